@@ -1,5 +1,6 @@
 import os
 import re
+import socket
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -35,6 +36,8 @@ API_ID = get_env_var("API_ID", "0", int)
 API_HASH = get_env_var("API_HASH", "")
 BOT_TOKEN = get_env_var("BOT_TOKEN", "")
 SESSION_NAME = get_env_var("SESSION_NAME", "tg_media_search_bot")
+# 用户客户端的会话名，同一会话只能在一个进程中运行，多个 worker 各自登录并设置不同的会话名
+USER_SESSION_NAME = get_env_var("USER_SESSION_NAME", f"{SESSION_NAME}_user")
 
 # 代理配置
 USE_PROXY = get_env_var("USE_PROXY", "False").lower() == "true"
@@ -47,7 +50,100 @@ PROXY_PASSWORD = get_env_var("PROXY_PASSWORD", "")
 # MongoDB 配置
 MONGODB_URI = get_env_var("MONGODB_URI", "mongodb://localhost:27017")
 DB_NAME = get_env_var("DB_NAME", "tg_media_search")
+# 连接池配置：整个进程共享一个客户端，多个机器人进程连接同一副本集时可按需调小
+MONGODB_MAX_POOL_SIZE = get_env_var("MONGODB_MAX_POOL_SIZE", "50", int)
+MONGODB_MIN_POOL_SIZE = get_env_var("MONGODB_MIN_POOL_SIZE", "0", int)
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = get_env_var("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000", int)
+MONGODB_CONNECT_TIMEOUT_MS = get_env_var("MONGODB_CONNECT_TIMEOUT_MS", "5000", int)
+MONGODB_SOCKET_TIMEOUT_MS = get_env_var("MONGODB_SOCKET_TIMEOUT_MS", "0", int)  # 0表示不限制
+MONGODB_READ_PREFERENCE = get_env_var("MONGODB_READ_PREFERENCE", "primary")  # 如 secondaryPreferred
+# 启动时自动创建索引；多进程部署时可关闭，改为运行 python3 -m app.migrate
+MONGODB_AUTO_INDEX = get_env_var("MONGODB_AUTO_INDEX", "True").lower() == "true"
 
 # 应用配置
 RESULTS_PER_PAGE = 10
 AUTO_DELETE_TIMEOUT = 10 * 60  # 10分钟，单位：秒
+SEARCH_CACHE_WINDOW = get_env_var("SEARCH_CACHE_WINDOW", "200", int)  # 每次搜索预取并缓存的结果键数量
+SEARCH_COUNT_CAP = get_env_var("SEARCH_COUNT_CAP", "1000", int)  # 结果计数上限，超过时显示为 "1000+"
+SEARCH_SESSION_MAX = get_env_var("SEARCH_SESSION_MAX", "5000", int)  # 内存中最多保留的搜索会话数（LRU淘汰）
+SEARCH_SESSION_PERSIST = get_env_var("SEARCH_SESSION_PERSIST", "True").lower() == "true"  # 搜索会话持久化到MongoDB，重启后分页按钮仍可用
+SEARCH_RANKING = get_env_var("SEARCH_RANKING", "True").lower() == "true"  # 按文件名相关度（BM25）和时间综合排序，关闭时只按时间排序
+SEARCH_RANK_CANDIDATES = get_env_var("SEARCH_RANK_CANDIDATES", "500", int)  # 参与相关度排序的最新候选数，更早的结果按时间排在其后
+SEARCH_RECENCY_WEIGHT = get_env_var("SEARCH_RECENCY_WEIGHT", "0.3", float)  # 时间得分在综合得分中的权重（0-1）
+SEARCH_RECENCY_HALF_LIFE_DAYS = get_env_var("SEARCH_RECENCY_HALF_LIFE_DAYS", "30", float)  # 时间得分的半衰期（天）
+FUZZY_SEARCH = get_env_var("FUZZY_SEARCH", "True").lower() == "true"  # 精确搜索结果过少时启用容错搜索
+# 精确结果少于该数量时补充容错搜索结果；合并时假定全部精确结果都在第一页中，因此不超过每页结果数
+FUZZY_MIN_RESULTS = min(get_env_var("FUZZY_MIN_RESULTS", "3", int), RESULTS_PER_PAGE)
+FUZZY_SCAN_LIMIT = get_env_var("FUZZY_SCAN_LIMIT", "5000", int)  # 容错搜索候选生成阶段最多检查的文档数
+FUZZY_MAX_RESULTS = get_env_var("FUZZY_MAX_RESULTS", "50", int)  # 容错搜索最多返回的结果数
+HOT_INDEX_ENABLED = get_env_var("HOT_INDEX_ENABLED", "True").lower() == "true"  # 在进程内存中为常用群组建立倒排索引，搜索不访问数据库
+HOT_INDEX_MAX_MB = get_env_var("HOT_INDEX_MAX_MB", "256", int)  # 内存索引上限（MB，估计值），超过时淘汰最久未搜索的群组
+HOT_INDEX_MAX_CHAT_DOCS = get_env_var("HOT_INDEX_MAX_CHAT_DOCS", "200000", int)  # 媒体文件数超过该值的群组不加载到内存
+QUERY_CACHE_ENABLED = get_env_var("QUERY_CACHE_ENABLED", "True").lower() == "true"  # 缓存各群组的首页搜索结果，群组有新写入时失效
+QUERY_CACHE_SIZE = get_env_var("QUERY_CACHE_SIZE", "5000", int)  # 最多缓存的搜索语句数（LRU淘汰）
+QUERY_CACHE_TTL = get_env_var("QUERY_CACHE_TTL", "600", int)  # 缓存结果的有效期（秒）
+QUERY_CACHE_WARM_TOP_K = get_env_var("QUERY_CACHE_WARM_TOP_K", "10", int)  # 启动时为每个群组预热的常用搜索数，0表示不预热
+QUERY_CACHE_WARM_CHATS = get_env_var("QUERY_CACHE_WARM_CHATS", "50", int)  # 启动时最多预热的群组数（按搜索次数）
+QUERY_STATS_FLUSH_INTERVAL = 60  # 搜索语句使用次数的批量写入间隔（秒）
+QUERY_STATS_RETENTION_DAYS = get_env_var("QUERY_STATS_RETENTION_DAYS", "30", int)  # 搜索语句使用次数的保留天数
+
+# 内联模式配置（需要在 BotFather 中使用 /setinline 开启）
+INLINE_RESULTS_PER_PAGE = get_env_var("INLINE_RESULTS_PER_PAGE", "20", int)  # 每次内联查询返回的结果数（Telegram上限50）
+INLINE_DEBOUNCE = get_env_var("INLINE_DEBOUNCE", "0.4", float)  # 同一用户连续输入时，等待该时间内没有新查询才执行搜索（秒）
+INLINE_CACHE_TTL = get_env_var("INLINE_CACHE_TTL", "60", int)  # 内联查询结果的缓存时间（秒）
+INLINE_MEMBERSHIP_TTL = get_env_var("INLINE_MEMBERSHIP_TTL", "600", int)  # 用户所在群组列表的缓存时间（秒）
+
+# 指标接口配置：在机器人的事件循环中提供 Prometheus 格式的 /metrics
+METRICS_ENABLED = get_env_var("METRICS_ENABLED", "True").lower() == "true"
+METRICS_HOST = get_env_var("METRICS_HOST", "127.0.0.1")  # 默认只监听本机，需要远程抓取时改为 0.0.0.0
+METRICS_PORT = get_env_var("METRICS_PORT", "9464", int)
+EVENT_LOOP_LAG_INTERVAL = get_env_var("EVENT_LOOP_LAG_INTERVAL", "0.5", float)  # 事件循环延迟的采样间隔（秒）
+
+# 历史索引流水线配置
+HISTORY_PAGE_SIZE = 100  # 每次 get_chat_history API 调用拉取的消息数（Telegram上限100）
+INDEX_BATCH_SIZE = get_env_var("INDEX_BATCH_SIZE", "500", int)  # 每次 bulk_write 的最大文档数
+INDEX_FLUSH_INTERVAL = get_env_var("INDEX_FLUSH_INTERVAL", "2", float)  # 未满批次的最长等待时间（秒）
+INDEX_STATS_INTERVAL = 10  # 输出各阶段吞吐量日志的间隔（秒）
+
+# 索引任务队列配置：多个群组并行索引，共用用户客户端的 API 速率预算
+INDEX_CONCURRENCY = get_env_var("INDEX_CONCURRENCY", "2", int)  # 同时进行的索引任务数
+INDEX_PROGRESS_INTERVAL = get_env_var("INDEX_PROGRESS_INTERVAL", "5", float)  # 进度消息的最短更新间隔（秒）
+
+# 部署模式：all 在一个进程中运行全部功能；frontend 只运行机器人前端（搜索和命令）；
+# worker 只运行索引（用户客户端、索引任务、实时消息写入），可以运行多个。
+# 前端和 worker 之间通过 MongoDB 的 index_jobs 集合传递任务，通过轮询 media_occurrences 同步新写入的文件
+RUN_MODE = get_env_var("RUN_MODE", "all").lower()
+WORKER_ID = get_env_var("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")  # worker 标识，用于领取任务和心跳
+JOB_POLL_INTERVAL = get_env_var("JOB_POLL_INTERVAL", "2", float)  # worker 空闲时检查任务队列的间隔（秒）
+JOB_HEARTBEAT_INTERVAL = get_env_var("JOB_HEARTBEAT_INTERVAL", "10", float)  # 进行中任务的心跳间隔（秒），同时检查任务是否已被取消
+JOB_HEARTBEAT_TIMEOUT = get_env_var("JOB_HEARTBEAT_TIMEOUT", "120", float)  # 心跳超时后任务可被其他 worker 重新领取（秒）
+CHANGE_FEED_INTERVAL = get_env_var("CHANGE_FEED_INTERVAL", "1", float)  # 前端轮询新写入文件的间隔（秒）
+CHANGE_FEED_LAG = get_env_var("CHANGE_FEED_LAG", "2", int)  # 只读取生成超过该时间的记录（秒），等待并发写入全部提交
+CHANGE_FEED_BATCH = 1000  # 每次轮询读取的最大记录数
+
+# 实时消息写入队列配置
+INGEST_QUEUE_SIZE = get_env_var("INGEST_QUEUE_SIZE", "5000", int)  # 队列容量，满时新消息的处理会等待（背压）
+INGEST_BATCH_SIZE = get_env_var("INGEST_BATCH_SIZE", "200", int)  # 每次批量写入的最大文档数
+INGEST_FLUSH_INTERVAL = get_env_var("INGEST_FLUSH_INTERVAL", "1", float)  # 未满批次的最长等待时间（秒）
+
+# 实时同步配置：用户客户端接收更新并检测消息ID缺口，只补拉缺失的区间
+LIVE_UPDATES = get_env_var("LIVE_UPDATES", "True").lower() == "true"  # 用户客户端接收新消息、编辑和删除更新；False 时只靠定期轮询
+LIVE_SYNC_POLL_INTERVAL = get_env_var("LIVE_SYNC_POLL_INTERVAL", "300", float)  # 检查没有收到更新的已索引群组是否有遗漏消息的间隔（秒）
+LIVE_SYNC_GAP_DELAY = get_env_var("LIVE_SYNC_GAP_DELAY", "5", float)  # 发现缺口后等待多久再补拉（秒），合并连续到达的更新
+LIVE_SYNC_CONCURRENCY = 2  # 同时补拉的群组数
+MEDIA_REMOVALS_TTL = 24 * 60 * 60  # media_removals 中删除记录的保留时间（秒），前端通过它同步删除
+
+# 索引校验配置：持续按批调用 get_messages 核对已索引的消息，移出已删除或被替换的文件
+RECONCILE_ENABLED = get_env_var("RECONCILE_ENABLED", "True").lower() == "true"
+RECONCILE_BATCH_SIZE = 200  # 每次 get_messages 校验的消息数（Telegram上限200）
+RECONCILE_INTERVAL = get_env_var("RECONCILE_INTERVAL", "3", float)  # 两次 get_messages 调用之间的最短间隔（秒），限制校验占用的 API 速率
+RECONCILE_PERIOD = get_env_var("RECONCILE_PERIOD", "86400", float)  # 同一群组两轮校验的最短间隔（秒）
+RECONCILE_LEASE = 300  # 校验租约时长（秒），多个 worker 不会同时校验同一群组
+RECONCILE_IDLE_INTERVAL = 60  # 没有需要校验的群组时，再次检查的间隔（秒）
+
+# 用户客户端 Telegram API 调度配置（令牌桶，根据 FloodWait 自适应）
+TG_RATE_INITIAL = get_env_var("TG_RATE_INITIAL", "2", float)  # 初始速率（次/秒）
+TG_RATE_MIN = get_env_var("TG_RATE_MIN", "0.2", float)  # 最低速率（次/秒）
+TG_RATE_MAX = get_env_var("TG_RATE_MAX", "20", float)  # 最高速率（次/秒）
+TG_RATE_BURST = get_env_var("TG_RATE_BURST", "5", int)  # 允许的突发调用数
+TG_FLOOD_MAX_RETRIES = get_env_var("TG_FLOOD_MAX_RETRIES", "3", int)  # 遇到FloodWait后的最大重试次数
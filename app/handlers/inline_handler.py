@@ -0,0 +1,241 @@
+import asyncio
+import calendar
+import logging
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pyrogram.enums import ChatMemberStatus, ParseMode
+from pyrogram.types import InlineQueryResultArticle, InputTextMessageContent
+from app.models.media_file import MediaFileModel, RESULT_PROJECTION
+from app.utils.pagination import Pagination
+from app.utils.query_parser import parse_query, QueryError
+from app.utils.ttl_cache import TTLCache
+from app.config.settings import (
+    INLINE_RESULTS_PER_PAGE, INLINE_DEBOUNCE, INLINE_CACHE_TTL, INLINE_MEMBERSHIP_TTL
+)
+
+logger = logging.getLogger(__name__)
+
+# 查询结果和成员关系缓存的最大条目数
+RESULT_CACHE_SIZE = 2000
+MEMBERSHIP_CACHE_SIZE = 10000
+# 已索引群组列表的刷新间隔（秒）
+INDEXED_CHATS_TTL = 300
+# 检查成员关系时的最大并发请求数
+MEMBERSHIP_CONCURRENCY = 5
+# 不算作群组成员的状态
+NOT_MEMBER_STATUSES = (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED)
+# 跨群组合并同一文件需要 file_unique_id
+INLINE_PROJECTION = dict(RESULT_PROJECTION, file_unique_id=1)
+
+def encode_offset(key):
+    """
+    将分页排序键编码为内联查询的 offset（Telegram 限制64字节）
+    
+    :param key: 排序键 (timestamp, _id)
+    :return: "毫秒时间戳:_id"
+    """
+    timestamp, doc_id = key
+    millis = calendar.timegm(timestamp.utctimetuple()) * 1000 + timestamp.microsecond // 1000
+    return f"{millis}:{doc_id}"
+
+def decode_offset(offset):
+    """
+    还原 encode_offset 生成的排序键
+    
+    :param offset: 内联查询的 offset
+    :return: 排序键，offset 为空或无效时返回None
+    """
+    try:
+        millis, doc_id = offset.split(":")
+        return (datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), ObjectId(doc_id))
+    except Exception:
+        return None
+
+class InlineSearchHandler:
+    def __init__(self, bot):
+        """
+        内联模式搜索：在任意聊天中输入 @机器人 关键词，搜索用户所在的全部已索引群组
+        
+        内联查询会随每次按键触发，因此：同一用户的首页查询先等待 INLINE_DEBOUNCE 秒，
+        期间有新查询则放弃旧查询；查询结果按 (群组集合, 查询, offset) 缓存；
+        用户所在的群组列表缓存 INLINE_MEMBERSHIP_TTL 秒，不会每次按键都调用 get_chat_member。
+        
+        :param bot: Pyrogram机器人客户端实例
+        """
+        self.bot = bot
+        self.db = MediaFileModel()
+        self.results = TTLCache(RESULT_CACHE_SIZE, INLINE_CACHE_TTL)
+        self.memberships = TTLCache(MEMBERSHIP_CACHE_SIZE, INLINE_MEMBERSHIP_TTL)
+        # 已索引的群组ID及其名称
+        self.chat_titles = {}
+        self._indexed_chats = []
+        self._indexed_chats_loaded = 0
+        # 用户ID -> 最新的内联查询ID，用于防抖
+        self._latest_queries = {}
+        # 用户ID -> 正在进行的成员关系检查，同一用户的并发查询共用一次检查
+        self._membership_tasks = {}
+        self._register_handlers()
+    
+    def _register_handlers(self):
+        """注册内联查询处理器"""
+        self.bot.on_inline_query()(self.handle_inline_query)
+    
+    async def handle_inline_query(self, client, inline_query):
+        """处理内联查询，按 offset 逐页返回结果"""
+        query = inline_query.query.strip()
+        user_id = inline_query.from_user.id
+        offset = inline_query.offset
+        
+        try:
+            if not query:
+                await inline_query.answer([], cache_time=INLINE_CACHE_TTL, is_personal=True)
+                return
+            
+            # 防抖：只处理用户停止输入后的最后一次首页查询，翻页请求不需要防抖
+            if not offset:
+                self._latest_queries[user_id] = inline_query.id
+                await asyncio.sleep(INLINE_DEBOUNCE)
+                if self._latest_queries.get(user_id) != inline_query.id:
+                    return
+                self._latest_queries.pop(user_id, None)
+            
+            chat_ids = await self._member_chats(user_id)
+            if not chat_ids:
+                await inline_query.answer(
+                    [], cache_time=INLINE_CACHE_TTL, is_personal=True,
+                    switch_pm_text="你所在的群组还没有索引媒体文件", switch_pm_parameter="help"
+                )
+                return
+            
+            key = (tuple(chat_ids), query, offset)
+            page = self.results.get(key)
+            if page is None:
+                page = await self._search(query, chat_ids, offset)
+                self.results.set(key, page)
+            docs, next_offset = page
+            
+            await inline_query.answer(
+                [self._to_result(doc) for doc in docs],
+                cache_time=INLINE_CACHE_TTL,
+                is_personal=True,
+                next_offset=next_offset
+            )
+        except QueryError as e:
+            await inline_query.answer(
+                [], cache_time=INLINE_CACHE_TTL, is_personal=True,
+                switch_pm_text=str(e)[:64], switch_pm_parameter="help"
+            )
+        except Exception as e:
+            logger.error(f"处理内联查询时出错: {str(e)}")
+    
+    async def _search(self, query, chat_ids, offset):
+        """
+        跨群组键集分页搜索
+        
+        :param query: 搜索语句
+        :param chat_ids: 用户所在的已索引群组ID列表
+        :param offset: 内联查询的 offset，首页为空
+        :return: (结果列表, 下一页的 offset)，没有下一页时 offset 为空字符串
+        """
+        parsed = parse_query(query)
+        if parsed.sender_username:
+            sender = await self.bot.get_users(parsed.sender_username)
+            parsed.set_sender(sender.id)
+        
+        after = decode_offset(offset) if offset else None
+        docs = await self.db.search_media_files(
+            parsed.keyword, chat_ids, after, INLINE_RESULTS_PER_PAGE, parsed.mongo_filters(), INLINE_PROJECTION
+        )
+        next_offset = encode_offset(self.db.sort_key(docs[-1])) if len(docs) == INLINE_RESULTS_PER_PAGE else ""
+        return self._collapse(docs), next_offset
+    
+    @staticmethod
+    def _collapse(docs):
+        """
+        合并同一页中在多个群组发布的同一文件，保留最新的一条并累计发布次数
+        
+        目录只在群组内去重，跨群组搜索时同一文件在每个群组各有一条文档
+        """
+        collapsed = {}
+        for doc in docs:
+            key = doc.get("file_unique_id") or doc["_id"]
+            if key in collapsed:
+                collapsed[key]["occurrences"] = collapsed[key].get("occurrences", 1) + doc.get("occurrences", 1)
+            else:
+                collapsed[key] = dict(doc)
+        return list(collapsed.values())
+    
+    def _to_result(self, doc):
+        """将媒体文件转换为内联结果，选中后发送跳转到原消息的链接"""
+        emoji = "🎵" if doc["media_type"] == "audio" else "🎬"
+        link = Pagination.message_link(doc["chat_id"], doc["message_id"])
+        chat_title = self.chat_titles.get(doc["chat_id"]) or str(doc["chat_id"])
+        return InlineQueryResultArticle(
+            title=f"{emoji} {doc['file_name']}",
+            input_message_content=InputTextMessageContent(
+                f"{emoji} [{doc['file_name']}]({link})",
+                parse_mode=ParseMode.MARKDOWN,
+                disable_web_page_preview=True
+            ),
+            id=str(doc["_id"]),
+            url=link,
+            description=f"{chat_title} · {doc['timestamp']:%Y-%m-%d}" + (
+                f" · 发布 {doc['occurrences']} 次" if doc.get("occurrences", 1) > 1 else ""
+            )
+        )
+    
+    async def _member_chats(self, user_id):
+        """
+        获取用户所在的已索引群组，结果缓存 INLINE_MEMBERSHIP_TTL 秒
+        
+        :param user_id: 用户ID
+        :return: 群组ID列表
+        """
+        chat_ids = self.memberships.get(user_id)
+        if chat_ids is not None:
+            return chat_ids
+        
+        task = self._membership_tasks.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._check_memberships(user_id))
+            self._membership_tasks[user_id] = task
+            task.add_done_callback(lambda _: self._membership_tasks.pop(user_id, None))
+        return await asyncio.shield(task)
+    
+    async def _check_memberships(self, user_id):
+        """逐个群组检查用户是否为成员，并写入缓存"""
+        semaphore = asyncio.Semaphore(MEMBERSHIP_CONCURRENCY)
+        
+        async def is_member(chat_id):
+            async with semaphore:
+                try:
+                    member = await self.bot.get_chat_member(chat_id, user_id)
+                    return member.status not in NOT_MEMBER_STATUSES
+                except Exception:
+                    # 不是成员（UserNotParticipant）或机器人已不在群组中
+                    return False
+        
+        chats = await self._get_indexed_chats()
+        checks = await asyncio.gather(*(is_member(chat_id) for chat_id in chats))
+        chat_ids = sorted(chat_id for chat_id, member in zip(chats, checks) if member)
+        self.memberships.set(user_id, chat_ids)
+        return chat_ids
+    
+    async def _get_indexed_chats(self):
+        """获取已索引的群组列表，定期刷新，并记录新群组的名称"""
+        if time.monotonic() - self._indexed_chats_loaded < INDEXED_CHATS_TTL:
+            return self._indexed_chats
+        
+        chat_ids = await self.db.indexed_chat_ids()
+        for chat_id in chat_ids:
+            if chat_id not in self.chat_titles:
+                try:
+                    self.chat_titles[chat_id] = (await self.bot.get_chat(chat_id)).title
+                except Exception as e:
+                    logger.debug(f"获取群组 {chat_id} 名称失败: {str(e)}")
+                    self.chat_titles[chat_id] = None
+        
+        self._indexed_chats = chat_ids
+        self._indexed_chats_loaded = time.monotonic()
+        return chat_ids
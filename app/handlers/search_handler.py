@@ -1,16 +1,35 @@
 import re
-import asyncio
+import time
 import logging
 from pyrogram import Client, filters
 from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from app.models.media_file import MediaFileModel
 from app.utils.pagination import Pagination
-from app.config.settings import RESULTS_PER_PAGE, AUTO_DELETE_TIMEOUT
+from app.utils.session_store import SearchSessionStore
+from app.utils.hot_index import HotIndex
+from app.utils.query_cache import QueryCache
+from app.utils.metrics import registry
+from app.utils.query_parser import parse_query, ParsedQuery, QueryError
+from app.utils.permissions import is_chat_admin
+from app.config.settings import (
+    RESULTS_PER_PAGE, SEARCH_CACHE_WINDOW, HOT_INDEX_ENABLED, QUERY_CACHE_ENABLED,
+    SEARCH_RANKING, SEARCH_RANK_CANDIDATES, FUZZY_SEARCH, FUZZY_MIN_RESULTS, SEARCH_COUNT_CAP
+)
 
 logger = logging.getLogger(__name__)
 
-# 存储活跃搜索的字典 {message_id: {"user_id": user_id, "query": query, "chat_id": chat_id}}
-active_searches = {}
+# 活跃搜索保存在 SearchSessionStore 中，以 (chat_id, message_id) 为键，会话数据为
+# {"user_id": user_id, "query": query, "keyword": keyword, "conditions": [condition], "chat_id": chat_id,
+#  "total": total, "capped": capped, "keys": [sort_key], "ranked": ranked, "tail": sort_key,
+#  "fuzzy": fuzzy, "cursors": {page: sort_key}}
+# keyword 和 conditions 是解析后的关键词和筛选条件（from:@user 已解析为用户ID）；
+# total 和 keys 是搜索会话缓存：结果总数（capped 表示达到计数上限）和预取窗口内结果的排序键，
+# ranked 为 True 时 keys 按相关度排序；tail 是窗口之后按时间分页的起点，窗口已包含全部结果时为None；
+# fuzzy 为 True 表示精确结果过少，keys 中补充了容错搜索的近似结果；
+# 会话随自动删除一起过期；cursors 保存缓存窗口之外每一页的起点，回调数据只携带页码
+
+# 相关度排序窗口取整页，窗口之后的页面从 tail 开始按时间分页
+RANK_WINDOW = max(SEARCH_RANK_CANDIDATES // RESULTS_PER_PAGE, 1) * RESULTS_PER_PAGE
 
 class SearchHandler:
     def __init__(self, bot):
@@ -21,8 +40,54 @@ class SearchHandler:
         """
         self.bot = bot
         self.db = MediaFileModel()
+        # 活跃搜索会话，到期时自动删除搜索结果消息
+        self.sessions = SearchSessionStore(self._delete_search_message)
+        # 翻页时搜索会话缓存的命中/未命中次数
+        self.cache_stats = {"hits": 0, "misses": 0}
+        # 进程内热点索引，群组未加载时回退到数据库
+        self.hot_index = HotIndex(self.db) if HOT_INDEX_ENABLED else None
+        # 热门搜索的首页结果缓存，群组有新写入时失效
+        self.query_cache = QueryCache() if QUERY_CACHE_ENABLED else None
+        # 按数据来源统计的搜索延迟（秒）
+        self.latency = {
+            source: registry.histogram("search_query_seconds", "首页搜索查询耗时，按数据来源区分", {"source": source})
+            for source in ("hot", "mongo", "fuzzy")
+        }
+        # /f 命令和翻页回调的分阶段耗时：查询、Telegram 回复/编辑和总耗时
+        self.command_latency = {
+            phase: registry.histogram("search_command_seconds", "/f 命令各阶段耗时", {"phase": phase})
+            for phase in ("query", "reply", "total")
+        }
+        self.page_latency = {
+            phase: registry.histogram("page_callback_seconds", "翻页回调各阶段耗时", {"phase": phase})
+            for phase in ("load", "edit", "total")
+        }
+        registry.gauge("active_searches", "未过期的搜索会话数", lambda: len(self.sessions))
+        if self.query_cache is not None:
+            registry.gauge("query_cache_hits_total", "首页结果缓存命中次数", lambda: self.query_cache.hits, kind="counter")
+            registry.gauge("query_cache_misses_total", "首页结果缓存未命中次数", lambda: self.query_cache.misses, kind="counter")
+            registry.gauge("query_cache_entries", "首页结果缓存条目数", lambda: len(self.query_cache))
         self._register_handlers()
     
+    async def start(self):
+        """启动会话过期调度，恢复重启前的搜索会话（需在机器人客户端启动后调用），在后台预热常用搜索"""
+        await self.sessions.start()
+        if self.query_cache is not None:
+            await self.query_cache.start(self._run_query)
+    
+    async def stop(self):
+        """停止会话过期调度，保存搜索语句的使用次数"""
+        await self.sessions.stop()
+        if self.query_cache is not None:
+            await self.query_cache.stop()
+    
+    def tracks(self, chat_id):
+        """是否有该群组的内存数据（内存索引或结果缓存），供 ChangeFeed 过滤不需要的写入"""
+        return bool(
+            (self.hot_index and self.hot_index.tracks(chat_id))
+            or (self.query_cache is not None and self.query_cache.tracks(chat_id))
+        )
+    
     def _register_handlers(self):
         """注册消息和回调处理器"""
         # 注册/f命令处理器
@@ -31,8 +96,11 @@ class SearchHandler:
         # 注册/help命令处理器
         self.bot.on_message(filters.command("help"))(self.handle_help_command)
         
+        # 注册/stats命令处理器（与 /index 相同，只在群组中由管理员使用）
+        self.bot.on_message(filters.command("stats") & filters.group)(self.handle_stats_command)
+        
         # 注册分页回调处理器
-        self.bot.on_callback_query(filters.regex(r"^page:(.+):(\d+)$"))(self.handle_page_callback)
+        self.bot.on_callback_query(filters.regex(r"^page:(\d+)$"))(self.handle_page_callback)
         
         # 注册关闭回调处理器
         self.bot.on_callback_query(filters.regex(r"^close$"))(self.handle_close_callback)
@@ -45,7 +113,10 @@ class SearchHandler:
             "**主要命令**：\n"
             "• `/f 关键词` - 搜索包含指定关键词的媒体文件\n"
             "• `/help` - 显示此帮助信息\n"
-            "• `/index` - 【仅管理员】索引群组历史媒体文件\n\n"
+            "• `/stats` - 【仅管理员】显示搜索统计\n"
+            "• `@机器人用户名 关键词` - 在任意聊天中搜索你所在的全部群组（内联模式）\n"
+            "• `/index` - 【仅管理员】索引群组历史媒体文件\n"
+            "• `/index status` / `/index cancel` - 【仅管理员】查看或取消索引任务\n\n"
             "**使用方法**：\n"
             "1. 首先，确保机器人拥有管理员权限\n"
             "2. 确保用户账号已加入此群组\n"
@@ -56,7 +127,10 @@ class SearchHandler:
             "7. 只有搜索发起者可以操作分页按钮\n"
             "8. 搜索结果将在10分钟后自动删除\n\n"
             "**提示**：\n"
-            "• 搜索是基于文件名进行的\n"
+            "• 搜索是基于文件名进行的，支持中文关键词的任意片段，如 `/f 杰伦`\n"
+            "• 关键词有拼写错误、几乎搜不到时，会自动补充近似结果\n"
+            "• 结果按相关度和时间综合排序，可附加筛选条件：`type:audio`、`type:video`、"
+            "`size>100MB`、`dur<5m`、`from:@用户名`，如 `/f 晴天 type:audio dur<5m`\n"
             "• 机器人会自动索引新上传的媒体文件\n"
             "• 历史媒体文件需要通过 `/index` 命令手动索引\n"
             "• 若没有搜索到结果，可能是文件名中不包含您搜索的关键词，或者历史文件尚未索引\n"
@@ -66,6 +140,10 @@ class SearchHandler:
     
     async def handle_search_command(self, client, message):
         """处理/f搜索命令"""
+        with self.command_latency["total"].time():
+            await self._search_command(message)
+    
+    async def _search_command(self, message):
         try:
             # 提取搜索关键词
             command_parts = message.text.split(maxsplit=1)
@@ -75,44 +153,67 @@ class SearchHandler:
             
             search_query = command_parts[1].strip()
             
-            # 获取搜索结果
-            total_results = self.db.count_search_results(search_query, message.chat.id)
+            # 分离关键词和筛选条件
+            try:
+                parsed = parse_query(search_query)
+            except QueryError as e:
+                await message.reply(f"⚠️ {str(e)}", quote=True)
+                return
+            
+            if parsed.sender_username:
+                try:
+                    sender = await self.bot.get_users(parsed.sender_username)
+                    parsed.set_sender(sender.id)
+                except Exception as e:
+                    logger.warning(f"解析用户名 @{parsed.sender_username} 失败: {str(e)}")
+                    await message.reply(f"⚠️ 找不到用户 @{parsed.sender_username}。", quote=True)
+                    return
+            
+            # 一次查询同时获取结果总数、第一页结果和结果窗口的排序键，
+            # 后续翻页直接从内存中取该页的ID；热门搜索直接使用缓存的首页结果
+            with self.command_latency["query"].time():
+                page = await self._cached_query(parsed, message.chat.id)
+            total_results = page["total"]
+            results = page["results"]
             
             if total_results == 0:
                 await message.reply(f"没有找到包含关键词 '{search_query}' 的媒体文件。", quote=True)
                 return
             
             # 初始化分页器
-            paginator = Pagination(total_results)
-            skip = paginator.get_skip()
-            
-            # 获取第一页结果
-            results = self.db.search_media_files(search_query, message.chat.id, skip, RESULTS_PER_PAGE)
+            paginator = Pagination(total_results, capped=page["capped"])
             
             # 格式化结果
-            result_text = Pagination.format_results(results, message.chat.id)
+            result_text = Pagination.format_results(results, message.chat.id, fuzzy=page.get("fuzzy", False))
             
             # 创建分页键盘
-            keyboard = paginator.get_pagination_keyboard(search_query, "page:{query}:{page}")
+            keyboard = paginator.get_pagination_keyboard(search_query, "page:{page}")
             
             # 发送结果
-            reply = await message.reply(
-                result_text,
-                quote=True,
-                reply_markup=keyboard,
-                disable_web_page_preview=True,
-                parse_mode="markdown"
-            )
+            with self.command_latency["reply"].time():
+                reply = await message.reply(
+                    result_text,
+                    quote=True,
+                    reply_markup=keyboard,
+                    disable_web_page_preview=True,
+                    parse_mode="markdown"
+                )
             
-            # 记录活跃搜索
-            active_searches[reply.id] = {
+            # 记录活跃搜索，并计划到期自动删除
+            await self.sessions.add(message.chat.id, reply.id, {
                 "user_id": message.from_user.id,
                 "query": search_query,
-                "chat_id": message.chat.id
-            }
-            
-            # 设置自动删除计时器
-            asyncio.create_task(self._schedule_delete(reply.id, message.chat.id, AUTO_DELETE_TIMEOUT))
+                "keyword": parsed.keyword,
+                "conditions": parsed.conditions,
+                "chat_id": message.chat.id,
+                "total": total_results,
+                "capped": page["capped"],
+                "keys": page["keys"],
+                "ranked": page["ranked"],
+                "tail": page["tail"],
+                "fuzzy": page.get("fuzzy", False),
+                "cursors": {}
+            })
             
         except Exception as e:
             logger.error(f"处理搜索命令时出错: {str(e)}")
@@ -120,47 +221,65 @@ class SearchHandler:
     
     async def handle_page_callback(self, client, callback_query):
         """处理分页回调"""
+        with self.page_latency["total"].time():
+            await self._page_callback(callback_query)
+    
+    async def _page_callback(self, callback_query):
         try:
             # 解析回调数据
-            match = re.match(r"^page:(.+):(\d+)$", callback_query.data)
-            search_query = match.group(1)
-            page = int(match.group(2))
+            match = re.match(r"^page:(\d+)$", callback_query.data)
+            page = int(match.group(1))
             message_id = callback_query.message.id
+            search = await self.sessions.get(callback_query.message.chat.id, message_id)
             
             # 检查是否是原始搜索者
-            if message_id not in active_searches:
+            if search is None:
                 await callback_query.answer("此搜索已过期。", show_alert=True)
                 return
                 
-            if callback_query.from_user.id != active_searches[message_id]["user_id"]:
+            if callback_query.from_user.id != search["user_id"]:
                 await callback_query.answer("只有搜索发起者可以操作分页。", show_alert=True)
                 return
             
-            chat_id = active_searches[message_id]["chat_id"]
+            chat_id = search["chat_id"]
+            search_query = search["query"]
+            
+            # 获取当前页结果
+            with self.page_latency["load"].time():
+                results = await self._load_page(search, page)
+            if results is None:
+                await callback_query.answer("页码无效，请重新搜索。", show_alert=True)
+                return
+            
+            # 计数达到上限时，翻到不满一页说明已到最后一页，此时可以得到准确总数
+            if search["capped"] and len(results) < RESULTS_PER_PAGE:
+                search["total"] = (page - 1) * RESULTS_PER_PAGE + len(results)
+                search["capped"] = False
             
-            # 获取结果总数
-            total_results = self.db.count_search_results(search_query, chat_id)
+            # 保存新记录的翻页起点和总数
+            await self.sessions.save(chat_id, message_id, search)
             
-            # 初始化分页器
-            paginator = Pagination(total_results, page)
-            skip = paginator.get_skip()
+            if not results and page > 1:
+                await callback_query.answer("已经是最后一页了。", show_alert=True)
+                return
             
-            # 获取当前页结果
-            results = self.db.search_media_files(search_query, chat_id, skip, RESULTS_PER_PAGE)
+            # 初始化分页器，结果总数直接使用缓存，不再重新计数
+            paginator = Pagination(search["total"], page, capped=search["capped"])
             
             # 格式化结果
-            result_text = Pagination.format_results(results, chat_id)
+            result_text = Pagination.format_results(results, chat_id, fuzzy=search.get("fuzzy", False))
             
             # 创建分页键盘
-            keyboard = paginator.get_pagination_keyboard(search_query, "page:{query}:{page}")
+            keyboard = paginator.get_pagination_keyboard(search_query, "page:{page}")
             
             # 更新消息
-            await callback_query.message.edit_text(
-                result_text,
-                reply_markup=keyboard,
-                disable_web_page_preview=True,
-                parse_mode="markdown"
-            )
+            with self.page_latency["edit"].time():
+                await callback_query.message.edit_text(
+                    result_text,
+                    reply_markup=keyboard,
+                    disable_web_page_preview=True,
+                    parse_mode="markdown"
+                )
             
             await callback_query.answer()
             
@@ -168,25 +287,211 @@ class SearchHandler:
             logger.error(f"处理分页回调时出错: {str(e)}")
             await callback_query.answer("操作失败，请重试。", show_alert=True)
     
+    async def _load_page(self, search, page):
+        """
+        获取搜索会话中指定页的结果
+        
+        页面落在缓存窗口内时，只按ID取回该页的文档；否则从该页起点做键集查询。
+        窗口中的文档在缓存之后被删除时，从窗口中去掉这些键并重新计数，页码和总数不会与实际结果错开。
+        
+        :param search: SearchSessionStore 中的搜索会话
+        :param page: 页码，从1开始
+        :return: 结果列表，页码没有已知起点时返回None
+        """
+        keys = search["keys"]
+        start = (page - 1) * RESULTS_PER_PAGE
+        end = start + RESULTS_PER_PAGE
+        # 没有 tail 说明窗口已包含全部结果
+        window_complete = search.get("tail") is None
+        keyword = search.get("keyword", search["query"])
+        filters = ParsedQuery(keyword, search.get("conditions")).mongo_filters()
+        
+        if start < len(keys) and (end <= len(keys) or window_complete):
+            self.cache_stats["hits"] += 1
+            ids = [key[1] for key in keys[start:end]]
+            results = self.hot_index.get_media_files_by_ids(search["chat_id"], ids) if self.hot_index else None
+            if results is None:
+                results = await self.db.get_media_files_by_ids(ids)
+            if len(results) < len(ids):
+                # 一次检查整个窗口，去掉全部已删除的键后重新取这一页
+                existing = {doc["_id"] async for doc in self.db.get_many([key[1] for key in keys], projection={"_id": 1})}
+                search["keys"] = [key for key in keys if key[1] in existing]
+                await self._recount(search, keyword, filters)
+                return await self._load_page(search, page)
+        else:
+            self.cache_stats["misses"] += 1
+            if 0 < start <= len(keys):
+                # 按相关度排序的窗口内顺序与时间无关，窗口之后从 tail 继续
+                after = search["tail"] if search.get("ranked") else keys[start - 1]
+            else:
+                after = search["cursors"].get(page)
+            if after is None:
+                return None
+            results = None
+            if self.hot_index:
+                results = self.hot_index.search_media_files(keyword, search["chat_id"], after, RESULTS_PER_PAGE, filters)
+            if results is None:
+                results = await self.db.search_media_files(keyword, search["chat_id"], after, RESULTS_PER_PAGE, filters)
+        
+        # 记录下一页的起点，供缓存窗口之外的翻页使用
+        if results:
+            search["cursors"][page + 1] = self.db.sort_key(results[-1])
+        
+        logger.debug(f"搜索会话缓存: 命中 {self.cache_stats['hits']} 次，未命中 {self.cache_stats['misses']} 次")
+        return results
+    
+    async def _recount(self, search, keyword, filters):
+        """
+        重新计算搜索会话的结果总数
+        
+        窗口已包含全部结果时（包括补充了容错结果的搜索）总数就是窗口大小，否则按当前数据计数，最多统计到计数上限
+        
+        :param search: SearchSessionStore 中的搜索会话
+        :param keyword: 搜索关键词
+        :param filters: 筛选条件
+        """
+        if search.get("tail") is None:
+            search["total"] = len(search["keys"])
+            search["capped"] = False
+            return
+        total = await self.db.count_search_results(keyword, search["chat_id"], filters, limit=SEARCH_COUNT_CAP + 1)
+        search["total"] = min(total, SEARCH_COUNT_CAP)
+        search["capped"] = total > SEARCH_COUNT_CAP
+    
+    async def _cached_query(self, parsed, chat_id):
+        """
+        获取首页结果，优先使用结果缓存
+        
+        :param parsed: 解析后的搜索语句
+        :param chat_id: 群组ID
+        :return: 首页结果
+        """
+        if self.query_cache is None:
+            return await self._run_query(parsed, chat_id)
+        
+        page = self.query_cache.get(chat_id, parsed)
+        if page is None:
+            # 版本号在查询之前获取，查询期间有新写入时不缓存可能过时的结果
+            version = self.query_cache.version(chat_id)
+            page = await self._run_query(parsed, chat_id)
+            self.query_cache.set(chat_id, parsed, page, version)
+        return page
+    
+    async def _run_query(self, parsed, chat_id):
+        """
+        执行搜索：精确结果过少时（如关键词有拼写错误），补充容错搜索的近似结果
+        
+        :param parsed: 解析后的搜索语句
+        :param chat_id: 群组ID
+        :return: 首页结果
+        """
+        page = await self._search_page(parsed, chat_id)
+        if FUZZY_SEARCH and parsed.keyword and page["total"] < FUZZY_MIN_RESULTS:
+            page = await self._add_fuzzy_results(page, parsed, chat_id)
+        return page
+    
+    async def _search_page(self, parsed, chat_id):
+        """
+        获取首页结果，优先使用内存索引，群组未加载时查询数据库
+        
+        :param parsed: 解析后的搜索语句
+        :param chat_id: 群组ID
+        :return: 与 MediaFileModel.search_page 相同格式的结果
+        """
+        window = RANK_WINDOW if SEARCH_RANKING else SEARCH_CACHE_WINDOW
+        options = {"filters": parsed.mongo_filters(), "ranked": SEARCH_RANKING}
+        
+        started = time.perf_counter()
+        page = None
+        if self.hot_index:
+            page = self.hot_index.search_page(parsed.keyword, chat_id, RESULTS_PER_PAGE, window, **options)
+        source = "hot"
+        if page is None:
+            source = "mongo"
+            page = await self.db.search_page(parsed.keyword, chat_id, RESULTS_PER_PAGE, window, **options)
+        self.latency[source].observe(time.perf_counter() - started)
+        return page
+    
+    async def _add_fuzzy_results(self, page, parsed, chat_id):
+        """
+        在精确结果之后补充容错搜索结果
+        
+        精确结果少于 FUZZY_MIN_RESULTS 时都在第一页中，合并后的全部结果放入 keys，
+        翻页直接按ID取回，不需要 tail。
+        
+        :param page: 精确搜索的首页结果
+        :param parsed: 解析后的搜索语句
+        :param chat_id: 群组ID
+        :return: 合并后的首页结果，没有近似结果时返回原结果
+        """
+        with self.latency["fuzzy"].time():
+            fuzzy = await self.db.fuzzy_search(parsed.keyword, chat_id, parsed.mongo_filters())
+        
+        exact_ids = {doc["_id"] for doc in page["results"]}
+        extra = [doc for doc in fuzzy if doc["_id"] not in exact_ids]
+        if not extra:
+            return page
+        
+        merged = page["results"] + extra
+        return {
+            "total": len(merged),
+            "capped": False,
+            "results": merged[:RESULTS_PER_PAGE],
+            "keys": [self.db.sort_key(doc) for doc in merged],
+            "ranked": True,
+            "tail": None,
+            "fuzzy": True
+        }
+    
+    def stats_text(self):
+        """生成搜索统计文本：内存索引和结果缓存的命中率、各来源的延迟分布和会话缓存命中情况"""
+        lines = ["📊 **搜索统计**"]
+        if self.hot_index:
+            stats = self.hot_index.stats()
+            lines.append(
+                f"内存索引：{stats['chats']} 个群组，{stats['docs']} 个文件，约 {stats['bytes'] / 1024 / 1024:.1f}MB，"
+                f"命中率 {stats['hit_ratio']:.1%}（{stats['hits']}/{stats['hits'] + stats['misses']}）"
+            )
+        if self.query_cache is not None:
+            cache = self.query_cache
+            lines.append(
+                f"结果缓存：{len(cache)} 条，命中率 {cache.hit_ratio:.1%}（{cache.hits}/{cache.hits + cache.misses}），"
+                f"启动预热 {cache.warmed} 条"
+            )
+        for source, histogram in self.latency.items():
+            lines.append(f"{source} 延迟：{histogram.summary()}")
+        lines.append(f"/f 总耗时：{self.command_latency['total'].summary()}")
+        lines.append(f"翻页总耗时：{self.page_latency['total'].summary()}")
+        lines.append(f"翻页缓存：命中 {self.cache_stats['hits']} 次，未命中 {self.cache_stats['misses']} 次")
+        return "\n".join(lines)
+    
+    async def handle_stats_command(self, client, message):
+        """处理/stats命令，显示搜索统计（仅群组管理员可用）"""
+        if not await is_chat_admin(message):
+            await message.reply("⚠️ 只有群组管理员可以查看搜索统计。", quote=True)
+            return
+        await message.reply(self.stats_text(), quote=True)
+    
     async def handle_close_callback(self, client, callback_query):
         """处理关闭回调"""
         try:
             message_id = callback_query.message.id
+            chat_id = callback_query.message.chat.id
+            search = await self.sessions.get(chat_id, message_id)
             
             # 检查是否是原始搜索者
-            if message_id not in active_searches:
+            if search is None:
                 await callback_query.answer("此搜索已过期。", show_alert=True)
                 return
                 
-            if callback_query.from_user.id != active_searches[message_id]["user_id"]:
+            if callback_query.from_user.id != search["user_id"]:
                 await callback_query.answer("只有搜索发起者可以关闭搜索。", show_alert=True)
                 return
             
             # 删除搜索结果
             await callback_query.message.delete()
             # 清理活跃搜索记录
-            if message_id in active_searches:
-                del active_searches[message_id]
+            await self.sessions.remove(chat_id, message_id)
                 
             await callback_query.answer("搜索已关闭。")
             
@@ -194,21 +499,15 @@ class SearchHandler:
             logger.error(f"处理关闭回调时出错: {str(e)}")
             await callback_query.answer("关闭失败，请重试。", show_alert=True)
     
-    async def _schedule_delete(self, message_id, chat_id, timeout):
+    async def _delete_search_message(self, chat_id, message_id):
         """
-        安排自动删除消息
+        搜索会话到期时自动删除搜索结果消息
         
-        :param message_id: 消息ID
         :param chat_id: 聊天ID
-        :param timeout: 超时时间（秒）
+        :param message_id: 消息ID
         """
-        await asyncio.sleep(timeout)
-        
-        # 如果消息ID仍在活跃搜索中，则删除
-        if message_id in active_searches:
-            try:
-                await self.bot.delete_messages(chat_id, message_id)
-                del active_searches[message_id]
-                logger.info(f"自动删除了消息ID: {message_id}")
-            except Exception as e:
-                logger.error(f"自动删除消息时出错: {str(e)}")
+        try:
+            await self.bot.delete_messages(chat_id, message_id)
+            logger.info(f"自动删除了消息ID: {message_id}")
+        except Exception as e:
+            logger.error(f"自动删除消息时出错: {str(e)}")
@@ -1,17 +1,27 @@
-import os
 import logging
 import asyncio
-from pyrogram import Client, filters, idle
+from pyrogram import filters, idle
 from pyrogram.handlers import MessageHandler
 from pyrogram.enums import ChatType
 from pyrogram.types import Chat, User, ChatMember
 from app.config.settings import (
-    API_ID, API_HASH, BOT_TOKEN, SESSION_NAME,
-    USE_PROXY, PROXY_TYPE, PROXY_HOST, PROXY_PORT, PROXY_USERNAME, PROXY_PASSWORD
+    RUN_MODE, MONGODB_AUTO_INDEX, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, EVENT_LOOP_LAG_INTERVAL,
+    RECONCILE_ENABLED, USER_SESSION_NAME
 )
 from app.handlers.search_handler import SearchHandler
+from app.handlers.inline_handler import InlineSearchHandler
 from app.utils.indexing import MediaIndexer
-import platform
+from app.utils.live_sync import LiveSync
+from app.utils.reconciler import Reconciler
+from app.utils.index_jobs import IndexJobManager, IndexJobQueue
+from app.utils.change_feed import ChangeFeed
+from app.utils.session_lease import SessionLease
+from app.utils.permissions import is_chat_admin
+from app.utils.telegram_scheduler import TelegramScheduler, INTERACTIVE
+from app.utils.metrics import registry, MetricsServer, EventLoopMonitor
+from app.utils.clients import (
+    check_credentials, build_proxy, create_user_client, create_bot_client, register_client_metrics
+)
 
 # 配置日志 - 只保留重要日志
 logging.basicConfig(
@@ -21,91 +31,86 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class MediaSearchBot:
-    def __init__(self):
-        """初始化媒体搜索机器人 - 使用双客户端架构"""
-        logger.info("初始化媒体搜索机器人")
-        
-        # 检查必要环境变量
-        if not API_ID or not API_HASH or not BOT_TOKEN:
-            raise ValueError("缺少必要的API凭据，请检查.env文件")
-        
-        # 配置代理（如果启用）
-        proxy = None
-        if USE_PROXY:
-            proxy = {
-                "scheme": PROXY_TYPE,
-                "hostname": PROXY_HOST,
-                "port": PROXY_PORT
-            }
-            
-            if PROXY_USERNAME and PROXY_PASSWORD:
-                proxy["username"] = PROXY_USERNAME
-                proxy["password"] = PROXY_PASSWORD
-                
-            logger.info(f"已配置{PROXY_TYPE}代理")
-        
-        # 设备标识参数 - 非常重要
-        # 这些参数确保客户端被识别为独立设备，不会干扰其他设备的会话
-        # 即使在程序退出后重新启动，也会使用相同标识
-        device_model = "TgMediaSearchBot"  # 固定标识，避免随机命名
-        system_version = platform.system()  # 系统类型
-        app_version = "1.0.0"              # 应用版本
+    def __init__(self, frontend_only=False):
+        """
+        初始化媒体搜索机器人 - 使用双客户端架构
         
-        # 检查会话文件
-        user_session_path = f"{SESSION_NAME}_user.session"
-        if not os.path.isfile(user_session_path):
-            logger.warning(f"未找到用户会话文件: {user_session_path}")
-            logger.warning("请先运行 'python3 auth_user.py' 创建会话文件")
-        
-        # 创建用户客户端 - 用于索引历史消息
-        # 关键: 保持与auth_user.py中相同的设备标识参数，确保认为是同一设备
-        self.user = Client(
-            name=SESSION_NAME + "_user",  # 与auth_user.py中相同
-            workdir="./",                 # 确保会话文件路径一致 
-            api_id=API_ID,
-            api_hash=API_HASH,
-            proxy=proxy,
-            device_model=device_model,    # 与用户认证保持一致
-            system_version=system_version,
-            app_version=app_version,
-            in_memory=False,              # 文件存储会话
-            no_updates=True,              # 不接收更新，只用于API调用
-            allow_flooded=True            # 允许在短时间内发送大量请求（适用于索引功能）
-        )
+        :param frontend_only: 只运行机器人前端（RUN_MODE=frontend），不创建用户客户端，
+                              /index 任务写入任务队列，由 worker 进程（app.worker）执行
+        """
+        logger.info("初始化媒体搜索机器人" + ("（前端模式）" if frontend_only else ""))
+        check_credentials()
+        self.frontend_only = frontend_only
+        proxy = build_proxy()
         
         # 创建机器人客户端 - 用于处理搜索命令
-        bot_device_model = f"{device_model}_Bot"  # 区分机器人和用户客户端
-        self.bot = Client(
-            name=SESSION_NAME + "_bot",
-            workdir="./",
-            api_id=API_ID,
-            api_hash=API_HASH,
-            proxy=proxy,
-            device_model=bot_device_model,  # 与用户客户端区分
-            system_version=system_version,
-            app_version=app_version,
-            bot_token=BOT_TOKEN
-        )
-        
-        # 初始化媒体索引器和搜索处理器
-        self.indexer = MediaIndexer(self.user)
+        self.bot = create_bot_client(proxy)
         self.search_handler = SearchHandler(self.bot)
+        # 内联模式：在任意聊天中搜索用户所在的全部已索引群组
+        self.inline_handler = InlineSearchHandler(self.bot)
+        
+        if frontend_only:
+            self.user = None
+            self.user_scheduler = None
+            self.session_lease = None
+            self.indexer = None
+            self.live_sync = None
+            self.reconciler = None
+            # 任务只写入 index_jobs 集合，由 worker 进程领取
+            self.index_jobs = IndexJobQueue(self.bot)
+            # 新文件由 worker 写入，通过轮询同步到内存索引和结果缓存
+            search_handler = self.search_handler
+            has_memory_state = search_handler.hot_index is not None or search_handler.query_cache is not None
+            self.change_feed = ChangeFeed(interested=search_handler.tracks) if has_memory_state else None
+        else:
+            # 创建用户客户端 - 用于索引历史消息
+            self.user = create_user_client(proxy)
+            # 同一用户会话只能在一个进程中运行（与 worker 共用时启动失败）
+            self.session_lease = SessionLease(USER_SESSION_NAME)
+            # 用户客户端的所有 API 调用共用一个调度器：令牌桶限速，交互调用优先于批量索引
+            self.user_scheduler = TelegramScheduler()
+            self.indexer = MediaIndexer(self.user, self.user_scheduler)
+            # 新消息、编辑和删除的实时同步，缺失的消息按检查点补拉
+            self.live_sync = LiveSync(self.indexer)
+            # 持续校验已索引的消息，移出实时同步遗漏的删除
+            self.reconciler = Reconciler(self.indexer) if RECONCILE_ENABLED else None
+            # 索引任务队列，多个群组并行索引时共用 user_scheduler 的速率预算
+            self.index_jobs = IndexJobManager(self.indexer, self.bot)
+            self.change_feed = None
+        
+        # Prometheus 指标接口和事件循环延迟监控，与机器人运行在同一个事件循环中
+        self.metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_ENABLED else None
+        self.loop_monitor = EventLoopMonitor(EVENT_LOOP_LAG_INTERVAL) if METRICS_ENABLED else None
+        self._register_metrics()
         
         # 注册事件处理器
         self._register_handlers()
     
+    def _register_metrics(self):
+        """注册各组件的状态指标，取值函数只在抓取时调用"""
+        register_client_metrics(self.user_scheduler)
+        
+        if not self.frontend_only:
+            registry.gauge("ingest_queue_size", "实时写入队列中等待写入的媒体文件数", lambda: len(self.indexer.ingest_queue))
+            registry.gauge("index_jobs_active", "排队和进行中的索引任务数", lambda: len(self.index_jobs))
+        if self.change_feed:
+            registry.gauge(
+                "change_feed_events_total", "从其他进程同步的目录文档变化数",
+                lambda: self.change_feed.events, kind="counter"
+            )
+        hot_index = self.search_handler.hot_index
+        if hot_index:
+            registry.gauge("hot_index_bytes", "内存索引占用（字节，估计值）", lambda: hot_index.nbytes)
+            registry.gauge("hot_index_chats", "已加载到内存索引的群组数", lambda: len(hot_index.chats))
+    
     def _register_handlers(self):
         """注册事件处理器"""
-        # 用户客户端 - 处理新媒体文件
-        try:
-            self.user.add_handler(
-                MessageHandler(
-                    self._handle_new_message,
-                    filters.media & filters.group
-                )
-            )
-        except Exception as e:
-            logger.error(f"注册用户客户端处理器失败: {e}")
+        # 用户客户端 - 处理新消息、编辑和删除
+        if self.user is not None:
+            try:
+                self.live_sync.register(self.user)
+            except Exception as e:
+                logger.error(f"注册用户客户端处理器失败: {e}")
         
         # 机器人客户端 - 处理命令
         try:
@@ -128,90 +133,66 @@ class MediaSearchBot:
             logger.error(f"注册机器人处理器失败: {e}")
             raise
     
-    async def _handle_new_message(self, client, message):
-        """处理新消息，将媒体文件添加到索引"""
-        await self.indexer.process_new_message(message)
-    
     async def _handle_index_command(self, client, message):
-        """处理索引命令，开始检索群组历史媒体文件"""
-        # 检查命令发送者是否有管理员权限
-        is_admin = False
-        user_id = message.from_user.id
+        """
+        处理索引命令
         
-        try:
-            # 获取用户在群组中的详细信息
-            chat = message.chat
-            user = await chat.get_member(user_id)
-            
-            # 检查用户状态 - 使用正确的状态值: owner(群主)和administrator(管理员)
-            if hasattr(user, 'status'):
-                if isinstance(user.status, str):
-                    is_admin = user.status in ["owner", "administrator"]
-                elif hasattr(user.status, 'value'):
-                    status_value = user.status.value
-                    is_admin = status_value in ["owner", "administrator", "creator", 1, 2]
-            
-            # 对于Pyrogram API，使用ChatMember类的特殊检查
-            if hasattr(user, '__class__'):
-                class_name = str(user.__class__)
-                owner_check = any(owner_term in class_name for owner_term in ['ChatMemberOwner', 'ChannelParticipantCreator'])
-                admin_check = any(admin_term in class_name for admin_term in ['ChatMemberAdministrator', 'ChannelParticipantAdmin'])
-                is_admin = is_admin or owner_check or admin_check
-                
-        except Exception as e:
-            logger.error(f"检查用户权限时出错: {str(e)}")
-        
-        if not is_admin:
+        /index 将群组加入索引队列，/index status 查看进度，/index cancel 取消索引
+        """
+        # 检查命令发送者是否有管理员权限
+        if not await is_chat_admin(message):
             await message.reply("⚠️ 只有群组管理员可以使用索引命令。", quote=True)
             return
         
         chat_id = message.chat.id
         chat_title = message.chat.title
+        subcommand = message.command[1].lower() if len(message.command) > 1 else None
         
-        # 检查用户客户端是否已经登录
-        if not self.user.is_connected:
-            await message.reply(
-                "⚠️ 用户客户端未连接，无法执行索引。请确保已正确配置用户账号。", 
-                quote=True
-            )
+        if subcommand == "status":
+            await message.reply(await self.index_jobs.status_text(chat_id), quote=True)
             return
         
-        # 检查用户客户端是否有权限访问该群组
-        try:
-            # 使用用户客户端获取群组信息来验证访问权限
-            chat = await self.user.get_chat(chat_id)
-            logger.info(f"开始索引群组: {chat.title}")
-        except Exception as e:
-            logger.error(f"用户客户端无法访问群组: {str(e)}")
-            await message.reply(
-                "⚠️ 索引失败：用户客户端无法访问此群组。请确保用户账号已加入此群组。", 
-                quote=True
-            )
+        if subcommand == "cancel":
+            if not await self.index_jobs.cancel(chat_id):
+                await message.reply("ℹ️ 该群组没有进行中的索引任务。", quote=True)
+            return
+        
+        if await self.index_jobs.has_active(chat_id):
+            await message.reply("⏳ 该群组的索引任务已在进行中，使用 `/index status` 查看进度。", quote=True)
             return
+        
+        # 前端模式下没有用户客户端，访问权限由 worker 在执行任务时检查，失败会显示在进度消息中
+        if self.user is not None:
+            # 检查用户客户端是否已经登录
+            if not self.user.is_connected:
+                await message.reply(
+                    "⚠️ 用户客户端未连接，无法执行索引。请确保已正确配置用户账号。", 
+                    quote=True
+                )
+                return
+            
+            # 检查用户客户端是否有权限访问该群组
+            try:
+                # 使用用户客户端获取群组信息来验证访问权限
+                chat = await self.user_scheduler.call(self.user.get_chat, chat_id, priority=INTERACTIVE)
+                logger.info(f"开始索引群组: {chat.title}")
+            except Exception as e:
+                logger.error(f"用户客户端无法访问群组: {str(e)}")
+                await message.reply(
+                    "⚠️ 索引失败：用户客户端无法访问此群组。请确保用户账号已加入此群组。", 
+                    quote=True
+                )
+                return
                 
-        # 发送开始索引消息
+        # 发送排队消息，任务开始后由 IndexJobManager 更新为进度
+        pending = await self.index_jobs.queued()
         indexing_msg = await message.reply(
-            f"🔍 开始索引群组 '{chat_title}' 的历史媒体文件...\n"
-            f"这可能需要一些时间，取决于群组大小和历史消息数量。", 
+            f"🕒 已将群组 '{chat_title}' 加入索引队列"
+            + (f"，前面还有 {pending} 个群组。" if pending else "。")
+            + "\n使用 `/index status` 查看进度，`/index cancel` 取消索引。",
             quote=True
         )
-        
-        try:
-            # 启动索引过程
-            count = await self.indexer.index_chat_history(chat_id)
-            
-            # 更新索引完成消息
-            await indexing_msg.edit_text(
-                f"✅ 索引完成！已为群组 '{chat_title}' 索引了 {count} 个媒体文件。\n\n"
-                f"使用 `/f 关键词` 来搜索文件。\n"
-                f"使用 `/help` 获取更多帮助。"
-            )
-        except Exception as e:
-            logger.error(f"索引失败: {str(e)}")
-            await indexing_msg.edit_text(
-                f"❌ 索引过程出错: {str(e)}\n\n"
-                f"此错误可能是因为用户客户端权限不足或其他限制导致。"
-            )
+        await self.index_jobs.submit(chat_id, chat_title, message.from_user.id, indexing_msg)
     
     async def _handle_new_chat(self, client, message):
         """处理加入新群组的事件"""
@@ -225,7 +206,6 @@ class MediaSearchBot:
         if not added_me:
             return
         
-        chat_id = message.chat.id
         chat_title = message.chat.title
         
         logger.info(f"机器人被添加到群组: {chat_title}")
@@ -242,21 +222,47 @@ class MediaSearchBot:
     
     async def start(self):
         """启动机器人 - 包括用户客户端和机器人客户端"""
+        # 创建数据库索引 - 异步驱动需要在事件循环中执行
+        # 索引器和搜索处理器共享同一个连接池和集合，进程内只创建一次；
+        # 关闭 MONGODB_AUTO_INDEX 时由 python3 -m app.migrate 负责创建
+        if MONGODB_AUTO_INDEX:
+            try:
+                await self.search_handler.db.ensure_indexes()
+            except Exception as e:
+                logger.error(f"创建数据库索引失败: {str(e)}")
+                raise
+        
+        # 启动实时消息的后台写入队列；前端模式下改为同步其他进程写入的文件
+        if self.indexer:
+            self.indexer.start()
+        if self.change_feed:
+            self.change_feed.start()
+        
+        # 启动指标接口，端口被占用等错误不影响机器人运行
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"启动指标接口失败: {str(e)}")
+            self.loop_monitor.start()
+        
         # 先启动用户客户端
         user_connected = False
         
-        try:
-            logger.info("正在启动用户客户端...")
-            # 重要：这里的start()不会要求重新登录
-            # 如果会话文件有效，它会自动恢复会话而不是请求手机号和验证码
-            # 这不是重复登录，而是利用auth_user.py已经创建的会话凭证
-            await self.user.start()
-            user_connected = True
-            user_info = await self.user.get_me()
-            logger.info(f"用户客户端已启动: {user_info.first_name}")
-        except Exception as e:
-            logger.error(f"启动用户客户端失败: {str(e)}")
-            logger.info("继续启动机器人客户端...")
+        if self.user is not None:
+            try:
+                logger.info("正在启动用户客户端...")
+                # 重要：这里的start()不会要求重新登录
+                # 如果会话文件有效，它会自动恢复会话而不是请求手机号和验证码
+                # 这不是重复登录，而是利用auth_user.py已经创建的会话凭证
+                await self.session_lease.acquire()
+                await self.user.start()
+                user_connected = True
+                user_info = await self.user_scheduler.call(self.user.get_me, priority=INTERACTIVE)
+                logger.info(f"用户客户端已启动: {user_info.first_name}")
+            except Exception as e:
+                logger.error(f"启动用户客户端失败: {str(e)}")
+                logger.info("继续启动机器人客户端...")
         
         # 然后启动机器人客户端
         try:
@@ -265,11 +271,25 @@ class MediaSearchBot:
             bot_info = await self.bot.get_me()
             logger.info(f"机器人客户端已启动: @{bot_info.username}")
             
+            # 恢复搜索会话并启动自动删除调度
+            await self.search_handler.start()
+            
+            # 恢复未完成的索引任务，需要用户客户端才能拉取历史；前端模式只提交任务
+            if user_connected or self.frontend_only:
+                await self.index_jobs.start()
+            # 补拉已索引群组停机期间的消息，之后按更新检测缺口
+            if user_connected:
+                self.live_sync.start()
+                if self.reconciler:
+                    self.reconciler.start()
+            
             # 打印启动信息
             print(f"\n{'='*30}")
             print(f"媒体搜索机器人已启动!")
             print(f"机器人: @{bot_info.username}")
-            if user_connected:
+            if self.frontend_only:
+                print("前端模式: 历史消息索引由 worker 进程执行")
+            elif user_connected:
                 print(f"历史消息索引功能已启用")
             else:
                 print(f"警告: 历史消息索引功能未启用")
@@ -285,6 +305,12 @@ class MediaSearchBot:
     async def stop(self):
         """停止机器人 - 只关闭当前连接，不会影响其他设备会话"""
         try:
+            # 停止搜索会话调度，未到期的会话已持久化，重启后恢复
+            await self.search_handler.stop()
+            
+            # 停止索引任务，进行中的任务已保存检查点，重启后继续
+            await self.index_jobs.stop()
+            
             # 关闭机器人客户端
             await self.bot.stop()
             logger.info("机器人客户端已停止")
@@ -292,14 +318,40 @@ class MediaSearchBot:
             # 关闭用户客户端
             # 注意: stop()方法只会关闭当前连接，不会撤销会话凭证
             # 这确保下次启动时可以无缝恢复会话，也不会影响其他设备
-            await self.user.stop()
-            logger.info("用户客户端已停止")
+            if self.user is not None:
+                if self.user.is_connected:
+                    await self.user.stop()
+                    logger.info("用户客户端已停止")
+                await self.session_lease.release()
         except Exception as e:
             logger.error(f"停止客户端时出错: {str(e)}")
+        
+        # 用户客户端停止后不会再有新消息入队，保存实时同步的检查点，写入队列中剩余的媒体文件
+        if self.indexer:
+            try:
+                await self.live_sync.stop()
+                if self.reconciler:
+                    await self.reconciler.stop()
+                await self.indexer.stop()
+            except Exception as e:
+                logger.error(f"写入剩余媒体文件时出错: {str(e)}")
+        if self.change_feed:
+            await self.change_feed.stop()
+        
+        if self.metrics_server:
+            await self.loop_monitor.stop()
+            await self.metrics_server.stop()
 
 async def main():
-    """主函数"""
-    bot = MediaSearchBot()
+    """主函数，按 RUN_MODE 启动完整机器人、前端或索引 worker"""
+    if RUN_MODE == "worker":
+        from app.worker import IndexWorker
+        bot = IndexWorker()
+    elif RUN_MODE in ("all", "frontend"):
+        bot = MediaSearchBot(frontend_only=RUN_MODE == "frontend")
+    else:
+        raise ValueError(f"未知的 RUN_MODE: {RUN_MODE}，可选 all、frontend、worker")
+    
     try:
         await bot.start()
     except KeyboardInterrupt:
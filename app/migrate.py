@@ -0,0 +1,199 @@
+import asyncio
+import logging
+from pymongo import UpdateOne, DeleteMany
+from pyrogram.file_id import FileId, FileUniqueId, FileUniqueType
+from app.models.media_file import MediaFileModel, OCCURRENCE_FIELDS
+from app.utils.tokenizer import build_search_tokens, build_fuzzy_grams
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# 旧版本创建、已被替换的索引名称
+LEGACY_INDEXES = [
+    "file_name_text",  # $text 索引，已被 search_tokens 替代
+    "chat_id_1_search_tokens_1_timestamp_-1",  # 不含 _id，无法支持键集分页
+    "chat_id_1_media_type_1_timestamp_-1__id_-1",  # 不含结果字段，无法覆盖查询
+    "chat_id_1_sender_id_1_timestamp_-1__id_-1",
+]
+
+# 目录唯一索引 (chat_id, file_unique_id) 的名称
+CATALOGUE_INDEX = "chat_id_1_file_unique_id_1"
+
+# 目录文档不再保存的字段：file_id 只对索引所用的账号有效，indexed_at 与 _id 中的时间戳重复
+DROPPED_FIELDS = ("file_id", "indexed_at")
+
+# 由文件名派生的字段及其生成函数
+DERIVED_FIELDS = {
+    "search_tokens": build_search_tokens,
+    "trigrams": build_fuzzy_grams,
+}
+
+async def backfill_derived_fields(db, batch_size=1000):
+    """
+    为缺少 search_tokens 或 trigrams 字段的历史文档补充由文件名派生的字段
+    
+    :param db: MediaFileModel实例
+    :param batch_size: 每批写入的文档数
+    :return: 更新的文档数量
+    """
+    updated = 0
+    batch = []
+    cursor = db.collection.find(
+        {"$or": [{field: {"$exists": False}} for field in DERIVED_FIELDS]},
+        {"file_name": 1}
+    )
+    
+    async for doc in cursor:
+        batch.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {field: build(doc.get("file_name")) for field, build in DERIVED_FIELDS.items()}}
+        ))
+        if len(batch) >= batch_size:
+            result = await db.collection.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+            logger.info(f"已补充 {updated} 条文档的搜索词元和模糊搜索元组")
+    
+    if batch:
+        result = await db.collection.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+    
+    return updated
+
+def derive_file_unique_id(file_id):
+    """
+    由 file_id 推导 file_unique_id，与 Pyrogram 解析音频、视频和文件消息时的算法一致
+    
+    :param file_id: 媒体文件的 file_id
+    :return: file_unique_id，file_id 无法解析时返回None
+    """
+    try:
+        decoded = FileId.decode(file_id)
+        return FileUniqueId(file_unique_type=FileUniqueType.DOCUMENT, media_id=decoded.media_id).encode()
+    except Exception:
+        return None
+
+async def build_catalogue(db, batch_size=1000):
+    """
+    将每条消息一条文档的旧数据转换为去重目录
+    
+    1. 为旧文档推导 file_unique_id，并在 media_occurrences 中记录每次发布
+    2. 合并同一群组中 file_unique_id 相同的文档，保留最早的一条，occurrences 为发布次数
+    
+    :param db: MediaFileModel实例
+    :param batch_size: 每批写入的文档数
+    :return: (记录的发布数, 合并删除的重复文档数)
+    """
+    # 旧文档补上 file_unique_id 后可能与已有目录文档重复，合并完成前先去掉唯一约束，由调用方重新创建
+    indexes = await db.collection.index_information()
+    if CATALOGUE_INDEX in indexes:
+        await db.collection.drop_index(CATALOGUE_INDEX)
+    
+    recorded = 0
+    failed = 0
+    occurrences = []
+    updates = []
+    
+    async def flush():
+        nonlocal recorded, occurrences, updates
+        if occurrences:
+            result = await db.occurrences.bulk_write(occurrences, ordered=False)
+            recorded += result.upserted_count
+        if updates:
+            await db.collection.bulk_write(updates, ordered=False)
+        occurrences, updates = [], []
+    
+    cursor = db.collection.find(
+        {"occurrences": {"$exists": False}},
+        {field: 1 for field in OCCURRENCE_FIELDS + ("file_id",)}
+    )
+    async for doc in cursor:
+        if not doc.get("file_unique_id"):
+            doc["file_unique_id"] = derive_file_unique_id(doc.get("file_id"))
+            if not doc["file_unique_id"]:
+                failed += 1
+                continue
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"file_unique_id": doc["file_unique_id"]}}))
+        occurrences.append(UpdateOne(
+            {"chat_id": doc["chat_id"], "message_id": doc["message_id"]},
+            {"$setOnInsert": {field: doc.get(field) for field in OCCURRENCE_FIELDS}},
+            upsert=True
+        ))
+        if len(occurrences) >= batch_size:
+            await flush()
+            logger.info(f"已记录 {recorded} 次发布")
+    await flush()
+    if failed:
+        logger.warning(f"{failed} 条文档的 file_id 无法解析，保留为单独的目录文档")
+    
+    # 已经是目录文档（有 occurrences）的优先保留，其次保留最早发布的一条
+    pipeline = [
+        {"$match": {"file_unique_id": {"$exists": True}}},
+        {"$sort": {"timestamp": 1, "_id": 1}},
+        {"$group": {
+            "_id": {"chat_id": "$chat_id", "file_unique_id": "$file_unique_id"},
+            "docs": {"$push": {"_id": "$_id", "catalogued": {"$ifNull": ["$occurrences", False]}}},
+            "n": {"$sum": 1}
+        }},
+        {"$match": {"n": {"$gt": 1}}}
+    ]
+    removed = 0
+    async for group in db.collection.aggregate(pipeline, allowDiskUse=True):
+        docs = group["docs"]
+        keep = next((doc for doc in docs if doc["catalogued"]), docs[0])
+        count = await db.occurrences.count_documents(group["_id"])
+        await db.collection.bulk_write([
+            DeleteMany({"_id": {"$in": [doc["_id"] for doc in docs if doc is not keep]}}),
+            UpdateOne({"_id": keep["_id"]}, {"$set": {"occurrences": count}})
+        ], ordered=True)
+        removed += len(docs) - 1
+    
+    # 其余旧文档只发布过一次
+    await db.collection.update_many({"occurrences": {"$exists": False}}, {"$set": {"occurrences": 1}})
+    return recorded, removed
+
+async def compact_documents(db):
+    """
+    删除目录文档中不再保存的字段
+    
+    没有 file_unique_id 的旧文档（file_id 无法解析）保留 file_id，以便之后重新推导
+    
+    :param db: MediaFileModel实例
+    :return: 更新的文档数量
+    """
+    result = await db.collection.update_many(
+        {"file_unique_id": {"$exists": True}, "$or": [{field: {"$exists": True}} for field in DROPPED_FIELDS]},
+        {"$unset": {field: "" for field in DROPPED_FIELDS}}
+    )
+    return result.modified_count
+
+async def drop_legacy_indexes(db):
+    """删除不再使用的旧索引"""
+    indexes = await db.collection.index_information()
+    for name in LEGACY_INDEXES:
+        if name in indexes:
+            await db.collection.drop_index(name)
+            logger.info(f"已删除旧索引: {name}")
+
+async def main():
+    """执行数据库迁移：创建索引并回填历史文档"""
+    db = MediaFileModel()
+    try:
+        await db.ensure_indexes()
+        updated = await backfill_derived_fields(db)
+        logger.info(f"派生字段回填完成，共更新 {updated} 条文档")
+        recorded, removed = await build_catalogue(db)
+        logger.info(f"去重目录迁移完成，记录 {recorded} 次发布，合并 {removed} 条重复文档")
+        if await db.ensure_catalogue_index():
+            logger.info("已创建目录唯一索引 (chat_id, file_unique_id)")
+        compacted = await compact_documents(db)
+        logger.info(f"已精简 {compacted} 条目录文档")
+        await drop_legacy_indexes(db)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
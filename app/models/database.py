@@ -0,0 +1,95 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+import logging
+from app.config.settings import (
+    MONGODB_URI, DB_NAME, MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE,
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS, MONGODB_CONNECT_TIMEOUT_MS,
+    MONGODB_SOCKET_TIMEOUT_MS, MONGODB_READ_PREFERENCE
+)
+
+logger = logging.getLogger(__name__)
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    连接池事件监听：统计已打开的连接数、正在借出的连接数和借出失败次数
+    
+    回调在驱动的工作线程中执行，只做整数加减，不影响查询路径
+    """
+    
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+    
+    def connection_created(self, event):
+        self.open += 1
+    
+    def connection_closed(self, event):
+        self.open -= 1
+    
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+    
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+    
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+    
+    def connection_check_out_started(self, event):
+        pass
+    
+    def connection_ready(self, event):
+        pass
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
+
+# 进程内共享的MongoDB客户端，所有模型复用同一个连接池
+_client = None
+# 共享客户端的连接池统计
+pool_metrics = PoolMetrics()
+
+def get_client():
+    """
+    获取进程内共享的MongoDB客户端，首次调用时创建
+    
+    :return: AsyncIOMotorClient实例
+    """
+    global _client
+    if _client is None:
+        logger.info(
+            f"尝试连接MongoDB: {MONGODB_URI}, 数据库: {DB_NAME}, "
+            f"连接池: {MONGODB_MIN_POOL_SIZE}-{MONGODB_MAX_POOL_SIZE}, 读偏好: {MONGODB_READ_PREFERENCE}"
+        )
+        _client = AsyncIOMotorClient(
+            MONGODB_URI,
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS or None,
+            readPreference=MONGODB_READ_PREFERENCE,
+            event_listeners=[pool_metrics]
+        )
+    return _client
+
+def get_database():
+    """获取应用数据库"""
+    return get_client()[DB_NAME]
+
+def close_client():
+    """关闭共享的MongoDB客户端，之后再次调用 get_client 会重新创建"""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
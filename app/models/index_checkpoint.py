@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+import logging
+from pymongo import ASCENDING, ReturnDocument
+from app.models.database import get_database, close_client
+
+logger = logging.getLogger(__name__)
+
+class IndexCheckpointModel:
+    def __init__(self):
+        """
+        初始化索引检查点存储
+        
+        每个群组一条记录：{_id: chat_id, oldest_id, newest_id, backfill_done, updated_at,
+        reconcile_owner, reconcile_lease, reconcile_from, reconciled_at}
+        oldest_id 与 newest_id 之间的消息已经全部写入数据库；
+        reconcile_* 是校验任务的租约和进度：reconcile_from 之前的消息已在本轮校验过，reconciled_at 为上一轮完成的时间。
+        """
+        self.db = get_database()
+        self.collection = self.db.index_checkpoints
+    
+    async def get_checkpoint(self, chat_id):
+        """
+        获取群组的索引检查点
+        
+        :param chat_id: 群组ID
+        :return: 检查点记录，从未索引过时返回None
+        """
+        return await self.collection.find_one({"_id": chat_id})
+    
+    async def advance(self, chat_id, oldest_id=None, newest_id=None, backfill_done=False):
+        """
+        推进群组的索引检查点，只会扩大已索引的区间
+        
+        :param chat_id: 群组ID
+        :param oldest_id: 已写入的最旧消息ID
+        :param newest_id: 已写入的最新消息ID
+        :param backfill_done: 是否已回溯到群组的第一条消息
+        """
+        update = {"$set": {"updated_at": datetime.now()}}
+        if oldest_id is not None:
+            update["$min"] = {"oldest_id": oldest_id}
+        if newest_id is not None:
+            update["$max"] = {"newest_id": newest_id}
+        if backfill_done:
+            update["$set"]["backfill_done"] = True
+        else:
+            update["$setOnInsert"] = {"backfill_done": False}
+        
+        await self.collection.update_one({"_id": chat_id}, update, upsert=True)
+    
+    async def claim_reconcile(self, owner, lease_seconds, period_seconds):
+        """
+        领取一个需要校验的群组：租约已过期，且上一轮校验早于 period_seconds 秒前或尚未完成，最久未校验的优先
+        
+        :param owner: 领取者标识
+        :param lease_seconds: 租约时长（秒），期间其他进程不会领取该群组
+        :param period_seconds: 同一群组两轮校验的最短间隔（秒）
+        :return: 领取的检查点记录，没有需要校验的群组时返回None
+        """
+        now = datetime.now()
+        return await self.collection.find_one_and_update(
+            {
+                "newest_id": {"$ne": None},
+                "$and": [
+                    {"$or": [{"reconcile_lease": None}, {"reconcile_lease": {"$lt": now}}]},
+                    {"$or": [
+                        {"reconciled_at": None},
+                        {"reconciled_at": {"$lt": now - timedelta(seconds=period_seconds)}},
+                        {"reconcile_from": {"$gt": 0}}
+                    ]}
+                ]
+            },
+            {"$set": {"reconcile_owner": owner, "reconcile_lease": now + timedelta(seconds=lease_seconds)}},
+            sort=[("reconciled_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def save_reconcile_progress(self, chat_id, owner, message_id, lease_seconds):
+        """
+        保存校验进度并续租
+        
+        :return: 是否仍持有租约，租约已被其他进程领取时返回False
+        """
+        result = await self.collection.update_one(
+            {"_id": chat_id, "reconcile_owner": owner},
+            {"$set": {"reconcile_from": message_id, "reconcile_lease": datetime.now() + timedelta(seconds=lease_seconds)}}
+        )
+        return result.matched_count > 0
+    
+    async def finish_reconcile(self, chat_id, owner):
+        """完成一轮校验，释放租约，下一轮从头开始"""
+        await self.collection.update_one(
+            {"_id": chat_id, "reconcile_owner": owner},
+            {"$set": {"reconciled_at": datetime.now(), "reconcile_from": 0, "reconcile_lease": None}}
+        )
+    
+    async def release_reconcile(self, chat_id, owner):
+        """中途停止校验时释放租约，保留进度，下次从中断处继续"""
+        await self.collection.update_one(
+            {"_id": chat_id, "reconcile_owner": owner}, {"$set": {"reconcile_lease": None}}
+        )
+    
+    def close(self):
+        """关闭共享的数据库连接"""
+        close_client()
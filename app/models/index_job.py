@@ -0,0 +1,177 @@
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from datetime import datetime
+import logging
+from app.models.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# 尚未结束的任务状态，重启后需要恢复
+ACTIVE_STATUSES = [QUEUED, RUNNING]
+
+class IndexJobModel:
+    def __init__(self):
+        """
+        初始化索引任务存储
+        
+        每条记录对应一次 /index 请求：{chat_id, chat_title, status, requested_by,
+        reply_chat_id, reply_message_id, progress, error, created_at, started_at, finished_at}
+        reply_chat_id / reply_message_id 指向用于显示进度的消息，重启后可继续更新。
+        拆分部署时集合同时作为任务队列：worker 进程用 claim 领取任务，
+        进行中的任务记录 worker_id 和 heartbeat_at，心跳超时的任务可以被其他 worker 重新领取。
+        """
+        self.db = get_database()
+        self.collection = self.db.index_jobs
+    
+    async def ensure_indexes(self):
+        """创建按群组和状态查询任务的索引"""
+        await self.collection.create_index([("chat_id", ASCENDING), ("created_at", DESCENDING)])
+        await self.collection.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+        # 每个群组最多一个未结束的任务：多个前端同时收到 /index 时，只有一方能插入
+        try:
+            await self.collection.create_index(
+                [("chat_id", ASCENDING)],
+                unique=True,
+                name="chat_id_1_active",
+                partialFilterExpression={"status": {"$in": ACTIVE_STATUSES}}
+            )
+        except OperationFailure as e:
+            logger.error(f"创建索引任务唯一索引失败（存在同一群组的多个未结束任务）: {str(e)}")
+    
+    async def create(self, chat_id, chat_title, requested_by, reply_chat_id, reply_message_id):
+        """
+        创建排队中的索引任务
+        
+        :return: 任务记录，群组已有未结束的任务时返回None
+        """
+        job = {
+            "chat_id": chat_id,
+            "chat_title": chat_title,
+            "status": QUEUED,
+            "requested_by": requested_by,
+            "reply_chat_id": reply_chat_id,
+            "reply_message_id": reply_message_id,
+            "progress": {},
+            "error": None,
+            "created_at": datetime.now(),
+            "started_at": None,
+            "finished_at": None
+        }
+        try:
+            result = await self.collection.insert_one(job)
+        except DuplicateKeyError:
+            return None
+        job["_id"] = result.inserted_id
+        return job
+    
+    async def get(self, job_id):
+        """按ID获取任务"""
+        return await self.collection.find_one({"_id": job_id})
+    
+    async def find_latest(self, chat_id):
+        """获取群组最近一次的索引任务，没有时返回None"""
+        return await self.collection.find_one({"chat_id": chat_id}, sort=[("created_at", DESCENDING)])
+    
+    async def has_active(self, chat_id):
+        """群组是否有排队中或进行中的任务"""
+        return await self.collection.find_one({"chat_id": chat_id, "status": {"$in": ACTIVE_STATUSES}}) is not None
+    
+    async def count_queued(self, before=None):
+        """
+        统计排队中的任务数
+        
+        :param before: 只统计创建时间早于该时间的任务，用于计算队列位置
+        """
+        query = {"status": QUEUED}
+        if before is not None:
+            query["created_at"] = {"$lt": before}
+        return await self.collection.count_documents(query)
+    
+    async def count_running(self):
+        """统计进行中的任务数"""
+        return await self.collection.count_documents({"status": RUNNING})
+    
+    async def claim(self, worker_id, stale_before):
+        """
+        原子地领取最早的可执行任务：排队中的任务，或心跳早于 stale_before 的进行中任务（其 worker 已退出）
+        
+        :param worker_id: 领取任务的 worker 标识
+        :param stale_before: 心跳超时的时间界限
+        :return: 领取后的任务记录（状态为 running），没有可领取的任务时返回None
+        """
+        now = datetime.now()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": QUEUED},
+                {"status": RUNNING, "heartbeat_at": {"$lt": stale_before}},
+                {"status": RUNNING, "heartbeat_at": None}
+            ]},
+            {"$set": {"status": RUNNING, "worker_id": worker_id, "started_at": now, "heartbeat_at": now}},
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def heartbeat(self, job_ids, worker_id):
+        """
+        刷新 worker 进行中任务的心跳
+        
+        :param job_ids: 任务ID列表
+        :param worker_id: worker 标识
+        :return: 不再属于该 worker 的任务：任务ID -> 当前状态（已取消，或已被其他 worker 领取）
+        """
+        if not job_ids:
+            return {}
+        query = {"_id": {"$in": list(job_ids)}, "status": RUNNING, "worker_id": worker_id}
+        result = await self.collection.update_many(query, {"$set": {"heartbeat_at": datetime.now()}})
+        if result.matched_count == len(job_ids):
+            return {}
+        cursor = self.collection.find({"_id": {"$in": list(job_ids)}}, {"status": 1, "worker_id": 1})
+        return {
+            job["_id"]: job["status"]
+            async for job in cursor
+            if job["status"] != RUNNING or job.get("worker_id") != worker_id
+        }
+    
+    async def list_active(self):
+        """按创建顺序列出所有尚未结束的任务，用于重启后恢复队列"""
+        cursor = self.collection.find({"status": {"$in": ACTIVE_STATUSES}}).sort("created_at", ASCENDING)
+        return await cursor.to_list(length=None)
+    
+    async def set_status(self, job_id, status, error=None, expected=None, worker_id=None):
+        """
+        更新任务状态
+        
+        :param job_id: 任务ID
+        :param status: 新状态
+        :param error: 失败原因
+        :param expected: 仅当当前状态在该列表中时才更新，用于避免覆盖已取消的任务
+        :param worker_id: 仅当任务仍由该 worker 执行时才更新，用于避免覆盖已被其他 worker 接手的任务
+        :return: 更新后的任务记录，状态不符合 expected 或 worker_id 时返回None
+        """
+        update = {"status": status}
+        if status == RUNNING:
+            update["started_at"] = datetime.now()
+        elif status not in ACTIVE_STATUSES:
+            update["finished_at"] = datetime.now()
+        if error is not None:
+            update["error"] = error
+        
+        query = {"_id": job_id}
+        if expected:
+            query["status"] = {"$in": expected}
+        if worker_id is not None:
+            query["worker_id"] = worker_id
+        return await self.collection.find_one_and_update(
+            query, {"$set": update}, return_document=ReturnDocument.AFTER
+        )
+    
+    async def set_progress(self, job_id, progress):
+        """保存任务进度"""
+        await self.collection.update_one({"_id": job_id}, {"$set": {"progress": progress}})
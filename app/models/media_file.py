@@ -1,73 +1,679 @@
-from pymongo import MongoClient, ASCENDING, TEXT
+import asyncio
+from pymongo import ASCENDING, DESCENDING, UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
 from datetime import datetime
 import logging
-from app.config.settings import MONGODB_URI, DB_NAME
+from app.config.settings import SEARCH_COUNT_CAP, FUZZY_SCAN_LIMIT, FUZZY_MAX_RESULTS, MEDIA_REMOVALS_TTL
+from app.models.database import get_database, close_client
+from app.utils.tokenizer import (
+    build_search_tokens, build_query_tokens, build_query_substrings, substring_pattern, build_fuzzy_grams
+)
+from app.utils.ranking import rank_documents
+from app.utils.fuzzy import rerank_fuzzy
+from app.utils.streams import chunked
 
 logger = logging.getLogger(__name__)
 
+# MongoDB重复键错误码
+DUPLICATE_KEY_ERROR = 11000
+
+# upsert 因并发写入同一个键冲突时的最大重试次数
+UPSERT_RETRIES = 3
+
+# 搜索结果和相关度排序候选只读取显示、排序和评分需要的字段，
+# 占文档大半的 search_tokens、trigrams 只在数据库端匹配，不传回进程
+RESULT_PROJECTION = {
+    "file_name": 1, "message_id": 1, "chat_id": 1, "media_type": 1, "timestamp": 1, "occurrences": 1
+}
+
+# 每次发布只记录在 media_occurrences 中的字段，其余字段属于文件本身，保存在目录文档中
+OCCURRENCE_FIELDS = ("chat_id", "message_id", "file_unique_id", "sender_id", "timestamp")
+
+# 目录文档中代表首次发布的字段，该发布被删除后改为剩余最早的一次发布
+FIRST_POSTING_FIELDS = ("message_id", "timestamp", "sender_id")
+
+# get_many 每次 $in 查询的键数，兼顾往返次数和单次查询的大小
+GET_MANY_CHUNK = 1000
+
+def covering_index(*keys):
+    """
+    在索引键之后补上 RESULT_PROJECTION 的其余字段
+    
+    按前面的键查询和排序、只投影 RESULT_PROJECTION 时，结果页直接从索引中读出（covered query），
+    不需要读取文档。search_tokens 是数组字段（多键索引），关键词查询无法由索引覆盖，
+    因此只用于 type:、from: 等不带关键词的筛选。
+    
+    :param keys: (字段, 方向) 形式的索引键
+    :return: 完整的索引键列表
+    """
+    fields = {field for field, _ in keys}
+    return list(keys) + [(field, ASCENDING) for field in RESULT_PROJECTION if field not in fields]
+
 class MediaFileModel:
+    """
+    两级媒体文件目录：
+    media_files 每个群组中的每个文件（file_unique_id）只有一条文档，搜索只查询该集合，
+    同一文件重复转发不会占用多条搜索结果，文档的 occurrences 字段记录发布次数，
+    message_id/timestamp/sender_id 为首次索引到的那次发布；
+    目录文档只保存搜索、筛选和显示需要的字段，file_id 只对索引所用的账号有效、机器人无法使用，不再保存；
+    media_occurrences 每条消息一条轻量记录，用于去重写入和统计发布次数；
+    media_removals 记录消息删除引起的目录变化，供其他进程的 ChangeFeed 同步。
+    """
+    # 索引在进程内只需创建一次，多个模型实例共享该标记
+    _indexes_ensured = False
+    # 写入监听器，目录文档新插入或发布次数变化后回调，用于同步内存索引等进程内缓存
+    _write_listeners = []
+    
     def __init__(self):
-        """初始化MongoDB连接"""
+        """初始化MongoDB连接（Motor异步驱动，所有实例共享进程内的连接池）"""
         try:
-            logger.info(f"尝试连接MongoDB: {MONGODB_URI}, 数据库: {DB_NAME}")
-            self.client = MongoClient(MONGODB_URI)
-            self.db = self.client[DB_NAME]
+            self.db = get_database()
             self.collection = self.db.media_files
-            self._ensure_indexes()
-            logger.info("MongoDB连接成功")
+            self.occurrences = self.db.media_occurrences
+            self.removals = self.db.media_removals
         except Exception as e:
             logger.error(f"MongoDB连接失败: {str(e)}")
             raise
     
-    def _ensure_indexes(self):
-        """创建必要的索引"""
-        # 文件名文本索引
-        self.collection.create_index([("file_name", TEXT)])
+    async def ensure_indexes(self):
+        """创建必要的索引（需要在事件循环中await，进程内只执行一次）"""
+        if MediaFileModel._indexes_ensured:
+            return
+        
+        # 文件名n元组词元索引（替代无法切分中文的$text索引），
+        # 末尾的 (timestamp, _id) 与排序一致，翻页时可以直接定位到上一页的末尾
+        await self.collection.create_index([
+            ("chat_id", ASCENDING),
+            ("search_tokens", ASCENDING),
+            ("timestamp", DESCENDING),
+            ("_id", DESCENDING)
+        ])
+        # 模糊搜索的元组索引，只在精确搜索结果过少时使用
+        await self.collection.create_index([("chat_id", ASCENDING), ("trigrams", ASCENDING)])
+        # 筛选条件的复合索引：type: 和 from: 可以按索引顺序直接取出最新结果，
+        # 末尾带有结果字段，不带关键词时整页结果由索引覆盖；
+        # size/duration 的范围条件在 chat_id 前缀的索引范围内过滤，不会扫描整个集合
+        await self.collection.create_index(covering_index(
+            ("chat_id", ASCENDING),
+            ("media_type", ASCENDING),
+            ("timestamp", DESCENDING),
+            ("_id", DESCENDING)
+        ))
+        await self.collection.create_index(covering_index(
+            ("chat_id", ASCENDING),
+            ("sender_id", ASCENDING),
+            ("timestamp", DESCENDING),
+            ("_id", DESCENDING)
+        ))
         # 消息ID和群组ID的复合索引
-        self.collection.create_index([("message_id", ASCENDING), ("chat_id", ASCENDING)], unique=True)
+        await self.collection.create_index([("message_id", ASCENDING), ("chat_id", ASCENDING)], unique=True)
         # 时间戳索引，用于排序
-        self.collection.create_index([("timestamp", ASCENDING)])
+        await self.collection.create_index([("timestamp", ASCENDING)])
+        # 每条消息只记录一次发布；按文件统计发布次数
+        await self.occurrences.create_index([("chat_id", ASCENDING), ("message_id", ASCENDING)], unique=True)
+        await self.occurrences.create_index([("chat_id", ASCENDING), ("file_unique_id", ASCENDING)])
+        await self.removals.create_index([("created_at", ASCENDING)], expireAfterSeconds=MEDIA_REMOVALS_TTL)
+        if not await self.ensure_catalogue_index():
+            logger.warning("media_files 中存在重复文件，请运行 python3 -m app.migrate 合并后再启动")
+        MediaFileModel._indexes_ensured = True
     
-    def add_media_file(self, file_data):
-        """添加新的媒体文件记录"""
-        file_data["indexed_at"] = datetime.now()
+    async def ensure_catalogue_index(self):
+        """
+        创建目录的唯一索引 (chat_id, file_unique_id)
         
-        # 检查是否已存在相同记录
-        existing = self.collection.find_one({
-            "message_id": file_data["message_id"],
-            "chat_id": file_data["chat_id"]
-        })
+        迁移前的旧文档没有 file_unique_id，不受唯一约束；
+        旧数据中的重复文件需要先由迁移合并，否则索引创建失败。
         
-        if existing:
+        :return: 索引是否创建成功
+        """
+        try:
+            await self.collection.create_index(
+                [("chat_id", ASCENDING), ("file_unique_id", ASCENDING)],
+                unique=True,
+                partialFilterExpression={"file_unique_id": {"$exists": True}}
+            )
+            return True
+        except OperationFailure as e:
+            logger.error(f"创建目录唯一索引失败: {str(e)}")
+            return False
+    
+    @classmethod
+    def add_write_listener(cls, listener):
+        """
+        注册写入监听器
+        
+        :param listener: 同步回调函数，参数为变化的目录文档列表：新插入的是完整文档（包含_id），
+                         已存在的文件再次发布时只有 _id、chat_id 和最新的 occurrences，
+                         发布被删除时只有 _id、chat_id、occurrences 和可能改变的 FIRST_POSTING_FIELDS，
+                         文件的全部发布都被删除时为 {_id, chat_id, "removed": True}
+        """
+        cls._write_listeners.append(listener)
+    
+    def notify_written(self, docs):
+        """通知写入监听器，监听器出错不影响写入结果"""
+        if not docs:
+            return
+        for listener in MediaFileModel._write_listeners:
+            try:
+                listener(docs)
+            except Exception as e:
+                logger.error(f"写入监听器处理失败: {str(e)}")
+    
+    def _prepare_document(self, file_data):
+        """补充搜索词元等派生字段（索引时间即 _id 中的时间戳，不单独保存）"""
+        file_data["search_tokens"] = build_search_tokens(file_data.get("file_name"))
+        file_data["trigrams"] = build_fuzzy_grams(file_data.get("file_name"))
+        return file_data
+    
+    async def add_media_file(self, file_data):
+        """
+        添加一条媒体文件消息
+        
+        :return: 文件是新文件时返回目录文档的_id，重复发布或消息已索引过时返回None
+        """
+        if not await self.add_media_files([file_data]):
             return None
+        return file_data.get("_id")
+    
+    async def add_media_files(self, files):
+        """
+        批量添加媒体文件消息
         
-        result = self.collection.insert_one(file_data)
-        return result.inserted_id
+        先以 (chat_id, message_id) 为键把每条消息无序 upsert 到 media_occurrences，
+        已索引过的消息保持不变；再把新发布按 (chat_id, file_unique_id) 合并后 upsert 到目录：
+        新文件插入完整文档，已有文件只增加 occurrences。每个集合各一次往返。
+        与没有 file_unique_id 的旧文档冲突的消息由 _adopt_legacy_documents 转换旧文档。
+        
+        :param files: 媒体文件数据列表，需要 file_unique_id
+        :return: 新索引的消息数量
+        """
+        if not files:
+            return 0
+        
+        operations = [
+            UpdateOne(
+                {"chat_id": file_data["chat_id"], "message_id": file_data["message_id"]},
+                {"$setOnInsert": {field: file_data.get(field) for field in OCCURRENCE_FIELDS}},
+                upsert=True
+            )
+            for file_data in files
+        ]
+        upserted, conflicts = await self._bulk_upsert(self.occurrences, operations)
+        if conflicts:
+            raise RuntimeError(f"写入 media_occurrences 时 {len(conflicts)} 条消息持续发生唯一索引冲突")
+        new_files = [files[index] for index in sorted(upserted)]
+        if not new_files:
+            return 0
+        
+        # 同一批中同一文件的多次发布合并为一次写入，以第一条作为目录文档
+        postings = {}
+        for file_data in new_files:
+            postings.setdefault((file_data["chat_id"], file_data["file_unique_id"]), []).append(file_data)
+        
+        documents = []
+        operations = []
+        for (chat_id, file_unique_id), group in postings.items():
+            document = self._prepare_document(group[0])
+            documents.append(document)
+            operations.append(UpdateOne(
+                {"chat_id": chat_id, "file_unique_id": file_unique_id},
+                {
+                    "$setOnInsert": {key: value for key, value in document.items() if key != "_id"},
+                    "$inc": {"occurrences": len(group)}
+                },
+                upsert=True
+            ))
+        upserted, conflicts = await self._bulk_upsert(self.collection, operations)
+        changed = await self._adopt_legacy_documents([documents[index] for index in conflicts], postings)
+        conflicts = set(conflicts)
+        
+        # $setOnInsert 不会回填_id，按操作序号补上；已有文件查询最新的发布次数
+        reposted = []
+        for index, document in enumerate(documents):
+            if index in conflicts:
+                continue
+            if index in upserted:
+                document["_id"] = upserted[index]
+                document["occurrences"] = len(postings[(document["chat_id"], document["file_unique_id"])])
+                changed.append(document)
+            else:
+                reposted.append(document)
+        if reposted:
+            cursor = self.collection.find(
+                {"$or": [{"chat_id": doc["chat_id"], "file_unique_id": doc["file_unique_id"]} for doc in reposted]},
+                {"chat_id": 1, "occurrences": 1}
+            )
+            changed.extend(await cursor.to_list(length=None))
+        
+        self.notify_written(changed)
+        return len(new_files)
     
-    def search_media_files(self, keyword, chat_id, skip=0, limit=10):
-        """搜索媒体文件"""
-        query = {
-            "$text": {"$search": keyword},
-            "chat_id": chat_id
-        }
+    async def get_occurrence(self, chat_id, message_id):
+        """
+        获取一条消息的发布记录
+        
+        :return: 发布记录，消息未索引时返回None
+        """
+        return await self.occurrences.find_one({"chat_id": chat_id, "message_id": message_id})
+    
+    async def remove_messages(self, chat_id, message_ids):
+        """
+        删除已从群组中删除（或不再包含音视频）的消息
+        
+        删除这些消息的发布记录，再按剩余的发布更新目录：没有剩余发布的文件删除目录文档，
+        否则更新 occurrences，首次发布被删除时改为指向剩余最早的一次发布，搜索结果不会链接到已删除的消息。
+        
+        :param chat_id: 群组ID
+        :param message_ids: 消息ID列表
+        :return: 删除的发布记录数，消息都未索引时为0
+        """
+        message_ids = list(message_ids)
+        if not message_ids:
+            return 0
+        
+        removed_occurrences = await self.occurrences.find(
+            {"chat_id": chat_id, "message_id": {"$in": message_ids}}, {"file_unique_id": 1}
+        ).to_list(length=None)
+        if not removed_occurrences:
+            return 0
+        await self.occurrences.delete_many({"_id": {"$in": [doc["_id"] for doc in removed_occurrences]}})
+        file_unique_ids = list({doc["file_unique_id"] for doc in removed_occurrences})
+        
+        # 每个受影响文件的剩余发布次数和最早的一次发布
+        pipeline = [
+            {"$match": {"chat_id": chat_id, "file_unique_id": {"$in": file_unique_ids}}},
+            {"$sort": {"timestamp": ASCENDING, "message_id": ASCENDING}},
+            {"$group": {"_id": "$file_unique_id", "count": {"$sum": 1}, "first": {"$first": "$$ROOT"}}}
+        ]
+        remaining = {group["_id"]: group async for group in self.occurrences.aggregate(pipeline)}
+        
+        deleted = set(message_ids)
+        operations = []
+        changed = []
+        cursor = self.collection.find(
+            {"chat_id": chat_id, "file_unique_id": {"$in": file_unique_ids}}, {"file_unique_id": 1, "message_id": 1}
+        )
+        async for doc in cursor:
+            group = remaining.get(doc["file_unique_id"])
+            if group is None:
+                operations.append(DeleteOne({"_id": doc["_id"]}))
+                changed.append({"_id": doc["_id"], "chat_id": chat_id, "removed": True})
+                continue
+            update = {"occurrences": group["count"]}
+            if doc["message_id"] in deleted:
+                update.update({field: group["first"].get(field) for field in FIRST_POSTING_FIELDS})
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+            changed.append(dict(update, _id=doc["_id"], chat_id=chat_id))
+        
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+            await self.removals.insert_one({
+                "chat_id": chat_id,
+                "removed": [doc["_id"] for doc in changed if doc.get("removed")],
+                "updated": [doc["_id"] for doc in changed if not doc.get("removed")],
+                "created_at": datetime.now()
+            })
+            self.notify_written(changed)
+        return len(removed_occurrences)
+    
+    async def _adopt_legacy_documents(self, documents, postings):
+        """
+        把新发布写入同一条消息的旧文档
+        
+        迁移前的旧文档（或迁移时 file_id 无法解析的文档）没有 file_unique_id，不会被按
+        (chat_id, file_unique_id) 的 upsert 匹配到，插入新目录文档时与 (message_id, chat_id) 唯一索引冲突。
+        这类文档没有发布记录，这条消息就是它唯一的一次发布：补上 file_unique_id 和派生字段，作为该文件的目录文档。
+        
+        :param documents: upsert 持续冲突的目录文档
+        :param postings: (chat_id, file_unique_id) -> 本批中该文件的新发布列表
+        :return: 变化的目录文档列表 {_id, chat_id, occurrences}
+        :raises RuntimeError: 冲突的不是旧文档
+        """
+        changed = []
+        for document in documents:
+            fields = {key: value for key, value in document.items() if key != "_id"}
+            fields["occurrences"] = len(postings[(document["chat_id"], document["file_unique_id"])])
+            adopted = await self.collection.find_one_and_update(
+                {
+                    "chat_id": document["chat_id"],
+                    "message_id": document["message_id"],
+                    "file_unique_id": {"$exists": False}
+                },
+                {"$set": fields, "$unset": {"file_id": "", "indexed_at": ""}},
+                projection={"chat_id": 1, "occurrences": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if adopted is None:
+                raise RuntimeError(
+                    f"写入目录时消息 {document['chat_id']}/{document['message_id']} 持续发生唯一索引冲突"
+                )
+            logger.info(f"消息 {document['chat_id']}/{document['message_id']} 的旧文档已转换为目录文档")
+            document["_id"] = adopted["_id"]
+            changed.append(adopted)
+        return changed
+    
+    async def _bulk_upsert(self, collection, operations):
+        """
+        执行无序批量 upsert
         
-        # 按时间戳降序排列（最新的优先）
-        cursor = self.collection.find(query).sort("timestamp", -1).skip(skip).limit(limit)
+        并发写入同一个键时，upsert 可能触发唯一索引冲突：此时记录已由另一方插入，
+        重试冲突的操作即可按更新执行（media_occurrences 的 $setOnInsert 重试后不做任何修改）。
+        最多重试 UPSERT_RETRIES 次，仍然冲突的操作（与 filter 之外的唯一键冲突）交给调用方处理。
         
-        return list(cursor)
+        :return: (操作序号 -> 新插入文档的_id, 仍然冲突的操作序号列表)
+        """
+        upserted = {}
+        pending = list(range(len(operations)))
+        for _ in range(UPSERT_RETRIES + 1):
+            try:
+                result = await collection.bulk_write([operations[index] for index in pending], ordered=False)
+                upserted.update({pending[index]: _id for index, _id in result.upserted_ids.items()})
+                return upserted, []
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+                    raise
+                upserted.update({pending[item["index"]]: item["_id"] for item in e.details.get("upserted", [])})
+                pending = [pending[err["index"]] for err in errors]
+        return upserted, pending
     
-    def count_search_results(self, keyword, chat_id):
-        """计算搜索结果总数"""
-        query = {
-            "$text": {"$search": keyword},
-            "chat_id": chat_id
+    def build_search_query(self, keyword, chat_id, filters=None):
+        """
+        查询计划：将关键词转换为基于 search_tokens 的查询条件
+        
+        所有查询词元都必须出现在文件名中，每个词元都是一次索引查找，
+        因此子串匹配与整词匹配的代价相同。短于三个字符的单词没有词元，
+        用 substring_pattern 生成的正则（与内存索引相同）在文件名中匹配，只有这类单词时扫描群组的全部文档。
+        
+        :param keyword: 搜索关键词
+        :param chat_id: 群组ID，或群组ID列表（跨群组搜索，按 $in 合并各群组的索引范围）
+        :param filters: 附加的筛选条件，如 {"media_type": "audio", "file_size": {"$gt": 1024}}
+        :return: 查询条件，关键词中没有可搜索内容且没有筛选条件时返回None
+        """
+        tokens = build_query_tokens(keyword)
+        substrings = build_query_substrings(keyword)
+        if not tokens and not substrings and not filters:
+            return None
+        
+        if isinstance(chat_id, (list, tuple, set)):
+            query = {"chat_id": {"$in": list(chat_id)}}
+        else:
+            query = {"chat_id": chat_id}
+        if tokens:
+            query["search_tokens"] = {"$all": tokens}
+        if substrings:
+            query["$and"] = [{"file_name": {"$regex": substring_pattern(text)}} for text in substrings]
+        if filters:
+            query.update(filters)
+        return query
+    
+    async def search_media_files(self, keyword, chat_id, after=None, limit=10, filters=None,
+                                 projection=RESULT_PROJECTION):
+        """
+        搜索媒体文件（键集分页）
+        
+        :param keyword: 搜索关键词
+        :param chat_id: 群组ID
+        :param after: 上一页最后一条结果的排序键 (timestamp, _id)，第一页为None
+        :param limit: 返回的最大结果数
+        :param filters: 附加的筛选条件
+        :param projection: 结果的投影，需要包含排序键 timestamp
+        :return: 结果列表，按 (timestamp, _id) 降序排列
+        """
+        query = self.build_search_query(keyword, chat_id, filters)
+        if query is None:
+            return []
+        
+        # 从上一页末尾继续，而不是 skip 掉前面所有页，每一页都是一次索引定位
+        if after is not None:
+            timestamp, last_id = after
+            query["timestamp"] = {"$lte": timestamp}
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": last_id}}
+            ]
+        
+        # 按时间戳降序排列（最新的优先），时间相同时按_id保证顺序稳定
+        cursor = self.collection.find(query, projection).sort([("timestamp", DESCENDING), ("_id", DESCENDING)]).limit(limit)
+        
+        return await cursor.to_list(length=limit)
+    
+    async def search_page(self, keyword, chat_id, limit=10, window=0, count_cap=SEARCH_COUNT_CAP,
+                          filters=None, ranked=False):
+        """
+        一次聚合同时获取结果总数、第一页结果和结果窗口的排序键
+        
+        使用 $facet 共享同一次 $match；$facet 之前先按排序截取 count_cap + 1 条（以及窗口所需的条数），
+        $sort 和 $limit 合并后可以按索引顺序读到上限即停止，结果非常多时计数和排序的代价也是有上限的。各分面只投影 RESULT_PROJECTION 中的字段，
+        不带关键词的筛选查询可以完全由 covering_index 创建的索引完成。
+        
+        ranked 为 True 且关键词有词元时，取最新的 window 个候选按相关度和时间重新排序，
+        keys 为排序后的顺序；window 之后的结果仍按时间顺序，从 tail 开始键集分页。
+        
+        :param keyword: 搜索关键词
+        :param chat_id: 群组ID
+        :param limit: 第一页的结果数
+        :param window: 额外返回的结果排序键数量，0表示不返回
+        :param count_cap: 计数上限
+        :param filters: 附加的筛选条件
+        :param ranked: 是否按相关度排序
+        :return: {"total": 总数, "capped": 总数是否达到上限, "results": 第一页结果, "keys": 排序键列表,
+                  "ranked": 是否已按相关度排序, "tail": 窗口之后的分页起点，窗口已包含全部结果时为None}
+        """
+        query = self.build_search_query(keyword, chat_id, filters)
+        if query is None:
+            return {"total": 0, "capped": False, "results": [], "keys": [], "ranked": False, "tail": None}
+        
+        tokens = query.get("search_tokens", {}).get("$all")
+        ranked = bool(ranked and tokens and window)
+        
+        facets = {"total": [{"$limit": count_cap + 1}, {"$count": "n"}]}
+        if ranked:
+            facets["candidates"] = [{"$limit": window}, {"$project": RESULT_PROJECTION}]
+        else:
+            facets["results"] = [{"$limit": limit}, {"$project": RESULT_PROJECTION}]
+            if window:
+                facets["keys"] = [{"$limit": window}, {"$project": {"timestamp": 1}}]
+        
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"timestamp": DESCENDING, "_id": DESCENDING}},
+            # $facet 会先取出前面阶段的全部输出，上限必须放在它之前
+            {"$limit": max(count_cap + 1, window, limit)},
+            {"$facet": facets}
+        ]
+        page = (await self.collection.aggregate(pipeline).to_list(length=1))[0]
+        
+        total = page["total"][0]["n"] if page["total"] else 0
+        if ranked:
+            # 候选按时间降序，最后一个即为窗口之后的分页起点
+            candidates = page["candidates"]
+            tail = self.sort_key(candidates[-1]) if len(candidates) == window else None
+            ordered = rank_documents(candidates, tokens)
+            results = ordered[:limit]
+            keys = [self.sort_key(doc) for doc in ordered]
+        else:
+            keys = [self.sort_key(doc) for doc in page.get("keys", [])]
+            tail = keys[-1] if window and len(keys) == window else None
+            results = page["results"]
+        
+        return {
+            "total": min(total, count_cap),
+            "capped": total > count_cap,
+            "results": results,
+            "keys": keys,
+            "ranked": ranked,
+            "tail": tail
         }
-        return self.collection.count_documents(query)
     
-    def get_media_file_by_id(self, file_id):
+    async def fuzzy_search(self, keyword, chat_id, filters=None, limit=FUZZY_MAX_RESULTS, scan_limit=FUZZY_SCAN_LIMIT):
+        """
+        容错搜索：按元组重合度生成候选，再按编辑距离重排
+        
+        重合数至少为 min_overlap 的文档一定包含最少见的 n - min_overlap + 1 个查询元组之一，
+        因此先用 (chat_id, trigrams) 索引统计每个查询元组的文档数（最多数到 scan_limit），
+        只从这些最少见的元组中按从少到多的顺序取候选，最多 scan_limit 个；
+        "mp3" 这类常见元组不会占满候选数量，耗时与群组大小无关，只取决于 scan_limit。
+        再在数据库中计算候选与查询元组的重合数，只取重合最多的一批返回。
+        
+        :param keyword: 搜索关键词
+        :param chat_id: 群组ID
+        :param filters: 附加的筛选条件
+        :param limit: 返回的最大结果数
+        :param scan_limit: 候选生成阶段最多检查的文档数
+        :return: 按 (编辑距离, 重合数, 时间) 排序的结果列表
+        """
+        grams = build_fuzzy_grams(keyword)
+        if not grams:
+            return []
+        
+        # 至少需要一半的查询元组重合，排除只共享常见元组的文档
+        min_overlap = max(1, len(grams) // 2)
+        counts = await asyncio.gather(*[
+            self.collection.count_documents({"chat_id": chat_id, "trigrams": gram}, limit=scan_limit)
+            for gram in grams
+        ])
+        rarest = sorted(zip(counts, grams))[:len(grams) - min_overlap + 1]
+        
+        candidate_ids = set()
+        for count, gram in rarest:
+            if not count:
+                continue
+            budget = scan_limit - len(candidate_ids)
+            if budget <= 0:
+                break
+            match = {"chat_id": chat_id, "trigrams": gram, "_id": {"$nin": list(candidate_ids)}}
+            if filters:
+                match.update(filters)
+            async for doc in self.collection.find(match, {"_id": 1}).limit(budget):
+                candidate_ids.add(doc["_id"])
+        if not candidate_ids:
+            return []
+        
+        pipeline = [
+            {"$match": {"_id": {"$in": list(candidate_ids)}}},
+            {"$project": dict(RESULT_PROJECTION, overlap={"$size": {"$setIntersection": ["$trigrams", grams]}})},
+            {"$match": {"overlap": {"$gte": min_overlap}}},
+            {"$sort": {"overlap": DESCENDING, "timestamp": DESCENDING, "_id": DESCENDING}},
+            {"$limit": limit * 4}
+        ]
+        candidates = await self.collection.aggregate(pipeline).to_list(length=limit * 4)
+        return rerank_fuzzy(keyword, candidates)[:limit]
+    
+    async def get_media_files_by_ids(self, ids):
+        """
+        按ID批量获取媒体文件，返回顺序与ids一致
+        
+        :param ids: 文档ID列表
+        :return: 只包含 RESULT_PROJECTION 字段的媒体文件列表，已不存在的文档会被跳过
+        """
+        if not ids:
+            return []
+        return [doc async for doc in self.get_many(ids, projection=RESULT_PROJECTION)]
+    
+    async def get_many(self, ids=None, messages=None, projection=None, chunk_size=GET_MANY_CHUNK):
+        """
+        批量流式获取目录文档：键按 chunk_size 分块，每块一次 $in 查询，逐条产出
+        
+        ids 和 messages 可以是异步生成器，任何时候只保留一块键和文档，可以遍历任意多的记录。
+        按消息查询时先从 media_occurrences 找到消息对应的文件，重复发布的消息也能找到目录文档，
+        产出的文档中 FIRST_POSTING_FIELDS 替换为该次发布的值。
+        
+        :param ids: 目录文档_id的可迭代对象
+        :param messages: (chat_id, message_id) 的可迭代对象，与 ids 二选一
+        :param projection: 目录文档的投影，None 表示全部字段
+        :param chunk_size: 每次查询的键数
+        :return: 异步生成器，按键的顺序产出文档，不存在的键跳过
+        """
+        if messages is not None:
+            async for doc in self._get_many_by_messages(messages, projection, chunk_size):
+                yield doc
+            return
+        
+        async for chunk in chunked(ids or [], chunk_size):
+            docs = {doc["_id"]: doc async for doc in self.collection.find({"_id": {"$in": chunk}}, projection)}
+            for doc_id in chunk:
+                if doc_id in docs:
+                    yield docs[doc_id]
+    
+    async def _get_many_by_messages(self, messages, projection, chunk_size):
+        async for chunk in chunked(messages, chunk_size):
+            by_chat = {}
+            for chat_id, message_id in chunk:
+                by_chat.setdefault(chat_id, []).append(message_id)
+            postings = {}
+            async for occurrence in self.occurrences.find(
+                {"$or": [{"chat_id": chat_id, "message_id": {"$in": ids}} for chat_id, ids in by_chat.items()]}
+            ):
+                postings[(occurrence["chat_id"], occurrence["message_id"])] = occurrence
+            if not postings:
+                continue
+            
+            if projection and any(projection.values()):
+                # 包含式投影需要带上匹配发布所用的字段
+                projection = dict(projection, chat_id=1, file_unique_id=1)
+            files = {(occurrence["chat_id"], occurrence["file_unique_id"]) for occurrence in postings.values()}
+            docs = {}
+            async for doc in self.collection.find(
+                {"$or": [{"chat_id": chat_id, "file_unique_id": file_unique_id} for chat_id, file_unique_id in files]},
+                projection
+            ):
+                docs[(doc["chat_id"], doc["file_unique_id"])] = doc
+            
+            for key in chunk:
+                occurrence = postings.get(tuple(key))
+                doc = docs.get((occurrence["chat_id"], occurrence["file_unique_id"])) if occurrence else None
+                if doc is not None:
+                    yield dict(doc, **{field: occurrence.get(field) for field in FIRST_POSTING_FIELDS})
+    
+    async def iter_occurrences(self, chat_id, after=0, chunk_size=GET_MANY_CHUNK):
+        """
+        按消息ID顺序流式遍历一个群组的发布记录
+        
+        每块按 (chat_id, message_id) 索引从上一块的末尾继续查询，不保持长时间打开的游标，
+        遍历途中暂停（如等待 API 限速）也不会因游标超时中断。
+        
+        :param chat_id: 群组ID
+        :param after: 从该消息ID之后开始
+        :param chunk_size: 每次查询的记录数
+        :return: 异步生成器，产出 {_id, message_id, file_unique_id}
+        """
+        while True:
+            occurrences = await self.occurrences.find(
+                {"chat_id": chat_id, "message_id": {"$gt": after}}, {"message_id": 1, "file_unique_id": 1}
+            ).sort("message_id", ASCENDING).limit(chunk_size).to_list(length=chunk_size)
+            for occurrence in occurrences:
+                yield occurrence
+            if len(occurrences) < chunk_size:
+                return
+            after = occurrences[-1]["message_id"]
+    
+    @staticmethod
+    def sort_key(doc):
+        """获取文档的分页排序键，作为下一页的起点"""
+        return (doc["timestamp"], doc["_id"])
+    
+    async def count_search_results(self, keyword, chat_id, filters=None, limit=None):
+        """
+        计算搜索结果总数
+        
+        :param limit: 最多统计的文档数，达到后停止扫描
+        """
+        query = self.build_search_query(keyword, chat_id, filters)
+        if query is None:
+            return 0
+        if limit:
+            return await self.collection.count_documents(query, limit=limit)
+        return await self.collection.count_documents(query)
+    
+    async def indexed_chat_ids(self):
+        """获取已索引媒体文件的全部群组ID（使用 chat_id 前缀索引，不扫描文档）"""
+        return await self.collection.distinct("chat_id")
+    
+    async def get_media_file_by_id(self, file_id):
         """通过ID查找媒体文件"""
-        return self.collection.find_one({"_id": file_id})
+        return await self.collection.find_one({"_id": file_id})
     
     def close(self):
-        """关闭数据库连接"""
-        self.client.close()
+        """关闭共享的数据库连接"""
+        close_client()
@@ -0,0 +1,76 @@
+from pymongo import ASCENDING, UpdateOne
+from datetime import datetime, timedelta
+import logging
+from app.models.database import get_database
+
+logger = logging.getLogger(__name__)
+
+class QueryStatsModel:
+    def __init__(self, retention_days=30):
+        """
+        初始化搜索语句使用统计
+        
+        每条记录对应一个群组中的一个规范化搜索语句：{chat_id, key, keyword, conditions, count, last_used}，
+        keyword 和 conditions 用于重启后重新执行该搜索；超过 retention_days 天未使用的记录由TTL索引删除。
+        
+        :param retention_days: 记录的保留天数
+        """
+        self.db = get_database()
+        self.collection = self.db.query_stats
+        self.retention_days = retention_days
+    
+    async def ensure_indexes(self):
+        """创建唯一索引和过期清理索引"""
+        await self.collection.create_index([("chat_id", ASCENDING), ("key", ASCENDING)], unique=True)
+        await self.collection.create_index(
+            [("last_used", ASCENDING)], expireAfterSeconds=self.retention_days * 24 * 60 * 60
+        )
+    
+    async def increment(self, usage):
+        """
+        批量累加使用次数
+        
+        :param usage: (chat_id, key) -> (keyword, conditions, 次数, 最后使用时间)
+        """
+        if not usage:
+            return
+        operations = [
+            UpdateOne(
+                {"chat_id": chat_id, "key": key},
+                {
+                    "$setOnInsert": {"keyword": keyword, "conditions": [list(condition) for condition in conditions]},
+                    "$inc": {"count": count},
+                    "$max": {"last_used": last_used}
+                },
+                upsert=True
+            )
+            for (chat_id, key), (keyword, conditions, count, last_used) in usage.items()
+        ]
+        await self.collection.bulk_write(operations, ordered=False)
+    
+    async def top_queries(self, per_chat, max_chats, days):
+        """
+        获取最近使用过的群组中最常用的搜索语句
+        
+        :param per_chat: 每个群组最多返回的搜索语句数
+        :param max_chats: 最多返回的群组数，按群组的总搜索次数排序
+        :param days: 只统计最近多少天内使用过的搜索语句
+        :return: [(chat_id, keyword, conditions)]，按群组总搜索次数和语句使用次数降序排列
+        """
+        pipeline = [
+            {"$match": {"last_used": {"$gte": datetime.now() - timedelta(days=days)}}},
+            {"$sort": {"count": -1}},
+            {"$group": {
+                "_id": "$chat_id",
+                "total": {"$sum": "$count"},
+                "queries": {"$push": {"keyword": "$keyword", "conditions": "$conditions"}}
+            }},
+            {"$sort": {"total": -1}},
+            {"$limit": max_chats},
+            {"$project": {"queries": {"$slice": ["$queries", per_chat]}}}
+        ]
+        top = []
+        async for group in self.collection.aggregate(pipeline):
+            for query in group["queries"]:
+                top.append((group["_id"], query["keyword"], query["conditions"]))
+        return top
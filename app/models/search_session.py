@@ -0,0 +1,99 @@
+from pymongo import ASCENDING
+import logging
+from app.models.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# 过期后仍未被清理的会话（例如机器人长时间停机）由TTL索引在该时长后删除
+STALE_SESSION_GRACE = 24 * 60 * 60
+
+class SearchSessionModel:
+    def __init__(self):
+        """
+        初始化搜索会话存储
+        
+        每条记录对应一条搜索结果消息：{_id: "chat_id:message_id", chat_id, message_id, expires_at, session}
+        """
+        self.db = get_database()
+        self.collection = self.db.search_sessions
+    
+    async def ensure_indexes(self):
+        """创建过期清理索引"""
+        await self.collection.create_index(
+            [("expires_at", ASCENDING)], expireAfterSeconds=STALE_SESSION_GRACE
+        )
+    
+    @staticmethod
+    def _doc_id(chat_id, message_id):
+        return f"{chat_id}:{message_id}"
+    
+    @staticmethod
+    def _encode(session):
+        """转换为BSON可存储的结构：元组转为列表，页码键转为字符串"""
+        encoded = dict(session)
+        encoded["keys"] = [list(key) for key in session.get("keys", [])]
+        encoded["cursors"] = {
+            str(page): list(key) if key else None
+            for page, key in session.get("cursors", {}).items()
+        }
+        if session.get("tail"):
+            encoded["tail"] = list(session["tail"])
+        return encoded
+    
+    @staticmethod
+    def _decode(session):
+        """还原 _encode 的转换"""
+        decoded = dict(session)
+        decoded["keys"] = [tuple(key) for key in session.get("keys", [])]
+        decoded["cursors"] = {
+            int(page): tuple(key) if key else None
+            for page, key in session.get("cursors", {}).items()
+        }
+        if session.get("tail"):
+            decoded["tail"] = tuple(session["tail"])
+        return decoded
+    
+    async def save(self, chat_id, message_id, session, expires_at):
+        """
+        保存或覆盖搜索会话
+        
+        :param chat_id: 群组ID
+        :param message_id: 搜索结果消息ID
+        :param session: 会话数据
+        :param expires_at: 过期时间
+        """
+        await self.collection.replace_one(
+            {"_id": self._doc_id(chat_id, message_id)},
+            {
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "expires_at": expires_at,
+                "session": self._encode(session)
+            },
+            upsert=True
+        )
+    
+    async def get(self, chat_id, message_id):
+        """
+        获取搜索会话
+        
+        :return: (会话数据, 过期时间)，不存在时返回None
+        """
+        doc = await self.collection.find_one({"_id": self._doc_id(chat_id, message_id)})
+        if not doc:
+            return None
+        return self._decode(doc["session"]), doc["expires_at"]
+    
+    async def delete(self, chat_id, message_id):
+        """删除搜索会话"""
+        await self.collection.delete_one({"_id": self._doc_id(chat_id, message_id)})
+    
+    async def list_expirations(self):
+        """
+        列出所有会话的过期时间，用于重启后恢复自动删除计划
+        
+        :return: 异步迭代 (chat_id, message_id, expires_at)
+        """
+        cursor = self.collection.find({}, {"chat_id": 1, "message_id": 1, "expires_at": 1})
+        async for doc in cursor:
+            yield doc["chat_id"], doc["message_id"], doc["expires_at"]
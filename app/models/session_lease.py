@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+import logging
+from pymongo.errors import DuplicateKeyError
+from app.models.database import get_database
+
+logger = logging.getLogger(__name__)
+
+class SessionLeaseModel:
+    def __init__(self):
+        """
+        初始化用户会话租约存储
+        
+        每个用户会话一条记录：{_id: 会话名, owner, expires_at}。
+        同一个会话文件是同一个 Telegram 授权，多个进程同时使用会导致会话数据库被锁定和更新被重复处理，
+        持有未过期租约的进程才能启动该会话的用户客户端。
+        """
+        self.db = get_database()
+        self.collection = self.db.session_leases
+    
+    async def acquire(self, session, owner, lease_seconds):
+        """
+        领取或续租会话
+        
+        :param session: 会话名
+        :param owner: 领取者标识
+        :param lease_seconds: 租约时长（秒），持有者退出后超过该时长其他进程才能领取
+        :return: 当前的持有者，领取成功时即为 owner
+        """
+        now = datetime.now()
+        try:
+            await self.collection.update_one(
+                {"_id": session, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=lease_seconds)}},
+                upsert=True
+            )
+            return owner
+        except DuplicateKeyError:
+            # 租约由其他进程持有且未过期，upsert 插入同一 _id 失败
+            lease = await self.collection.find_one({"_id": session})
+            return lease["owner"] if lease else None
+    
+    async def release(self, session, owner):
+        """释放会话，只删除自己持有的租约"""
+        await self.collection.delete_one({"_id": session, "owner": owner})
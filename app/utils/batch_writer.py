@@ -0,0 +1,137 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class MediaBatchWriter:
+    def __init__(self, db, batch_size, flush_interval):
+        """
+        初始化媒体文件批量写入器
+        
+        除了新消息，还可以攒批消息的删除和编辑（替换为其他文件），写入时每个群组的删除合并为一次 remove_messages，
+        编辑只需一次查询比较原来的文件。同一条消息先后加入的操作按到达顺序生效。
+        
+        :param db: MediaFileModel实例
+        :param batch_size: 批次达到该大小时写入
+        :param flush_interval: 批次中最早的记录等待超过该时长（秒）时写入
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        # (chat_id, message_id) -> 编辑后的媒体文件数据
+        self.replacements = {}
+        # chat_id -> 删除的消息ID集合
+        self.removals = {}
+        self.first_added = None
+        # 最近一次写入移出索引的消息数
+        self.removed = 0
+    
+    def __len__(self):
+        return len(self.pending) + len(self.replacements) + sum(len(ids) for ids in self.removals.values())
+    
+    def _touch(self):
+        if not len(self):
+            self.first_added = time.monotonic()
+    
+    def add(self, file_data):
+        """将一条媒体文件数据加入当前批次"""
+        self._touch()
+        self.pending.append(file_data)
+    
+    def replace(self, file_data):
+        """
+        加入一条编辑过的媒体消息：原来的文件不同时先移出原发布，再写入新文件
+        
+        :param file_data: 编辑后的媒体文件数据
+        """
+        self._touch()
+        key = (file_data["chat_id"], file_data["message_id"])
+        self._discard({key})
+        self.replacements[key] = file_data
+    
+    def remove(self, chat_id, message_ids):
+        """
+        加入删除的消息，批次中尚未写入的同一消息一并丢弃
+        
+        :param chat_id: 群组ID
+        :param message_ids: 消息ID列表
+        """
+        self._touch()
+        self._discard({(chat_id, message_id) for message_id in message_ids})
+        self.removals.setdefault(chat_id, set()).update(message_ids)
+    
+    def _discard(self, keys):
+        self.pending = [file_data for file_data in self.pending if (file_data["chat_id"], file_data["message_id"]) not in keys]
+        for key in keys:
+            self.replacements.pop(key, None)
+    
+    def time_until_flush(self):
+        """
+        距离按时间触发写入还剩多少秒
+        
+        :return: 剩余秒数，当前批次为空时返回None（无需定时写入）
+        """
+        if not len(self):
+            return None
+        return max(0.0, self.first_added + self.flush_interval - time.monotonic())
+    
+    def should_flush(self):
+        """批次已满或等待超时时需要写入"""
+        if not len(self):
+            return False
+        return len(self) >= self.batch_size or self.time_until_flush() == 0
+    
+    async def flush(self):
+        """
+        写入当前批次：先移出删除和被替换的发布，再写入新消息和编辑后的文件
+        
+        写入失败时整批放回，异常继续抛出，由调用方稍后重试；
+        各步骤都是幂等的（移出已不存在的发布、upsert 已索引的消息都不做任何修改），重试时重新应用整批。
+        
+        :return: 新插入的记录数量，移出的记录数量保存在 removed 中
+        """
+        self.removed = 0
+        if not len(self):
+            return 0
+        
+        batch, replacements, removals = self.pending, self.replacements, self.removals
+        self.pending, self.replacements, self.removals = [], {}, {}
+        try:
+            return await self._apply(batch, replacements, removals)
+        except Exception:
+            # 写入期间不会加入新数据（调用方等待 flush 完成），直接恢复原批次
+            self.pending, self.replacements, self.removals = batch, replacements, removals
+            raise
+    
+    async def _apply(self, batch, replacements, removals):
+        removals = {chat_id: set(message_ids) for chat_id, message_ids in removals.items()}
+        if replacements:
+            # 文件没有变化的编辑（只改了说明文字）按新消息写入，已索引时不做任何修改
+            for chat_id, changed in (await self._changed_files(replacements)).items():
+                removals.setdefault(chat_id, set()).update(changed)
+            batch = batch + list(replacements.values())
+        for chat_id, message_ids in removals.items():
+            self.removed += await self.db.remove_messages(chat_id, sorted(message_ids))
+        return await self.db.add_media_files(batch)
+    
+    async def _changed_files(self, replacements):
+        """
+        查找编辑后文件与已索引发布不同的消息
+        
+        :return: chat_id -> 消息ID列表
+        """
+        by_chat = {}
+        for chat_id, message_id in replacements:
+            by_chat.setdefault(chat_id, []).append(message_id)
+        
+        changed = {}
+        for chat_id, message_ids in by_chat.items():
+            cursor = self.db.occurrences.find(
+                {"chat_id": chat_id, "message_id": {"$in": message_ids}}, {"message_id": 1, "file_unique_id": 1}
+            )
+            async for occurrence in cursor:
+                file_data = replacements[(chat_id, occurrence["message_id"])]
+                if occurrence["file_unique_id"] != file_data["file_unique_id"]:
+                    changed.setdefault(chat_id, []).append(occurrence["message_id"])
+        return changed
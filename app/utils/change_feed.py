@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ASCENDING
+from app.models.media_file import MediaFileModel
+from app.config.settings import CHANGE_FEED_INTERVAL, CHANGE_FEED_LAG, CHANGE_FEED_BATCH
+
+logger = logging.getLogger(__name__)
+
+# 通知监听器时不读取的大字段
+EXCLUDED_FIELDS = {"search_tokens": 0, "trigrams": 0}
+
+class ChangeFeed:
+    def __init__(self, db=None, interval=CHANGE_FEED_INTERVAL, lag=CHANGE_FEED_LAG,
+                 batch_size=CHANGE_FEED_BATCH, interested=None):
+        """
+        跨进程的写入通知：轮询 media_occurrences 中新增的发布记录，查出对应的目录文档后
+        交给 MediaFileModel 的写入监听器，前端进程的内存索引因此能看到 worker 进程写入的文件；
+        消息删除引起的目录变化记录在 media_removals 中，以同样的方式同步
+        
+        media_occurrences 的 _id 由数据库在 upsert 时生成，按时间递增；并发写入不一定按 _id 顺序提交，
+        因此只读取生成超过 lag 秒的记录，游标之前不会再出现新记录（需要各主机与数据库的时钟同步）。
+        不依赖副本集的 change stream，单机 mongod 也可以使用。
+        
+        :param db: MediaFileModel实例
+        :param interval: 轮询间隔（秒）
+        :param lag: 只读取生成超过该时间的记录（秒）
+        :param batch_size: 每次读取的最大记录数
+        :param interested: 判断是否需要某个群组变化的函数，返回False的群组不查询目录文档；None 表示全部群组
+        """
+        self.db = db or MediaFileModel()
+        self.interval = interval
+        self.lag = lag
+        self.batch_size = batch_size
+        self.interested = interested
+        # 已读取的最后一条发布记录和删除记录的_id
+        self.cursor = None
+        self.removal_cursor = None
+        self.events = 0
+        self._task = None
+    
+    def start(self):
+        """从当前时间开始读取变化，更早的写入已经在数据库中，由内存索引加载时读取"""
+        if self._task is None:
+            self.cursor = self.removal_cursor = ObjectId.from_datetime(self._horizon())
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def _horizon(self):
+        return datetime.now(timezone.utc) - timedelta(seconds=self.lag)
+    
+    async def _run(self):
+        while True:
+            try:
+                # 积压较多时连续读取，直到追上
+                while await self.poll() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"读取新写入的媒体文件失败: {str(e)}")
+            await asyncio.sleep(self.interval)
+    
+    async def poll(self):
+        """
+        读取一批新的发布记录和删除记录并通知写入监听器
+        
+        :return: 两者中读取较多的记录数
+        """
+        # ObjectId.from_datetime 的计数部分为0，$lt 不包含该秒内生成的记录
+        upper = ObjectId.from_datetime(self._horizon())
+        return max(await self._poll_occurrences(upper), await self._poll_removals(upper))
+    
+    async def _poll_occurrences(self, upper):
+        cursor = self.db.occurrences.find(
+            {"_id": {"$gt": self.cursor, "$lt": upper}}, {"chat_id": 1, "file_unique_id": 1}
+        ).sort("_id", ASCENDING).limit(self.batch_size)
+        occurrences = await cursor.to_list(length=self.batch_size)
+        if not occurrences:
+            return 0
+        self.cursor = occurrences[-1]["_id"]
+        
+        files = {}
+        for occurrence in occurrences:
+            chat_id = occurrence["chat_id"]
+            if self.interested is None or self.interested(chat_id):
+                files.setdefault(chat_id, set()).add(occurrence["file_unique_id"])
+        if files:
+            # 新文件是完整文档，重复发布的文件带有最新的 occurrences，监听器都可以按_id处理
+            docs = await self.db.collection.find(
+                {"$or": [
+                    {"chat_id": chat_id, "file_unique_id": {"$in": list(file_unique_ids)}}
+                    for chat_id, file_unique_ids in files.items()
+                ]},
+                EXCLUDED_FIELDS
+            ).to_list(length=None)
+            self.events += len(docs)
+            self.db.notify_written(docs)
+        return len(occurrences)
+    
+    async def _poll_removals(self, upper):
+        """读取删除记录：删除的文件通知为 removed，更新了发布次数或首次发布的文件重新读取"""
+        cursor = self.db.removals.find({"_id": {"$gt": self.removal_cursor, "$lt": upper}}).sort(
+            "_id", ASCENDING
+        ).limit(self.batch_size)
+        removals = await cursor.to_list(length=self.batch_size)
+        if not removals:
+            return 0
+        self.removal_cursor = removals[-1]["_id"]
+        
+        docs = []
+        updated = []
+        for removal in removals:
+            if self.interested is None or self.interested(removal["chat_id"]):
+                docs.extend({"_id": doc_id, "chat_id": removal["chat_id"], "removed": True} for doc_id in removal["removed"])
+                updated.extend(removal["updated"])
+        if updated:
+            projection = {"chat_id": 1, "occurrences": 1, "message_id": 1, "timestamp": 1, "sender_id": 1}
+            docs.extend([doc async for doc in self.db.get_many(updated, projection=projection)])
+        if docs:
+            self.events += len(docs)
+            self.db.notify_written(docs)
+        return len(removals)
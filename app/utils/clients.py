@@ -0,0 +1,131 @@
+import os
+import logging
+import platform
+from pyrogram import Client
+from app.config.settings import (
+    API_ID, API_HASH, BOT_TOKEN, SESSION_NAME, USER_SESSION_NAME,
+    USE_PROXY, PROXY_TYPE, PROXY_HOST, PROXY_PORT, PROXY_USERNAME, PROXY_PASSWORD,
+    MONGODB_MAX_POOL_SIZE, LIVE_UPDATES
+)
+from app.models.database import pool_metrics
+from app.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# 设备标识参数 - 非常重要
+# 这些参数确保客户端被识别为独立设备，不会干扰其他设备的会话
+# 即使在程序退出后重新启动，也会使用相同标识
+DEVICE_MODEL = "TgMediaSearchBot"  # 固定标识，避免随机命名
+SYSTEM_VERSION = platform.system()  # 系统类型
+APP_VERSION = "1.0.0"              # 应用版本
+
+def check_credentials():
+    """检查必要环境变量"""
+    if not API_ID or not API_HASH or not BOT_TOKEN:
+        raise ValueError("缺少必要的API凭据，请检查.env文件")
+
+def build_proxy():
+    """
+    配置代理（如果启用）
+    
+    :return: Pyrogram 的代理参数，未启用时返回None
+    """
+    if not USE_PROXY:
+        return None
+    
+    proxy = {
+        "scheme": PROXY_TYPE,
+        "hostname": PROXY_HOST,
+        "port": PROXY_PORT
+    }
+    
+    if PROXY_USERNAME and PROXY_PASSWORD:
+        proxy["username"] = PROXY_USERNAME
+        proxy["password"] = PROXY_PASSWORD
+    
+    logger.info(f"已配置{PROXY_TYPE}代理")
+    return proxy
+
+def create_user_client(proxy=None):
+    """
+    创建用户客户端 - 用于索引历史消息
+    
+    关键: 保持与auth_user.py中相同的设备标识参数，确保认为是同一设备
+    
+    :param proxy: 代理参数
+    :return: Pyrogram Client
+    """
+    # 检查会话文件
+    user_session_path = f"{USER_SESSION_NAME}.session"
+    if not os.path.isfile(user_session_path):
+        logger.warning(f"未找到用户会话文件: {user_session_path}")
+        logger.warning("请先运行 'python3 auth_user.py' 创建会话文件（使用相同的 USER_SESSION_NAME）")
+    
+    return Client(
+        name=USER_SESSION_NAME,       # 与auth_user.py中相同
+        workdir="./",                 # 确保会话文件路径一致
+        api_id=API_ID,
+        api_hash=API_HASH,
+        proxy=proxy,
+        device_model=DEVICE_MODEL,    # 与用户认证保持一致
+        system_version=SYSTEM_VERSION,
+        app_version=APP_VERSION,
+        in_memory=False,              # 文件存储会话
+        no_updates=not LIVE_UPDATES,  # 接收新消息、编辑和删除更新，由 LiveSync 处理
+        sleep_threshold=0             # FloodWait 交给 TelegramScheduler 处理，以便自适应调整速率
+    )
+
+def create_bot_client(proxy=None, name=SESSION_NAME + "_bot", **kwargs):
+    """
+    创建机器人客户端 - 用于处理搜索命令
+    
+    :param proxy: 代理参数
+    :param name: 会话名称
+    :param kwargs: 其他 Client 参数，如 worker 进程使用的 in_memory、no_updates
+    :return: Pyrogram Client
+    """
+    return Client(
+        name=name,
+        workdir="./",
+        api_id=API_ID,
+        api_hash=API_HASH,
+        proxy=proxy,
+        device_model=f"{DEVICE_MODEL}_Bot",  # 与用户客户端区分
+        system_version=SYSTEM_VERSION,
+        app_version=APP_VERSION,
+        bot_token=BOT_TOKEN,
+        **kwargs
+    )
+
+def register_client_metrics(scheduler=None):
+    """
+    注册用户客户端调度器和 MongoDB 连接池的状态指标，取值函数只在抓取时调用
+    
+    :param scheduler: 用户客户端的 TelegramScheduler，没有用户客户端的进程（前端）传None
+    """
+    if scheduler is not None:
+        registry.gauge("telegram_calls_total", "用户客户端成功的 API 调用数", lambda: scheduler.calls, kind="counter")
+        registry.gauge("telegram_flood_waits_total", "用户客户端遇到的 FloodWait 次数", lambda: scheduler.flood_waits, kind="counter")
+        registry.gauge(
+            "telegram_flood_wait_seconds_total", "FloodWait 要求等待的总时长（秒）",
+            lambda: scheduler.flood_wait_seconds, kind="counter"
+        )
+        registry.gauge("telegram_rate", "用户客户端当前的 API 速率（次/秒）", lambda: scheduler.rate)
+        registry.gauge("telegram_rate_ceiling", "FloodWait 后速率的上限（次/秒）", lambda: scheduler.stats()["ceiling"])
+        registry.gauge(
+            "telegram_backoff_seconds", "FloodWait 退避的剩余时间（秒），没有退避时为0",
+            lambda: scheduler.stats()["backoff"]
+        )
+        for priority in ("interactive", "bulk"):
+            registry.gauge(
+                "telegram_waiting", "等待令牌的请求数",
+                lambda priority=priority: scheduler.stats()[f"waiting_{priority}"], labels={"priority": priority}
+            )
+    
+    registry.gauge("mongodb_pool_connections", "连接池中已打开的连接数", lambda: pool_metrics.open)
+    registry.gauge("mongodb_pool_checked_out", "正在使用的连接数", lambda: pool_metrics.checked_out)
+    registry.gauge("mongodb_pool_max_size", "连接池上限", lambda: MONGODB_MAX_POOL_SIZE)
+    registry.gauge(
+        "mongodb_pool_checkout_failures_total", "借出连接失败次数",
+        lambda: pool_metrics.checkout_failures, kind="counter"
+    )
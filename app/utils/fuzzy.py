@@ -0,0 +1,84 @@
+from app.utils.tokenizer import compact_text
+
+def allowed_distance(length):
+    """
+    按关键词长度确定允许的编辑距离：短关键词只容忍一处错误
+    
+    :param length: 紧凑关键词的长度
+    :return: 最大编辑距离
+    """
+    if length <= 4:
+        return 1
+    if length <= 8:
+        return 2
+    return 3
+
+def substring_distance(pattern, text, max_distance):
+    """
+    有界的近似子串匹配（Sellers 算法）：pattern 与 text 中任意子串的最小编辑距离
+    
+    按文本字符逐列更新动态规划，只保留一维数组；子串可以从任意位置开始，因此第0行恒为0。
+    每列只计算到最后一个不超过上限的行再多一行（Ukkonen 截断），
+    之后的行按上限处理，计算量约为 O(len(text) * max_distance)。
+    
+    :param pattern: 紧凑关键词
+    :param text: 紧凑文件名
+    :param max_distance: 最大编辑距离
+    :return: 编辑距离，超过 max_distance 时返回None
+    """
+    m = len(pattern)
+    if m == 0:
+        return 0
+    if m - max_distance > len(text):
+        return None
+    
+    limit = max_distance + 1
+    # column[i]：pattern 前 i 个字符与以当前位置结尾的某个子串的最小编辑距离
+    column = list(range(m + 1))
+    # 最后一个不超过上限的行，之后的行只需按上限处理
+    active = min(m, max_distance)
+    best = column[m] if active == m else limit
+    
+    for char in text:
+        previous_diagonal = 0
+        column[0] = 0
+        last = min(active + 1, m)
+        for i in range(1, last + 1):
+            current = column[i] if i <= active else limit
+            cost = 0 if pattern[i - 1] == char else 1
+            value = min(current + 1, column[i - 1] + 1, previous_diagonal + cost)
+            previous_diagonal = current
+            column[i] = value
+        
+        # 末尾超过上限的行不再计算，下一列最多向下扩展一行
+        active = last
+        while active > 0 and column[active] > max_distance:
+            active -= 1
+        if active == m:
+            best = min(best, column[m])
+            if best == 0:
+                return 0
+    
+    return best if best <= max_distance else None
+
+def rerank_fuzzy(keyword, candidates):
+    """
+    按编辑距离重排模糊搜索候选，超出允许距离的候选被丢弃
+    
+    :param keyword: 搜索关键词
+    :param candidates: 候选文档列表，需要 file_name、timestamp、_id 字段，可带有 overlap（元组命中数）
+    :return: 按 (编辑距离, 元组命中数降序, 时间降序) 排序的文档列表
+    """
+    pattern = compact_text(keyword)
+    if not pattern:
+        return []
+    max_distance = allowed_distance(len(pattern))
+    
+    scored = []
+    for doc in candidates:
+        distance = substring_distance(pattern, compact_text(doc.get("file_name")), max_distance)
+        if distance is not None:
+            scored.append((distance, doc))
+    
+    scored.sort(key=lambda item: (-item[0], item[1].get("overlap", 0), item[1]["timestamp"], item[1]["_id"]), reverse=True)
+    return [doc for _, doc in scored]
@@ -0,0 +1,387 @@
+from array import array
+from collections import OrderedDict
+from pymongo import ASCENDING
+import re
+import asyncio
+import logging
+import time
+from app.models.media_file import MediaFileModel
+from app.utils.tokenizer import build_search_tokens, build_query_tokens, build_query_substrings, substring_pattern
+from app.utils.query_parser import match_filters
+from app.utils.ranking import rank_documents
+from app.config.settings import HOT_INDEX_MAX_MB, HOT_INDEX_MAX_CHAT_DOCS, SEARCH_COUNT_CAP
+
+logger = logging.getLogger(__name__)
+
+# 每个文档和每个词元的固定内存开销估计（字节），用于内存上限判断
+DOC_OVERHEAD = 350
+TOKEN_OVERHEAD = 120
+POSTING_SIZE = array("I").itemsize
+# 文档数超过上限的群组，间隔多久后重新检查是否可以加载（秒）
+OVERSIZED_RECHECK = 3600
+
+# 加载到内存中的字段，只保留显示、排序和筛选需要的部分
+LOAD_PROJECTION = {
+    "_id": 1, "timestamp": 1, "file_name": 1, "message_id": 1, "media_type": 1,
+    "file_size": 1, "duration": 1, "sender_id": 1, "occurrences": 1
+}
+# 整数数组中表示缺失值（None）的占位
+MISSING = -1
+
+class ChatIndex:
+    """单个群组的内存倒排索引：n元组词元 -> 文档位置数组"""
+    
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        # 按位置存储的文档字段
+        self.ids = []
+        self.timestamps = []
+        self.file_names = []
+        self.message_ids = array("q")
+        self.media_types = []
+        # 同一文件在群组中的发布次数
+        self.occurrences = array("I")
+        # 筛选字段，缺失值存为 MISSING
+        self.file_sizes = array("q")
+        self.durations = array("q")
+        self.sender_ids = array("q")
+        # _id -> 位置
+        self.positions = {}
+        # 词元 -> 升序的文档位置数组
+        self.postings = {}
+        # 文档是否按排序键升序追加，是则倒序即为结果顺序，无需排序
+        self.ordered = True
+        # 已删除文档的位置，数组和倒排表中的数据保留到群组重新加载
+        self.removed = set()
+        self.nbytes = 0
+    
+    def __len__(self):
+        return len(self.ids) - len(self.removed)
+    
+    def add(self, doc):
+        """
+        追加一个文档
+        
+        :param doc: 包含 LOAD_PROJECTION 字段的文档；文档已存在时只需 _id 和变化的字段（occurrences、
+                    首次发布被删除后的 message_id/timestamp/sender_id），removed 为 True 时删除该文档
+        :return: 新增的内存估计（字节），文档已存在时为0
+        """
+        position = self.positions.get(doc["_id"])
+        if position is not None:
+            self._update(position, doc)
+            return 0
+        if doc.get("removed") or "file_name" not in doc:
+            return 0
+        
+        position = len(self.ids)
+        if self.ids and (doc["timestamp"], doc["_id"]) < (self.timestamps[-1], self.ids[-1]):
+            self.ordered = False
+        
+        self.ids.append(doc["_id"])
+        self.timestamps.append(doc["timestamp"])
+        self.file_names.append(doc["file_name"])
+        self.message_ids.append(doc["message_id"])
+        self.media_types.append(doc["media_type"])
+        self.occurrences.append(doc.get("occurrences") or 1)
+        self.file_sizes.append(_int_or_missing(doc.get("file_size")))
+        self.durations.append(_int_or_missing(doc.get("duration")))
+        self.sender_ids.append(_int_or_missing(doc.get("sender_id")))
+        self.positions[doc["_id"]] = position
+        
+        added = DOC_OVERHEAD + len(doc["file_name"].encode("utf-8"))
+        for token in build_search_tokens(doc["file_name"]):
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = array("I")
+                added += TOKEN_OVERHEAD
+            posting.append(position)
+            added += POSTING_SIZE
+        
+        self.nbytes += added
+        return added
+    
+    def _update(self, position, doc):
+        """更新已存在文档的发布次数和首次发布，或标记删除"""
+        if doc.get("removed"):
+            del self.positions[doc["_id"]]
+            self.removed.add(position)
+            return
+        if doc.get("occurrences"):
+            self.occurrences[position] = doc["occurrences"]
+        if "message_id" in doc:
+            self.message_ids[position] = doc["message_id"]
+            self.sender_ids[position] = _int_or_missing(doc.get("sender_id"))
+            if doc["timestamp"] != self.timestamps[position]:
+                self.timestamps[position] = doc["timestamp"]
+                self.ordered = False
+    
+    def match(self, tokens):
+        """
+        查找包含全部词元的文档
+        
+        :param tokens: 查询词元列表
+        :return: 文档位置列表，按 (timestamp, _id) 降序排列
+        """
+        postings = [self.postings.get(token) for token in tokens]
+        if not postings or not all(postings):
+            return []
+        
+        # 从最短的倒排表开始求交集
+        postings.sort(key=len)
+        matched = set(postings[0])
+        for posting in postings[1:]:
+            matched.intersection_update(posting)
+            if not matched:
+                return []
+        
+        matched.difference_update(self.removed)
+        return self._sorted(matched)
+    
+    def all_positions(self):
+        """全部文档位置，按 (timestamp, _id) 降序排列"""
+        return self._sorted(set(range(len(self.ids))) - self.removed)
+    
+    def _sorted(self, positions):
+        if self.ordered:
+            return sorted(positions, reverse=True)
+        return sorted(positions, key=self.sort_key, reverse=True)
+    
+    def sort_key(self, position):
+        return (self.timestamps[position], self.ids[position])
+    
+    def fields(self, position):
+        """获取筛选条件用到的字段"""
+        return {
+            "media_type": self.media_types[position],
+            "file_size": _missing_to_none(self.file_sizes[position]),
+            "duration": _missing_to_none(self.durations[position]),
+            "sender_id": _missing_to_none(self.sender_ids[position])
+        }
+    
+    def document(self, position):
+        """将位置还原为与数据库查询结果兼容的文档"""
+        return {
+            "_id": self.ids[position],
+            "chat_id": self.chat_id,
+            "timestamp": self.timestamps[position],
+            "file_name": self.file_names[position],
+            "message_id": self.message_ids[position],
+            "media_type": self.media_types[position],
+            "occurrences": self.occurrences[position]
+        }
+
+class HotIndex:
+    def __init__(self, db=None, max_bytes=HOT_INDEX_MAX_MB * 1024 * 1024, max_chat_docs=HOT_INDEX_MAX_CHAT_DOCS):
+        """
+        进程内的热点搜索索引，按 chat_id 懒加载，超过内存上限时淘汰最久未搜索的群组
+        
+        查询方法与 MediaFileModel 同名、结果格式相同，群组尚未加载时返回None，
+        调用方应回退到数据库查询；首次查询会在后台加载该群组。
+        通过 MediaFileModel 的写入监听与数据库保持同步。
+        
+        :param db: MediaFileModel实例，用于加载群组数据
+        :param max_bytes: 内存上限（字节，估计值）
+        :param max_chat_docs: 可加载群组的最大文档数，更大的群组始终走数据库
+        """
+        self.db = db or MediaFileModel()
+        self.max_bytes = max_bytes
+        self.max_chat_docs = max_chat_docs
+        # chat_id -> ChatIndex，按最近使用顺序排列
+        self.chats = OrderedDict()
+        # chat_id -> 加载期间收到的新文档
+        self._loading = {}
+        # chat_id -> 判定为超大群组的时间
+        self._oversized = {}
+        # 进行中的后台加载任务，保留引用避免任务在完成前被回收
+        self._tasks = set()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        MediaFileModel.add_write_listener(self.on_insert)
+    
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def search_page(self, keyword, chat_id, limit=10, window=0, count_cap=SEARCH_COUNT_CAP,
+                    filters=None, ranked=False):
+        """
+        与 MediaFileModel.search_page 相同的首页查询，排序和分页方式一致
+        
+        :return: {"total", "capped", "results", "keys", "ranked", "tail"}，群组未加载时返回None
+        """
+        tokens = build_query_tokens(keyword)
+        matched = self._match(tokens, chat_id, filters, build_query_substrings(keyword))
+        if matched is None:
+            return None
+        
+        index = self.chats[chat_id]
+        total = len(matched)
+        ranked = bool(ranked and tokens and window)
+        window_positions = matched[:window]
+        tail = index.sort_key(window_positions[-1]) if window and len(window_positions) == window else None
+        
+        if ranked:
+            ordered = rank_documents([index.document(position) for position in window_positions], tokens)
+            results = ordered[:limit]
+            keys = [MediaFileModel.sort_key(doc) for doc in ordered]
+        else:
+            results = [index.document(position) for position in matched[:limit]]
+            keys = [index.sort_key(position) for position in window_positions]
+        
+        return {
+            "total": min(total, count_cap),
+            "capped": total > count_cap,
+            "results": results,
+            "keys": keys,
+            "ranked": ranked,
+            "tail": tail
+        }
+    
+    def search_media_files(self, keyword, chat_id, after=None, limit=10, filters=None):
+        """
+        与 MediaFileModel.search_media_files 相同的键集分页查询
+        
+        :return: 结果列表，群组未加载时返回None
+        """
+        matched = self._match(build_query_tokens(keyword), chat_id, filters, build_query_substrings(keyword))
+        if matched is None:
+            return None
+        
+        index = self.chats[chat_id]
+        if after is not None:
+            matched = [position for position in matched if index.sort_key(position) < after]
+        return [index.document(position) for position in matched[:limit]]
+    
+    def get_media_files_by_ids(self, chat_id, ids):
+        """
+        与 MediaFileModel.get_media_files_by_ids 相同的按ID查询
+        
+        :return: 媒体文件列表，群组未加载时返回None
+        """
+        index = self._get_chat(chat_id)
+        if index is None:
+            return None
+        return [index.document(index.positions[doc_id]) for doc_id in ids if doc_id in index.positions]
+    
+    def tracks(self, chat_id):
+        """群组是否已加载或正在加载，只有这些群组需要接收写入变化"""
+        return chat_id in self.chats or chat_id in self._loading
+    
+    def on_insert(self, docs):
+        """
+        写入监听：将新插入的文档加入已加载或正在加载的群组，已有文档更新发布次数和首次发布，或删除
+        
+        :param docs: 变化的目录文档列表，包含_id
+        """
+        for doc in docs:
+            chat_id = doc.get("chat_id")
+            if chat_id in self._loading:
+                self._loading[chat_id].append(doc)
+            elif chat_id in self.chats:
+                self.nbytes += self.chats[chat_id].add(doc)
+        self._evict()
+    
+    def stats(self):
+        """获取命中率和内存占用统计"""
+        return {
+            "chats": len(self.chats),
+            "docs": sum(len(index) for index in self.chats.values()),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio
+        }
+    
+    def _match(self, tokens, chat_id, filters=None, substrings=()):
+        """
+        查找匹配的文档位置，语义与 MediaFileModel.build_search_query 一致
+        
+        :param substrings: build_query_substrings 得到的短单词，按 substring_pattern 在文件名中匹配
+        :return: 按 (timestamp, _id) 降序的位置列表，群组未加载时返回None
+        """
+        index = self._get_chat(chat_id)
+        if index is None:
+            return None
+        if tokens:
+            matched = index.match(tokens)
+        elif filters or substrings:
+            matched = index.all_positions()
+        else:
+            return []
+        if substrings:
+            patterns = [re.compile(substring_pattern(text)) for text in substrings]
+            matched = [
+                position for position in matched
+                if all(pattern.search(index.file_names[position]) for pattern in patterns)
+            ]
+        if filters:
+            matched = [position for position in matched if match_filters(filters, index.fields(position))]
+        return matched
+    
+    def _get_chat(self, chat_id):
+        """获取已加载的群组索引并更新最近使用顺序，未加载时在后台开始加载"""
+        index = self.chats.get(chat_id)
+        if index is not None:
+            self.chats.move_to_end(chat_id)
+            self.hits += 1
+            return index
+        
+        self.misses += 1
+        oversized_at = self._oversized.get(chat_id)
+        if chat_id not in self._loading and (
+            oversized_at is None or time.monotonic() - oversized_at >= OVERSIZED_RECHECK
+        ):
+            self._loading[chat_id] = []
+            task = asyncio.create_task(self._load(chat_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+    
+    async def _load(self, chat_id):
+        """从数据库加载群组的全部媒体文件"""
+        started = time.monotonic()
+        try:
+            count = await self.db.collection.count_documents({"chat_id": chat_id})
+            if count > self.max_chat_docs:
+                self._oversized[chat_id] = time.monotonic()
+                logger.info(f"群组 {chat_id} 有 {count} 个媒体文件，超过内存索引上限，继续使用数据库搜索")
+                return
+            
+            index = ChatIndex(chat_id)
+            cursor = self.db.collection.find({"chat_id": chat_id}, LOAD_PROJECTION).sort(
+                [("timestamp", ASCENDING), ("_id", ASCENDING)]
+            )
+            async for doc in cursor:
+                index.add(doc)
+            
+            # 加载期间写入的文档可能已在游标结果中，add 会按_id去重
+            for doc in self._loading[chat_id]:
+                index.add(doc)
+            
+            self._oversized.pop(chat_id, None)
+            self.chats[chat_id] = index
+            self.nbytes += index.nbytes
+            logger.info(
+                f"已将群组 {chat_id} 的 {len(index)} 个媒体文件加载到内存索引，"
+                f"约 {index.nbytes / 1024:.0f}KB，耗时 {time.monotonic() - started:.2f}s"
+            )
+            self._evict()
+        except Exception as e:
+            logger.error(f"加载群组 {chat_id} 的内存索引失败: {str(e)}")
+        finally:
+            self._loading.pop(chat_id, None)
+    
+    def _evict(self):
+        """超过内存上限时淘汰最久未搜索的群组，至少保留最近使用的一个"""
+        while self.nbytes > self.max_bytes and len(self.chats) > 1:
+            chat_id, index = self.chats.popitem(last=False)
+            self.nbytes -= index.nbytes
+            logger.info(f"内存索引已满，淘汰群组 {chat_id}（{len(index)} 个媒体文件）")
+
+def _int_or_missing(value):
+    return MISSING if value is None else int(value)
+
+def _missing_to_none(value):
+    return None if value == MISSING else value
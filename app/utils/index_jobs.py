@@ -0,0 +1,502 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import time
+from app.models.index_job import IndexJobModel, QUEUED, RUNNING, DONE, FAILED, CANCELLED, ACTIVE_STATUSES
+from app.config.settings import (
+    INDEX_CONCURRENCY, INDEX_PROGRESS_INTERVAL, WORKER_ID,
+    JOB_POLL_INTERVAL, JOB_HEARTBEAT_INTERVAL, JOB_HEARTBEAT_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# 任务状态的显示名称
+STATUS_LABELS = {
+    QUEUED: "🕒 排队中",
+    RUNNING: "⏳ 索引中",
+    DONE: "✅ 已完成",
+    FAILED: "❌ 失败",
+    CANCELLED: "🚫 已取消"
+}
+
+def _status_lines(job, position):
+    """
+    生成任务状态文本的公共部分
+    
+    :param job: 任务记录
+    :param position: 前面还有几个排队的任务
+    :return: 文本行列表
+    """
+    lines = [f"索引任务状态：{STATUS_LABELS.get(job['status'], job['status'])}"]
+    if position:
+        lines.append(f"前面还有 {position} 个任务排队")
+    
+    progress = job.get("progress") or {}
+    if progress:
+        lines.append(
+            f"已拉取 {progress.get('fetched', 0)} 条消息，"
+            f"已索引 {progress.get('written', 0)} 个媒体文件"
+        )
+    if job.get("error"):
+        lines.append(f"错误：{job['error']}")
+    return lines
+
+def _cancelled_text(job):
+    return f"🚫 已取消群组 '{job['chat_title']}' 的索引任务。"
+
+async def _edit_job_message(bot, job, text):
+    """更新任务的进度消息，消息已被删除或内容未变化时忽略"""
+    try:
+        await bot.edit_message_text(job["reply_chat_id"], job["reply_message_id"], text)
+    except Exception as e:
+        logger.debug(f"更新索引进度消息失败: {str(e)}")
+
+class IndexJobManager:
+    def __init__(self, indexer, bot, concurrency=INDEX_CONCURRENCY, progress_interval=INDEX_PROGRESS_INTERVAL,
+                 shared=False, worker_id=WORKER_ID):
+        """
+        索引任务队列：多个群组的 /index 请求排队，最多 concurrency 个群组同时索引
+        
+        所有任务共用索引器的 TelegramScheduler，并发只影响排队方式，不会突破 API 速率预算。
+        任务状态保存在 index_jobs 集合中，重启后未完成的任务会重新排队，
+        并借助索引检查点从中断处继续。
+        
+        shared 为 True 时（worker 进程）不维护内存队列，而是从 index_jobs 集合中原子地领取任务，
+        多个 worker 可以同时运行；进行中的任务定期写入心跳，心跳超时的任务由其他 worker 接手，
+        前端取消任务后在下一次心跳时停止。
+        
+        :param indexer: MediaIndexer实例
+        :param bot: 机器人客户端，用于更新进度消息
+        :param concurrency: 同时进行的索引任务数
+        :param progress_interval: 进度消息的最短更新间隔（秒）
+        :param shared: 是否从共享的任务集合中领取任务
+        :param worker_id: 领取任务时使用的 worker 标识
+        """
+        self.indexer = indexer
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.progress_interval = progress_interval
+        self.shared = shared
+        self.worker_id = worker_id
+        self.model = IndexJobModel()
+        # chat_id -> 任务记录，按提交顺序排队
+        self._pending = OrderedDict()
+        # chat_id -> (任务记录, 索引任务)
+        self._running = {}
+        # 被用户取消的任务ID，用于区分取消和停止
+        self._cancelled = set()
+        # 已被其他 worker 接手的任务ID，本地停止执行但不修改任务状态
+        self._released = set()
+        self._condition = asyncio.Condition()
+        self._workers = []
+        self._heartbeat_task = None
+    
+    def __len__(self):
+        """排队中的任务数"""
+        return len(self._pending)
+    
+    def is_active(self, chat_id):
+        """群组是否有排队中或进行中的任务"""
+        return chat_id in self._pending or chat_id in self._running
+    
+    def running_count(self):
+        """进行中的任务数"""
+        return len(self._running)
+    
+    async def has_active(self, chat_id):
+        """与 is_active 相同，与 IndexJobQueue 的接口一致"""
+        return self.is_active(chat_id)
+    
+    async def queued(self):
+        """排队中的任务数"""
+        return len(self._pending)
+    
+    def queue_position(self, chat_id):
+        """
+        获取任务在队列中的位置
+        
+        :return: 前面还有几个排队的任务，进行中时为0，没有任务时为None
+        """
+        if chat_id in self._running:
+            return 0
+        for position, pending_chat_id in enumerate(self._pending):
+            if pending_chat_id == chat_id:
+                return position
+        return None
+    
+    async def start(self):
+        """恢复未完成的任务并启动工作协程"""
+        if self._workers:
+            return
+        
+        await self.model.ensure_indexes()
+        if self.shared:
+            # 未完成的任务留在集合中，由 _next_job 领取
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        else:
+            restored = 0
+            for job in await self.model.list_active():
+                if job["status"] == RUNNING:
+                    job = await self.model.set_status(job["_id"], QUEUED)
+                self._pending[job["chat_id"]] = job
+                restored += 1
+            if restored:
+                logger.info(f"已恢复 {restored} 个未完成的索引任务")
+        
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+    
+    async def stop(self):
+        """
+        停止工作协程，进行中的任务保持 running 状态，重启后继续；
+        共享队列中的任务改回 queued，其他 worker 可以立即接手
+        """
+        running = [job for job, _ in self._running.values()]
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, *filter(None, [self._heartbeat_task]), return_exceptions=True)
+        self._workers = []
+        self._heartbeat_task = None
+        
+        if self.shared:
+            for job in running:
+                try:
+                    # 心跳超时后任务可能已被其他 worker 接手，只归还仍由本 worker 执行的任务
+                    await self.model.set_status(job["_id"], QUEUED, expected=[RUNNING], worker_id=self.worker_id)
+                except Exception as e:
+                    logger.error(f"归还索引任务 {job['_id']} 失败: {str(e)}")
+    
+    async def submit(self, chat_id, chat_title, requested_by, reply_message):
+        """
+        提交群组索引任务
+        
+        :param chat_id: 群组ID
+        :param chat_title: 群组名称
+        :param requested_by: 发起索引的用户ID
+        :param reply_message: 用于显示进度的消息
+        :return: 任务记录，群组已有未完成的任务时返回None
+        """
+        if self.is_active(chat_id):
+            return None
+        
+        # 检查和插入之间可能有并发的提交，由 index_jobs 的唯一索引保证只创建一个任务
+        job = await self.model.create(chat_id, chat_title, requested_by, reply_message.chat.id, reply_message.id)
+        if job is None:
+            return None
+        async with self._condition:
+            self._pending[chat_id] = job
+            self._condition.notify()
+        return job
+    
+    async def cancel(self, chat_id):
+        """
+        取消群组的索引任务，已写入的部分保留在检查点中
+        
+        :param chat_id: 群组ID
+        :return: 是否有任务被取消
+        """
+        job = self._pending.pop(chat_id, None)
+        if job:
+            await self.model.set_status(job["_id"], CANCELLED, expected=[QUEUED])
+            await self._edit(job, _cancelled_text(job))
+            return True
+        
+        running = self._running.get(chat_id)
+        if running:
+            job, task = running
+            self._cancelled.add(job["_id"])
+            task.cancel()
+            return True
+        
+        return False
+    
+    async def status_text(self, chat_id):
+        """
+        生成群组索引任务的状态文本
+        
+        :param chat_id: 群组ID
+        :return: 状态文本
+        """
+        running = self._running.get(chat_id)
+        job = running[0] if running else self._pending.get(chat_id)
+        if job is None:
+            job = await self.model.find_latest(chat_id)
+        if job is None:
+            return "ℹ️ 该群组还没有索引任务，使用 `/index` 开始索引。"
+        
+        lines = _status_lines(job, self.queue_position(chat_id))
+        lines.append(f"同时索引 {len(self._running)}/{self.concurrency} 个群组，{len(self._pending)} 个排队")
+        return "\n".join(lines)
+    
+    async def _next_job(self):
+        """
+        等待并取出下一个排队的任务，开始执行并登记为进行中
+        
+        :return: (任务记录, 索引任务)
+        """
+        if self.shared:
+            while True:
+                stale_before = datetime.now() - timedelta(seconds=JOB_HEARTBEAT_TIMEOUT)
+                job = await self.model.claim(self.worker_id, stale_before)
+                if job is not None:
+                    return self._start(job)
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+        
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._pending)
+            _, job = self._pending.popitem(last=False)
+            # 与出队在同一个锁内登记为进行中，is_active 不会在两者之间返回False
+            return self._start(job)
+    
+    def _start(self, job):
+        """
+        创建任务的索引协程并登记为进行中
+        
+        :return: (任务记录, 索引任务)
+        """
+        task = asyncio.create_task(self._index(job))
+        self._running[job["chat_id"]] = (job, task)
+        return job, task
+    
+    async def _index(self, job):
+        """
+        将任务标记为进行中并索引群组历史
+        
+        :return: IndexingStats，任务已不在排队状态时返回None
+        """
+        # 共享队列中领取的任务已经是 running 状态
+        if job["status"] == QUEUED:
+            job = await self.model.set_status(job["_id"], RUNNING, expected=[QUEUED])
+            if job is None:
+                return None
+        
+        await self._edit(job, self._format_progress(job, None))
+        return await self.indexer.index_chat_history(job["chat_id"], progress=self._progress_callback(job))
+    
+    async def _worker(self):
+        while True:
+            job, task = await self._next_job()
+            try:
+                await self._run_job(job, task)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"执行索引任务时出错: {str(e)}")
+                logger.exception(e)
+    
+    async def _heartbeat(self):
+        """刷新进行中任务的心跳，停止已被前端取消或已被其他 worker 接手的任务"""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            running = {job["_id"]: task for job, task in self._running.values()}
+            try:
+                lost = await self.model.heartbeat(list(running), self.worker_id)
+            except Exception as e:
+                logger.warning(f"刷新索引任务心跳失败: {str(e)}")
+                continue
+            for job_id, status in lost.items():
+                if status == CANCELLED:
+                    self._cancelled.add(job_id)
+                else:
+                    self._released.add(job_id)
+                running[job_id].cancel()
+    
+    async def _run_job(self, job, task):
+        """
+        等待单个索引任务结束并更新任务状态
+        
+        :param job: 任务记录
+        :param task: _start 创建的索引任务
+        """
+        chat_id = job["chat_id"]
+        try:
+            stats = await task
+        except asyncio.CancelledError:
+            if job["_id"] in self._released:
+                self._released.discard(job["_id"])
+                logger.warning(f"群组 {chat_id} 的索引任务已由其他 worker 接手，停止本地执行")
+                return
+            if job["_id"] not in self._cancelled:
+                # 机器人正在停止，任务保持 running 状态，重启后继续
+                raise
+            self._cancelled.discard(job["_id"])
+            await self.model.set_status(job["_id"], CANCELLED)
+            await self._edit(
+                job,
+                f"🚫 已取消群组 '{job['chat_title']}' 的索引任务。\n"
+                f"已索引的部分已保存，再次使用 `/index` 会从中断处继续。"
+            )
+            return
+        except Exception as e:
+            await self._fail(job, str(e))
+            return
+        finally:
+            self._running.pop(chat_id, None)
+        
+        if stats is None:
+            return
+        await self.model.set_progress(job["_id"], self._progress_fields(stats))
+        # index_chat_history 不抛出拉取错误，只在 stats 中标记失败
+        if stats.failed:
+            await self._fail(job, stats.error or "拉取历史消息失败")
+            return
+        if await self._finish(job, DONE):
+            await self._edit(job, self._format_summary(job, stats))
+    
+    async def _finish(self, job, status, error=None):
+        """
+        结束进行中的任务
+        
+        任务完成前的一刻可能已被 /index cancel 取消，或因心跳超时被其他 worker 接手，
+        此时不覆盖任务状态；已取消的任务改为显示取消消息。
+        
+        :return: 是否更新了任务状态
+        """
+        worker_id = self.worker_id if self.shared else None
+        if await self.model.set_status(job["_id"], status, error=error, expected=[RUNNING], worker_id=worker_id):
+            return True
+        current = await self.model.get(job["_id"])
+        if current is not None and current["status"] == CANCELLED:
+            await self._edit(job, _cancelled_text(job))
+        else:
+            logger.warning(f"群组 {job['chat_id']} 的索引任务已由其他 worker 接手，不更新任务状态")
+        return False
+    
+    async def _fail(self, job, error):
+        """将任务标记为失败并更新进度消息"""
+        logger.error(f"索引群组 {job['chat_id']} 失败: {error}")
+        if not await self._finish(job, FAILED, error):
+            return
+        await self._edit(
+            job,
+            f"❌ 索引过程出错: {error}\n\n"
+            "此错误可能是因为用户客户端权限不足或其他限制导致。已索引的部分已保存，再次使用 `/index` 会从中断处继续。"
+        )
+    
+    def _progress_callback(self, job):
+        """
+        创建任务的进度回调，按 progress_interval 限制进度消息的更新频率
+        
+        :param job: 任务记录
+        :return: 异步回调函数，参数为 IndexingStats
+        """
+        last_update = time.monotonic()
+        
+        async def progress(stats):
+            nonlocal last_update
+            if time.monotonic() - last_update < self.progress_interval:
+                return
+            last_update = time.monotonic()
+            
+            try:
+                await self.model.set_progress(job["_id"], self._progress_fields(stats))
+            except Exception as e:
+                logger.warning(f"保存索引进度失败: {str(e)}")
+            await self._edit(job, self._format_progress(job, stats))
+        
+        return progress
+    
+    @staticmethod
+    def _progress_fields(stats):
+        """获取需要持久化的进度字段"""
+        return {
+            "fetched": stats.counts["fetch"],
+            "written": stats.written,
+            "new_messages": stats.new_messages
+        }
+    
+    def _format_progress(self, job, stats):
+        """生成进度消息文本"""
+        text = f"🔍 正在索引群组 '{job['chat_title']}' 的历史媒体文件...\n"
+        if stats is None:
+            text += "这可能需要一些时间，取决于群组大小和历史消息数量。\n"
+        else:
+            text += (
+                f"已拉取 {stats.counts['fetch']} 条消息，已索引 {stats.written} 个媒体文件\n"
+                f"API速率 {self.indexer.scheduler.rate:.2f} 次/秒\n"
+            )
+        return text + "\n使用 `/index status` 查看进度，`/index cancel` 取消索引。"
+    
+    @staticmethod
+    def _format_summary(job, stats):
+        """生成索引完成消息文本"""
+        # 已有检查点时只补齐了缺口，报告增量结果
+        if stats.incremental:
+            summary = (
+                f"✅ 增量索引完成！本次仅补齐 {stats.new_messages} 条新消息（无需完整重扫），"
+                f"为群组 '{job['chat_title']}' 新增了 {stats.written} 个媒体文件。\n\n"
+            )
+        else:
+            summary = f"✅ 索引完成！已为群组 '{job['chat_title']}' 索引了 {stats.written} 个媒体文件。\n\n"
+        
+        return (
+            summary +
+            "使用 `/f 关键词` 来搜索文件。\n"
+            "使用 `/help` 获取更多帮助。"
+        )
+    
+    async def _edit(self, job, text):
+        await _edit_job_message(self.bot, job, text)
+
+class IndexJobQueue:
+    def __init__(self, bot):
+        """
+        前端进程（RUN_MODE=frontend）使用的索引任务队列：只把任务写入 index_jobs 集合，
+        由 worker 进程中的 IndexJobManager 领取执行，状态和取消都通过集合完成
+        
+        :param bot: 机器人客户端，用于更新已取消任务的消息
+        """
+        self.bot = bot
+        self.model = IndexJobModel()
+    
+    async def start(self):
+        await self.model.ensure_indexes()
+    
+    async def stop(self):
+        pass
+    
+    async def has_active(self, chat_id):
+        """群组是否有排队中或进行中的任务"""
+        return await self.model.has_active(chat_id)
+    
+    async def queued(self):
+        """排队中的任务数"""
+        return await self.model.count_queued()
+    
+    async def submit(self, chat_id, chat_title, requested_by, reply_message):
+        """
+        提交群组索引任务
+        
+        :return: 任务记录，群组已有未完成的任务时返回None
+        """
+        if await self.model.has_active(chat_id):
+            return None
+        return await self.model.create(chat_id, chat_title, requested_by, reply_message.chat.id, reply_message.id)
+    
+    async def cancel(self, chat_id):
+        """
+        取消群组的索引任务：排队中的任务直接取消，进行中的任务由 worker 在下一次心跳时停止
+        
+        :return: 是否有任务被取消
+        """
+        job = await self.model.find_latest(chat_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return False
+        if await self.model.set_status(job["_id"], CANCELLED, expected=ACTIVE_STATUSES) is None:
+            return False
+        if job["status"] == QUEUED:
+            await _edit_job_message(self.bot, job, _cancelled_text(job))
+        return True
+    
+    async def status_text(self, chat_id):
+        """生成群组索引任务的状态文本"""
+        job = await self.model.find_latest(chat_id)
+        if job is None:
+            return "ℹ️ 该群组还没有索引任务，使用 `/index` 开始索引。"
+        
+        position = await self.model.count_queued(before=job["created_at"]) if job["status"] == QUEUED else 0
+        lines = _status_lines(job, position)
+        lines.append(f"{await self.model.count_running()} 个群组索引中，{await self.model.count_queued()} 个排队")
+        return "\n".join(lines)
@@ -4,62 +4,360 @@ from pyrogram.enums import MessageMediaType
 from datetime import datetime
 import asyncio
 import logging
+import time
 from app.models.media_file import MediaFileModel
+from app.models.index_checkpoint import IndexCheckpointModel
+from app.utils.batch_writer import MediaBatchWriter
+from app.utils.ingest_queue import IngestionQueue
+from app.utils.telegram_scheduler import TelegramScheduler, BULK
+from app.utils.message_fetcher import fetch_messages
+from app.utils.metrics import registry
+from app.config.settings import (
+    HISTORY_PAGE_SIZE, INDEX_BATCH_SIZE,
+    INDEX_FLUSH_INTERVAL, INDEX_STATS_INTERVAL
+)
 
 logger = logging.getLogger(__name__)
 
+# 拉取阶段与提取阶段之间最多缓存的消息页数
+PIPELINE_QUEUE_PAGES = 4
+
+# 吞吐量计数器，消息数/秒和写入数/秒由 Prometheus 的 rate() 计算
+HISTORY_MESSAGES = registry.counter("indexer_messages_total", "索引器处理的消息数", {"source": "history"})
+LIVE_MESSAGES = registry.counter("indexer_messages_total", "索引器处理的消息数", {"source": "live"})
+HISTORY_INSERTS = registry.counter("indexer_media_inserted_total", "新索引的媒体文件消息数", {"source": "history"})
+
+class CheckpointMark:
+    """随流水线传递的检查点标记，对应的数据写入数据库后才保存"""
+    
+    def __init__(self, oldest_id=None, newest_id=None, backfill_done=False):
+        self.oldest_id = oldest_id
+        self.newest_id = newest_id
+        self.backfill_done = backfill_done
+    
+    def merge(self, other):
+        """合并两个标记，得到覆盖两者的区间"""
+        if other is None:
+            return self
+        return CheckpointMark(
+            oldest_id=min(filter(None, (self.oldest_id, other.oldest_id)), default=None),
+            newest_id=max(filter(None, (self.newest_id, other.newest_id)), default=None),
+            backfill_done=self.backfill_done or other.backfill_done
+        )
+
+class IndexingStats:
+    """索引流水线各阶段的吞吐量统计"""
+    
+    STAGES = ("fetch", "extract", "write")
+    
+    def __init__(self, incremental=False):
+        self.started = time.monotonic()
+        self.counts = {stage: 0 for stage in self.STAGES}
+        self.busy = {stage: 0.0 for stage in self.STAGES}
+        self.written = 0
+        # 是否基于已有检查点增量索引，以及补齐的新消息数
+        self.incremental = incremental
+        self.new_messages = 0
+        # 已拉取到的最新消息ID（含检查点中已索引的部分），拉取是否中途失败及失败原因
+        self.newest_id = None
+        self.failed = False
+        self.error = None
+    
+    def record(self, stage, count, elapsed):
+        """
+        记录某个阶段处理的条目数和耗时
+        
+        :param stage: 阶段名称
+        :param count: 处理的条目数
+        :param elapsed: 处理耗时（秒）
+        """
+        self.counts[stage] += count
+        self.busy[stage] += elapsed
+    
+    def summary(self):
+        """生成各阶段吞吐量摘要：整体速率（条/秒）及该阶段的忙碌时间"""
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        parts = [
+            f"{stage} {self.counts[stage] / elapsed:.1f}/s (忙碌 {self.busy[stage]:.1f}s)"
+            for stage in self.STAGES
+        ]
+        return ", ".join(parts) + f", 耗时 {elapsed:.1f}s"
+
 class MediaIndexer:
-    def __init__(self, client: Client):
+    def __init__(self, client: Client, scheduler=None):
         """
         初始化媒体索引器
         
         :param client: Pyrogram客户端实例
+        :param scheduler: 该客户端共用的 TelegramScheduler，不传时单独创建
         """
         self.client = client
+        self.scheduler = scheduler or TelegramScheduler()
         self.db = MediaFileModel()
+        self.checkpoints = IndexCheckpointModel()
+        # 实时消息的后写队列
+        self.ingest_queue = IngestionQueue(self.db)
     
-    async def index_chat_history(self, chat_id):
+    async def index_chat_history(self, chat_id, progress=None, backfill=True):
         """
         索引指定群组的历史媒体消息
         
+        使用三阶段流水线：拉取历史 -> 提取媒体 -> 批量写入，
+        各阶段通过有界队列连接，限速只作用于 Telegram API 调用。
+        
+        已有检查点时只拉取缺口：先拉取检查点之后的新消息，
+        再从最旧的检查点继续回溯尚未完成的历史。
+        
+        任务被取消时抛出 asyncio.CancelledError，已写入部分的检查点保持不变，
+        下次索引会从中断处继续。
+        
         :param chat_id: 群组ID
-        :return: 索引的媒体文件数量
+        :param progress: 每批写入后调用的异步回调，参数为 IndexingStats，由调用方自行限制频率
+        :param backfill: 是否回溯历史；False 时只补拉检查点之后的新消息，没有检查点时不拉取
+        :return: IndexingStats，written 为新索引的媒体文件数量
         """
-        logger.info(f"开始索引群组 {chat_id} 的历史媒体文件")
-        count = 0
+        checkpoint = await self.checkpoints.get_checkpoint(chat_id)
+        stats = IndexingStats(incremental=checkpoint is not None)
+        # 实时同步频繁补拉缺口，只在调试日志中记录
+        log = logger.info if backfill else logger.debug
+        if checkpoint:
+            stats.newest_id = checkpoint.get("newest_id")
+            log(
+                f"开始增量索引群组 {chat_id}：已索引区间 "
+                f"{checkpoint.get('oldest_id')}-{checkpoint.get('newest_id')}，"
+                f"历史回溯{'已完成' if checkpoint.get('backfill_done') else '未完成'}"
+            )
+        else:
+            log(f"开始索引群组 {chat_id} 的历史媒体文件")
+        
+        pages = asyncio.Queue(maxsize=PIPELINE_QUEUE_PAGES)
+        files = asyncio.Queue(maxsize=INDEX_BATCH_SIZE * 2)
+        
+        stages = [
+            asyncio.create_task(self._fetch_stage(chat_id, checkpoint, pages, stats, backfill)),
+            asyncio.create_task(self._extract_stage(pages, files, stats)),
+            asyncio.create_task(self._write_stage(chat_id, files, stats, progress))
+        ]
         
         try:
-            async for message in self.client.get_chat_history(chat_id):  # type: Message
-                if await self._process_message(message):
-                    count += 1
-                    
-                # 每处理100条消息输出一次日志
-                if count > 0 and count % 100 == 0:
-                    logger.info(f"已索引 {count} 条媒体文件")
-                    
-                # 避免请求过于频繁
-                await asyncio.sleep(0.05)
-                
+            await asyncio.gather(*stages)
+        except asyncio.CancelledError:
+            for stage in stages:
+                stage.cancel()
+            logger.info(f"群组 {chat_id} 的索引已取消，已索引 {stats.written} 条媒体文件 | {stats.summary()}")
+            raise
         except Exception as e:
             logger.error(f"索引群组 {chat_id} 历史时出错: {str(e)}")
             logger.exception(e)
+            stats.failed = True
+            stats.error = stats.error or str(e)
+            for stage in stages:
+                stage.cancel()
+        
+        log(f"群组 {chat_id} 历史索引完成，共索引 {stats.written} 条媒体文件 | {stats.summary()}")
+        return stats
+    
+    async def sync_chat(self, chat_id):
+        """
+        补拉已索引群组在检查点之后的新消息，不回溯历史
+        
+        没有新消息时只需要一次 API 调用，实时同步用它补齐停机或更新丢失造成的缺口。
+        
+        :param chat_id: 群组ID
+        :return: IndexingStats，newest_id 为补拉后已覆盖的最新消息ID，failed 表示拉取中途失败
+        """
+        return await self.index_chat_history(chat_id, backfill=False)
+    
+    async def _fetch_stage(self, chat_id, checkpoint, pages, stats, backfill=True):
+        """
+        流水线第一阶段：按页拉取历史消息
+        
+        :param chat_id: 群组ID
+        :param checkpoint: 群组的索引检查点，没有时为None
+        :param pages: 输出队列，元素为 (消息列表, CheckpointMark)，None表示结束
+        :param stats: 流水线统计
+        :param backfill: 是否回溯历史
+        """
+        try:
+            if checkpoint:
+                # 先补齐检查点之后的新消息
+                stats.new_messages = await self._fetch_range(
+                    chat_id, pages, stats, offset_id=0, stop_id=checkpoint.get("newest_id") or 0, gap=True
+                )
+                # 再从最旧的检查点继续回溯
+                if backfill and not checkpoint.get("backfill_done") and checkpoint.get("oldest_id"):
+                    await self._fetch_range(chat_id, pages, stats, offset_id=checkpoint["oldest_id"])
+            elif backfill:
+                await self._fetch_range(chat_id, pages, stats)
+        except Exception as e:
+            # 拉取失败时保留已拉取的部分，让后续阶段正常写完并保存检查点
+            logger.error(f"拉取群组 {chat_id} 历史消息时出错: {str(e)}")
+            logger.exception(e)
+            stats.failed = True
+            stats.error = str(e)
+        finally:
+            await pages.put(None)
+    
+    async def _fetch_range(self, chat_id, pages, stats, offset_id=0, stop_id=0, gap=False):
+        """
+        从新到旧拉取 offset_id 之前、stop_id 之后的消息
+        
+        每页对应一次 get_chat_history API 调用，由 TelegramScheduler 以批量优先级限速。
+        
+        :param chat_id: 群组ID
+        :param pages: 输出队列
+        :param stats: 流水线统计
+        :param offset_id: 从该消息ID之前开始拉取，0表示从最新消息开始
+        :param stop_id: 遇到不大于该ID的消息时停止，0表示拉取到群组的第一条消息
+        :param gap: 是否为补齐新消息的缺口阶段
+        :return: 拉取的消息数量
+        """
+        fetched = 0
+        newest_id = None
+        while True:
+            started = time.monotonic()
+            messages = await self.scheduler.call(self._get_history_page, chat_id, offset_id, priority=BULK)
+            stats.record("fetch", len(messages), time.monotonic() - started)
+            
+            finished = len(messages) < HISTORY_PAGE_SIZE
+            if stop_id:
+                in_range = [message for message in messages if message.id > stop_id]
+                finished = finished or len(in_range) < len(messages)
+                messages = in_range
+            
+            fetched += len(messages)
+            HISTORY_MESSAGES.inc(len(messages))
+            if messages and newest_id is None:
+                newest_id = messages[0].id
+                stats.newest_id = max(stats.newest_id or 0, newest_id)
+            
+            if gap:
+                # 缺口必须完整写入后才能推进 newest_id，中途中断时下次会重新补齐
+                mark = CheckpointMark(newest_id=newest_id if finished else None)
+            else:
+                mark = CheckpointMark(
+                    oldest_id=messages[-1].id if messages else None,
+                    newest_id=newest_id,
+                    backfill_done=finished
+                )
+            await pages.put((messages, mark))
+            
+            if finished:
+                return fetched
+            
+            offset_id = messages[-1].id
+    
+    async def _get_history_page(self, chat_id, offset_id):
+        """
+        拉取一页历史消息，对应一次 API 调用
         
-        logger.info(f"群组 {chat_id} 历史索引完成，共索引 {count} 条媒体文件")
-        return count
+        :param chat_id: 群组ID
+        :param offset_id: 从该消息ID之前开始拉取，0表示从最新消息开始
+        :return: 消息列表，从新到旧
+        """
+        return [
+            message async for message in self.client.get_chat_history(
+                chat_id, limit=HISTORY_PAGE_SIZE, offset_id=offset_id
+            )
+        ]
+    
+    async def _extract_stage(self, pages, files, stats):
+        """
+        流水线第二阶段：从消息中提取媒体文件数据
+        
+        每页的媒体文件之后附带该页的 CheckpointMark，保证检查点在数据写入之后才推进。
+        
+        :param pages: 输入队列，元素为 (消息列表, CheckpointMark)
+        :param files: 输出队列，元素为媒体文件数据或 CheckpointMark，None表示结束
+        :param stats: 流水线统计
+        """
+        while True:
+            page = await pages.get()
+            if page is None:
+                break
+            
+            messages, mark = page
+            started = time.monotonic()
+            extracted = [self._extract_media(message) for message in messages]
+            extracted = [file_data for file_data in extracted if file_data]
+            stats.record("extract", len(extracted), time.monotonic() - started)
+            
+            for file_data in extracted:
+                await files.put(file_data)
+            await files.put(mark)
+        
+        await files.put(None)
     
-    async def _process_message(self, message):
+    async def _write_stage(self, chat_id, files, stats, progress=None):
         """
-        处理单条消息，如果是音频或视频则添加到数据库
+        流水线第三阶段：攒批后通过 bulk_write 写入数据库，并保存检查点
+        
+        批次达到 INDEX_BATCH_SIZE 或距上次写入超过 INDEX_FLUSH_INTERVAL 秒时写入。
+        
+        :param chat_id: 群组ID
+        :param files: 输入队列，元素为媒体文件数据或 CheckpointMark
+        :param stats: 流水线统计
+        :param progress: 每批写入后调用的异步进度回调
+        """
+        writer = MediaBatchWriter(self.db, INDEX_BATCH_SIZE, INDEX_FLUSH_INTERVAL)
+        pending_mark = None
+        last_checkpoint = time.monotonic()
+        last_log = time.monotonic()
+        
+        while True:
+            try:
+                item = await asyncio.wait_for(files.get(), timeout=writer.time_until_flush())
+            except asyncio.TimeoutError:
+                item = False
+            
+            if isinstance(item, CheckpointMark):
+                pending_mark = item.merge(pending_mark)
+            elif item:
+                writer.add(item)
+            
+            if item is None or writer.should_flush():
+                started = time.monotonic()
+                flushed = len(writer)
+                inserted = await writer.flush()
+                stats.record("write", flushed, time.monotonic() - started)
+                stats.written += inserted
+                HISTORY_INSERTS.inc(inserted)
+                if progress and flushed:
+                    await progress(stats)
+            
+            # 待写入批次为空时，之前收到的标记对应的数据都已落库，可以保存检查点
+            if pending_mark and not len(writer) and (
+                item is None or time.monotonic() - last_checkpoint >= INDEX_FLUSH_INTERVAL
+            ):
+                await self.checkpoints.advance(
+                    chat_id, pending_mark.oldest_id, pending_mark.newest_id, pending_mark.backfill_done
+                )
+                pending_mark = None
+                last_checkpoint = time.monotonic()
+            
+            if time.monotonic() - last_log >= INDEX_STATS_INTERVAL:
+                logger.info(
+                    f"已索引 {stats.written} 条媒体文件 | {stats.summary()} | "
+                    f"API速率 {self.scheduler.rate:.2f} 次/秒"
+                )
+                last_log = time.monotonic()
+            
+            if item is None:
+                break
+    
+    def _extract_media(self, message):
+        """
+        从消息中提取音频或视频文件数据
         
         :param message: Pyrogram消息对象
-        :return: 是否成功处理了媒体文件
+        :return: 媒体文件数据，不是音频或视频时返回None
         """
         if not message.media:
-            return False
+            return None
             
         media_type = None
         file_name = None
-        file_id = None
+        file_unique_id = None
         file_size = None
         duration = None
         
@@ -68,14 +366,14 @@ class MediaIndexer:
             media_type = "audio"
             media = message.audio
             file_name = media.file_name or f"audio_{message.id}.mp3"
-            file_id = media.file_id
+            file_unique_id = media.file_unique_id
             file_size = media.file_size
             duration = media.duration
         elif message.video:
             media_type = "video"
             media = message.video
             file_name = media.file_name or f"video_{message.id}.mp4"
-            file_id = media.file_id
+            file_unique_id = media.file_unique_id
             file_size = media.file_size
             duration = media.duration
         elif message.document and message.document.mime_type:
@@ -84,21 +382,21 @@ class MediaIndexer:
                 media_type = "audio"
                 media = message.document
                 file_name = media.file_name or f"audio_{message.id}"
-                file_id = media.file_id
+                file_unique_id = media.file_unique_id
                 file_size = media.file_size
             elif mime.startswith("video/"):
                 media_type = "video"
                 media = message.document
                 file_name = media.file_name or f"video_{message.id}"
-                file_id = media.file_id
+                file_unique_id = media.file_unique_id
                 file_size = media.file_size
         
         if not media_type:
-            return False
+            return None
             
         # 准备文件数据
-        file_data = {
-            "file_id": file_id,
+        return {
+            "file_unique_id": file_unique_id,
             "file_name": file_name,
             "message_id": message.id,
             "chat_id": message.chat.id,
@@ -108,20 +406,74 @@ class MediaIndexer:
             "file_size": file_size,
             "duration": duration
         }
+    
+    async def process_new_message(self, message):
+        """
+        处理新消息，如果是媒体文件则加入后写队列，由后台任务批量写入索引
         
-        # 添加到数据库
-        try:
-            result = self.db.add_media_file(file_data)
-            return result is not None
-        except Exception as e:
-            logger.error(f"添加媒体文件到数据库时出错: {str(e)}")
+        :param message: Pyrogram消息对象
+        :return: 是否是需要索引的媒体文件
+        """
+        LIVE_MESSAGES.inc()
+        file_data = self._extract_media(message)
+        if not file_data:
             return False
+        
+        await self.ingest_queue.put(file_data)
+        return True
     
-    async def process_new_message(self, message):
+    async def process_edited_message(self, message):
         """
-        处理新消息，如果是媒体文件则添加到索引
+        处理编辑过的消息，加入后写队列：媒体被替换为其他文件时移出旧的发布并索引新文件，
+        替换为非音视频时移出，只修改说明文字时不做任何修改
         
         :param message: Pyrogram消息对象
-        :return: 是否成功处理了媒体文件
         """
-        return await self._process_message(message)
+        if not message.media:
+            return
+        file_data = self._extract_media(message)
+        if file_data:
+            await self.ingest_queue.put_edit(file_data)
+        else:
+            await self.ingest_queue.put_removal(message.chat.id, [message.id])
+    
+    async def process_deleted_messages(self, chat_id, message_ids):
+        """
+        处理群组中删除的消息，加入后写队列批量移出，搜索结果不再链接到已删除的消息
+        
+        :param chat_id: 群组ID
+        :param message_ids: 消息ID列表
+        """
+        await self.ingest_queue.put_removal(chat_id, message_ids)
+    
+    async def reconcile_messages(self, chat_id, occurrences):
+        """
+        核对一批已索引的发布（每 GET_MESSAGES_LIMIT 条一次 get_messages 调用），
+        已删除的消息移出索引，文件被替换的按编辑处理
+        
+        :param chat_id: 群组ID
+        :param occurrences: 发布记录列表，包含 message_id 和 file_unique_id
+        :return: (已删除的消息数, 文件被替换的消息数)
+        """
+        by_id = {occurrence["message_id"]: occurrence for occurrence in occurrences}
+        dead = []
+        replaced = 0
+        async for message_id, message in fetch_messages(self.client, self.scheduler, chat_id, list(by_id)):
+            occurrence = by_id[message_id]
+            file_data = self._extract_media(message) if message else None
+            if file_data is None:
+                dead.append(occurrence["message_id"])
+            elif file_data["file_unique_id"] != occurrence["file_unique_id"]:
+                await self.ingest_queue.put_edit(file_data)
+                replaced += 1
+        if dead:
+            await self.ingest_queue.put_removal(chat_id, dead)
+        return len(dead), replaced
+    
+    def start(self):
+        """启动实时消息的后台写入任务"""
+        self.ingest_queue.start()
+    
+    async def stop(self):
+        """停止后台写入任务，写入队列中剩余的数据"""
+        await self.ingest_queue.stop()
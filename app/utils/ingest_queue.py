@@ -0,0 +1,184 @@
+import time
+import asyncio
+import logging
+from app.utils.batch_writer import MediaBatchWriter
+from app.utils.metrics import registry
+from app.config.settings import INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+LIVE_INSERTS = registry.counter("indexer_media_inserted_total", "新索引的媒体文件消息数", {"source": "live"})
+LIVE_REMOVALS = registry.counter("indexer_media_removed_total", "因消息删除或编辑移出索引的媒体文件消息数")
+FLUSH_FAILURES = registry.counter("ingest_flush_failures_total", "实时写入队列批量写入失败的次数")
+
+# 写入失败后重试的间隔（秒）：从 RETRY_INITIAL 开始每次翻倍，最长 RETRY_MAX
+RETRY_INITIAL = 1
+RETRY_MAX = 60
+# 停止时写入剩余数据的最多尝试次数
+STOP_ATTEMPTS = 3
+
+# 队列中编辑和删除操作的类型标记，新消息直接以媒体文件数据入队
+REPLACE = "replace"
+REMOVE = "remove"
+
+class IngestionQueue:
+    def __init__(self, db, maxsize=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL):
+        """
+        实时媒体消息的后写队列：处理器只负责入队，后台任务按批量写入数据库
+        
+        新消息、编辑和删除按到达顺序进入同一个队列，由 MediaBatchWriter 合并后批量应用。
+        写入失败（如数据库主从切换、超时）时批次保留在写入器中，按指数退避重试；
+        重试期间批次已满时暂停读取队列，队列满后 put 等待，不会无限积压或丢弃数据。
+        
+        :param db: MediaFileModel实例
+        :param maxsize: 队列容量，队列满时 put 会等待，形成背压
+        :param batch_size: 批次达到该大小时写入
+        :param flush_interval: 未满批次的最长等待时间（秒）
+        """
+        self.db = db
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.writer = MediaBatchWriter(db, batch_size, flush_interval)
+        self.enqueued = 0
+        self.written = 0
+        self.removed = 0
+        # 连续写入失败的次数和下次重试的时间，写入成功后清零
+        self._failed = 0
+        self._retry_at = None
+        self._task = None
+    
+    def __len__(self):
+        return self.queue.qsize() + len(self.writer)
+    
+    def start(self):
+        """启动后台写入任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def put(self, file_data):
+        """
+        加入一条媒体文件数据，队列满时等待
+        
+        :param file_data: 媒体文件数据
+        """
+        await self.queue.put(file_data)
+        self.enqueued += 1
+    
+    async def put_edit(self, file_data):
+        """
+        加入一条编辑过的媒体消息，文件被替换时移出原来的发布
+        
+        :param file_data: 编辑后的媒体文件数据
+        """
+        await self.queue.put((REPLACE, file_data))
+        self.enqueued += 1
+    
+    async def put_removal(self, chat_id, message_ids):
+        """
+        加入删除的消息
+        
+        :param chat_id: 群组ID
+        :param message_ids: 消息ID列表
+        """
+        await self.queue.put((REMOVE, chat_id, list(message_ids)))
+        self.enqueued += 1
+    
+    async def drain(self):
+        """
+        等待此前加入的数据全部写入数据库，后台任务未运行时立即返回
+        
+        :raises RuntimeError: 写入失败，数据仍保留在队列中等待重试
+        """
+        if self._task is None:
+            return
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put(done)
+        await done
+    
+    async def stop(self):
+        """停止后台任务，写入队列中剩余的全部数据"""
+        if self._task is None:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+        logger.info(f"实时写入队列已停止，共写入 {self.written} 条新媒体文件，移出 {self.removed} 条")
+    
+    async def _flush(self):
+        """
+        写入当前批次
+        
+        :return: 是否写入成功，失败时批次保留，到 _retry_at 后重试
+        """
+        try:
+            inserted = await self.writer.flush()
+        except Exception as e:
+            self._failed += 1
+            FLUSH_FAILURES.inc()
+            delay = min(RETRY_INITIAL * 2 ** (self._failed - 1), RETRY_MAX)
+            self._retry_at = time.monotonic() + delay
+            logger.error(f"批量写入 {len(self.writer)} 条实时媒体数据失败（连续第 {self._failed} 次），{delay} 秒后重试: {str(e)}")
+            return False
+        
+        self._failed = 0
+        self._retry_at = None
+        self.written += inserted
+        self.removed += self.writer.removed
+        LIVE_INSERTS.inc(inserted)
+        LIVE_REMOVALS.inc(self.writer.removed)
+        return True
+    
+    def _time_until_flush(self):
+        """距离下次写入的秒数：重试期间为重试时间，否则由写入器按批次决定"""
+        if self._retry_at is not None:
+            return max(0.0, self._retry_at - time.monotonic())
+        return self.writer.time_until_flush()
+    
+    def _should_flush(self):
+        if self._retry_at is not None:
+            return time.monotonic() >= self._retry_at
+        return self.writer.should_flush()
+    
+    async def _run(self):
+        while True:
+            if self._retry_at is not None and len(self.writer) >= self.writer.batch_size:
+                # 重试期间批次已满：不再读取队列，等到重试时间
+                await asyncio.sleep(self._time_until_flush())
+                await self._flush()
+                continue
+            
+            try:
+                file_data = await asyncio.wait_for(self.queue.get(), timeout=self._time_until_flush())
+            except asyncio.TimeoutError:
+                file_data = False
+            
+            if isinstance(file_data, asyncio.Future):
+                # drain 的标记：写入当前批次后通知等待方，失败时等待方收到异常
+                ok = await self._flush()
+                if not file_data.done():
+                    if ok:
+                        file_data.set_result(None)
+                    else:
+                        file_data.set_exception(RuntimeError(f"{len(self.writer)} 条实时媒体数据写入失败，等待重试"))
+                continue
+            if file_data is None:
+                await self._flush_remaining()
+                break
+            if isinstance(file_data, tuple):
+                if file_data[0] == REPLACE:
+                    self.writer.replace(file_data[1])
+                else:
+                    self.writer.remove(file_data[1], file_data[2])
+            elif file_data:
+                self.writer.add(file_data)
+            
+            if self._should_flush():
+                await self._flush()
+    
+    async def _flush_remaining(self):
+        """停止时写入剩余数据，数据库仍不可用时有限次重试后放弃"""
+        for attempt in range(STOP_ATTEMPTS):
+            if await self._flush():
+                return
+            if attempt + 1 < STOP_ATTEMPTS:
+                await asyncio.sleep(self._time_until_flush())
+        logger.error(f"停止时仍有 {len(self.writer)} 条实时媒体数据无法写入，丢弃")
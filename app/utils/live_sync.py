@@ -0,0 +1,229 @@
+import time
+import asyncio
+import logging
+from pyrogram import filters
+from pyrogram.handlers import MessageHandler, EditedMessageHandler, DeletedMessagesHandler
+from app.utils.metrics import registry
+from app.config.settings import (
+    LIVE_SYNC_POLL_INTERVAL, LIVE_SYNC_GAP_DELAY, LIVE_SYNC_CONCURRENCY
+)
+
+logger = logging.getLogger(__name__)
+
+# 实时同步主循环的间隔（秒）：保存检查点、启动到期的补拉
+TICK_INTERVAL = 1
+# 补拉连续失败（如该账号无权访问群组）时重试间隔的最大倍数
+MAX_BACKOFF_EXPONENT = 5
+
+class LiveSync:
+    def __init__(self, indexer, poll_interval=LIVE_SYNC_POLL_INTERVAL, gap_delay=LIVE_SYNC_GAP_DELAY,
+                 concurrency=LIVE_SYNC_CONCURRENCY):
+        """
+        已索引群组的增量同步：用户客户端的更新写入新消息、编辑和删除，缺失的消息只补拉缺口
+        
+        超级群组的消息ID按发送顺序连续分配，每个已索引群组（有检查点）记录连续收到的最新消息ID：
+        收到的下一条消息正好接在后面时直接推进，写入队列写完后保存到检查点的 newest_id；
+        出现跳号（更新丢失、断线、消息发出后立即被删除）时，等待 gap_delay 秒后
+        用 MediaIndexer.sync_chat 从检查点拉取到最新消息，只补齐缺口，不需要管理员重新 /index。
+        启动时和每隔 poll_interval 秒，没有收到更新的群组也补拉一次：停机期间的消息一次补齐，
+        LIVE_UPDATES 为 False（用户客户端不接收更新）时完全依靠这种轮询。
+        
+        :param indexer: MediaIndexer实例
+        :param poll_interval: 检查没有收到更新的群组的间隔（秒）
+        :param gap_delay: 发现缺口后等待多久再补拉（秒）
+        :param concurrency: 同时补拉的群组数
+        """
+        self.indexer = indexer
+        self.checkpoints = indexer.checkpoints
+        self.poll_interval = poll_interval
+        self.gap_delay = gap_delay
+        self.concurrency = concurrency
+        # chat_id -> 已连续收到的最新消息ID，只记录有检查点的群组
+        self.newest = {}
+        # chat_id -> 收到过的最大消息ID
+        self.latest = {}
+        # chat_id -> 最近一次收到新消息的时间
+        self.last_update = {}
+        # chat_id -> 计划补拉的时间
+        self.gaps = {}
+        # chat_id -> 连续收到、写入后需要保存到检查点的 newest_id
+        self._advance = {}
+        # chat_id -> 补拉期间收到的消息ID，补拉完成后按顺序接续
+        self._seen = {}
+        # chat_id -> (连续失败次数, 下次重试时间)
+        self._failures = {}
+        self._tasks = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task = None
+        self.gaps_detected = 0
+        self.syncs = 0
+        self.recovered = 0
+        registry.gauge("live_sync_gaps_total", "检测到的消息ID缺口数", lambda: self.gaps_detected, kind="counter")
+        registry.gauge("live_sync_syncs_total", "完成的补拉次数", lambda: self.syncs, kind="counter")
+        registry.gauge("live_sync_recovered_messages_total", "补拉找回的消息数", lambda: self.recovered, kind="counter")
+    
+    def register(self, client):
+        """在用户客户端上注册新消息、编辑和删除的处理器"""
+        client.add_handler(MessageHandler(self._on_message, filters.group))
+        client.add_handler(EditedMessageHandler(self._on_edited, filters.group))
+        client.add_handler(DeletedMessagesHandler(self._on_deleted))
+    
+    def start(self):
+        """启动同步循环，第一次轮询会补拉全部已索引群组停机期间的消息"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """停止同步循环和进行中的补拉，保存已写入的检查点（需在写入队列停止之前调用）"""
+        tasks = [task for task in (self._task, *self._tasks) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._tasks.clear()
+        try:
+            await self._persist()
+        except Exception as e:
+            logger.error(f"保存实时同步检查点失败: {str(e)}")
+    
+    async def _on_message(self, client, message):
+        """新消息：记录消息ID用于缺口检测，媒体文件加入写入队列"""
+        self.observe(message.chat.id, message.id)
+        await self.indexer.process_new_message(message)
+    
+    async def _on_edited(self, client, message):
+        try:
+            await self.indexer.process_edited_message(message)
+        except Exception as e:
+            logger.error(f"处理编辑的消息 {message.chat.id}/{message.id} 失败: {str(e)}")
+    
+    async def _on_deleted(self, client, messages):
+        """删除的消息：普通群组的删除更新不带群组ID，无法定位，只处理超级群组"""
+        by_chat = {}
+        for message in messages:
+            if message.chat is not None:
+                by_chat.setdefault(message.chat.id, []).append(message.id)
+        for chat_id, message_ids in by_chat.items():
+            try:
+                await self.indexer.process_deleted_messages(chat_id, message_ids)
+            except Exception as e:
+                logger.error(f"处理群组 {chat_id} 删除的 {len(message_ids)} 条消息失败: {str(e)}")
+    
+    def observe(self, chat_id, message_id):
+        """
+        记录收到的新消息ID，检测缺口
+        
+        :param chat_id: 群组ID
+        :param message_id: 消息ID
+        """
+        self.last_update[chat_id] = time.monotonic()
+        newest = self.newest.get(chat_id)
+        if newest is None or message_id <= newest:
+            return
+        self.latest[chat_id] = max(self.latest.get(chat_id, 0), message_id)
+        
+        if chat_id in self._seen:
+            self._seen[chat_id].append(message_id)
+        elif message_id == newest + 1 and chat_id not in self.gaps:
+            self.newest[chat_id] = message_id
+            self._advance[chat_id] = message_id
+        else:
+            self._schedule(chat_id, self.gap_delay)
+            self.gaps_detected += 1
+    
+    def _schedule(self, chat_id, delay=0):
+        """计划补拉，连续失败的群组推迟到重试时间"""
+        if chat_id in self.gaps or chat_id in self._seen:
+            return
+        _, retry_at = self._failures.get(chat_id, (0, 0))
+        self.gaps[chat_id] = max(time.monotonic() + delay, retry_at)
+    
+    async def _run(self):
+        next_poll = 0
+        while True:
+            try:
+                if time.monotonic() >= next_poll:
+                    await self._poll()
+                    next_poll = time.monotonic() + self.poll_interval
+                await self._persist()
+                self._start_due()
+            except Exception as e:
+                logger.error(f"实时同步出错: {str(e)}")
+            await asyncio.sleep(TICK_INTERVAL)
+    
+    async def _poll(self):
+        """重新读取检查点（/index 会新增群组或推进检查点），为一个周期内没有收到更新的群组计划补拉"""
+        now = time.monotonic()
+        async for checkpoint in self.checkpoints.collection.find({"newest_id": {"$ne": None}}, {"newest_id": 1}):
+            chat_id = checkpoint["_id"]
+            if chat_id in self._seen:
+                continue
+            self.newest[chat_id] = max(self.newest.get(chat_id, 0), checkpoint["newest_id"])
+            if now - self.last_update.get(chat_id, float("-inf")) >= self.poll_interval:
+                self._schedule(chat_id)
+    
+    async def _persist(self):
+        """
+        写入队列中的消息写完后，把连续收到的最新消息ID保存到检查点
+        
+        写入失败时不推进检查点，之后写入成功时再保存，否则补拉会从未写入的消息之后开始
+        """
+        if not self._advance:
+            return
+        advance, self._advance = self._advance, {}
+        try:
+            await self.indexer.ingest_queue.drain()
+        except Exception:
+            for chat_id, newest_id in advance.items():
+                self._advance[chat_id] = max(self._advance.get(chat_id, 0), newest_id)
+            raise
+        for chat_id, newest_id in advance.items():
+            await self.checkpoints.advance(chat_id, newest_id=newest_id)
+    
+    def _start_due(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, due in self.gaps.items() if due <= now]:
+            del self.gaps[chat_id]
+            self._seen[chat_id] = []
+            task = asyncio.create_task(self._sync(chat_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _sync(self, chat_id):
+        """补拉一个群组的缺口，完成后接续补拉期间收到的消息"""
+        latest = self.latest.get(chat_id, 0)
+        stats = None
+        try:
+            async with self._semaphore:
+                stats = await self.indexer.sync_chat(chat_id)
+        except Exception as e:
+            logger.error(f"补拉群组 {chat_id} 的新消息失败: {str(e)}")
+        finally:
+            seen = self._seen.pop(chat_id, [])
+        
+        if stats is None or stats.failed:
+            failures = self._failures.get(chat_id, (0, 0))[0] + 1
+            delay = self.poll_interval * 2 ** min(failures - 1, MAX_BACKOFF_EXPONENT)
+            self._failures[chat_id] = (failures, time.monotonic() + delay)
+            self._schedule(chat_id)
+            return
+        
+        self._failures.pop(chat_id, None)
+        self.syncs += 1
+        self.recovered += stats.new_messages
+        if stats.new_messages:
+            logger.info(f"群组 {chat_id} 补拉了 {stats.new_messages} 条遗漏的消息，新索引 {stats.written} 条媒体文件")
+        
+        # 补拉从最新消息开始，补拉开始前收到的消息都已覆盖（即使最新的那条已被删除）
+        newest = max(self.newest.get(chat_id, 0), stats.newest_id or 0, latest)
+        if newest > (stats.newest_id or 0):
+            self._advance[chat_id] = newest
+        self.newest[chat_id] = newest
+        for message_id in sorted(seen):
+            if message_id <= newest:
+                continue
+            if message_id != newest + 1:
+                self._schedule(chat_id, self.gap_delay)
+                self.gaps_detected += 1
+                break
+            newest = self.newest[chat_id] = self._advance[chat_id] = message_id
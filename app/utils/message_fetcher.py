@@ -0,0 +1,30 @@
+import logging
+from app.utils.streams import chunked
+from app.utils.telegram_scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+# 每次 get_messages 调用最多请求的消息数（Telegram上限）
+GET_MESSAGES_LIMIT = 200
+
+async def fetch_messages(client, scheduler, chat_id, message_ids, chunk_size=GET_MESSAGES_LIMIT, priority=BULK):
+    """
+    按ID批量拉取消息：每 chunk_size 个ID一次 get_messages 调用，经调度器限速，逐条产出
+    
+    message_ids 可以是异步生成器（如 MediaFileModel.iter_occurrences），任何时候只保留一块ID和消息，
+    校验、导出、重新索引等工具可以遍历任意多的消息。
+    
+    :param client: Pyrogram客户端
+    :param scheduler: 该客户端的 TelegramScheduler
+    :param chat_id: 群组ID
+    :param message_ids: 消息ID的可迭代对象或异步可迭代对象
+    :param chunk_size: 每次调用请求的消息数，不超过 GET_MESSAGES_LIMIT
+    :param priority: 调度优先级
+    :return: 异步生成器，按请求顺序产出 (消息ID, 消息)，消息已删除时为None
+    """
+    chunk_size = min(chunk_size, GET_MESSAGES_LIMIT)
+    async for chunk in chunked(message_ids, chunk_size):
+        messages = await scheduler.call(client.get_messages, chat_id, chunk, priority=priority)
+        found = {message.id: message for message in messages if message and not message.empty}
+        for message_id in chunk:
+            yield message_id, found.get(message_id)
@@ -0,0 +1,268 @@
+from bisect import bisect_left
+from collections import OrderedDict
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 默认延迟分桶上界（秒），覆盖内存查询的亚毫秒级到数据库慢查询的秒级
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+class Histogram:
+    """固定分桶的直方图，用于统计延迟分布"""
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: 递增的分桶上界，超过最后一个上界的值计入 +Inf 桶
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value):
+        """记录一个观测值"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def time(self):
+        """返回计时上下文，退出时记录耗时（秒）"""
+        return _Timer(self)
+    
+    def quantile(self, q):
+        """
+        估算分位数
+        
+        :param q: 分位数，0到1之间
+        :return: 该分位数所在分桶的上界，没有观测值时返回0，落在 +Inf 桶时返回最后一个上界
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for upper, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return upper
+        return self.buckets[-1]
+    
+    def summary(self):
+        """生成 p50/p95/p99 摘要，单位毫秒"""
+        if not self.count:
+            return "无数据"
+        return (
+            f"p50≤{self.quantile(0.5) * 1000:g}ms p95≤{self.quantile(0.95) * 1000:g}ms "
+            f"p99≤{self.quantile(0.99) * 1000:g}ms (n={self.count}, 平均 {self.sum / self.count * 1000:.2f}ms)"
+        )
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+class Counter:
+    """单调递增的计数器"""
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, amount=1):
+        """增加计数"""
+        self.value += amount
+
+class MetricsRegistry:
+    """
+    指标注册表，按 Prometheus 文本格式输出
+    
+    每个指标族有名称、类型和说明，族内按标签区分多个指标；
+    gauge 和 counter 也可以注册为取值函数，在输出时才读取当前值，热路径上没有额外开销。
+    """
+    
+    def __init__(self):
+        # 名称 -> {"type", "help", "children": {标签元组: Histogram/Counter/取值函数}}
+        self._families = OrderedDict()
+    
+    def _child(self, name, kind, help_text, labels, factory):
+        family = self._families.setdefault(name, {"type": kind, "help": help_text, "children": OrderedDict()})
+        if family["type"] != kind:
+            raise ValueError(f"指标 {name} 已注册为 {family['type']}")
+        key = _label_key(labels)
+        if key not in family["children"]:
+            family["children"][key] = factory()
+        return family["children"][key]
+    
+    def histogram(self, name, help_text, labels=None, histogram=None):
+        """
+        注册直方图，同名同标签的直方图已存在时返回已有的实例
+        
+        :param histogram: 已有的 Histogram 实例，不传时新建
+        :return: Histogram
+        """
+        return self._child(name, "histogram", help_text, labels, lambda: histogram or Histogram())
+    
+    def counter(self, name, help_text, labels=None):
+        """注册计数器，同名同标签的计数器已存在时返回已有的实例"""
+        return self._child(name, "counter", help_text, labels, Counter)
+    
+    def gauge(self, name, help_text, func, labels=None, kind="gauge"):
+        """
+        注册取值函数，输出时调用，重复注册时替换旧函数
+        
+        :param func: 无参函数，返回当前值
+        :param kind: "gauge"，或取值单调递增时为 "counter"
+        """
+        self._child(name, kind, help_text, labels, lambda: func)
+        self._families[name]["children"][_label_key(labels)] = func
+    
+    def render(self):
+        """生成 Prometheus 文本格式（0.0.4）"""
+        lines = []
+        for name, family in self._families.items():
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for labels, child in family["children"].items():
+                if isinstance(child, Histogram):
+                    lines.extend(_render_histogram(name, labels, child))
+                    continue
+                try:
+                    value = child.value if isinstance(child, Counter) else child()
+                except Exception as e:
+                    logger.debug(f"读取指标 {name} 失败: {str(e)}")
+                    continue
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+# 进程内共享的指标注册表，各组件在初始化时注册自己的指标
+registry = MetricsRegistry()
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+def _render_histogram(name, labels, histogram):
+    # Prometheus 的分桶是累计值：le 表示小于等于该上界的观测数
+    lines = []
+    cumulative = 0
+    for upper, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{upper:g}')])} {cumulative}")
+    lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return lines
+
+class MetricsServer:
+    def __init__(self, host, port, metrics_registry=registry):
+        """
+        在当前事件循环中提供 /metrics HTTP 接口，供 Prometheus 抓取
+        
+        只实现单个 GET 请求所需的最小 HTTP/1.0 协议，不引入额外的Web框架。
+        
+        :param host: 监听地址
+        :param port: 监听端口
+        :param metrics_registry: 输出的指标注册表
+        """
+        self.host = host
+        self.port = port
+        self.registry = metrics_registry
+        self._server = None
+    
+    async def start(self):
+        """开始监听"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"指标接口已启动: http://{self.host}:{self.port}/metrics")
+    
+    async def stop(self):
+        """停止监听"""
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+    
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            # 读完请求头，忽略内容
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else ""
+            if len(parts) > 1 and parts[0] == "GET" and path == "/metrics":
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            
+            writer.write(
+                f"HTTP/1.0 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"处理指标请求失败: {str(e)}")
+        finally:
+            writer.close()
+
+class EventLoopMonitor:
+    def __init__(self, interval=0.5, metrics_registry=registry):
+        """
+        事件循环延迟监控：定期 sleep，实际唤醒时间比预期晚多少即为事件循环的阻塞时间
+        
+        :param interval: 采样间隔（秒）
+        :param metrics_registry: 注册指标的注册表
+        """
+        self.interval = interval
+        self.lag = 0.0
+        self.histogram = metrics_registry.histogram(
+            "event_loop_lag_seconds", "事件循环调度延迟"
+        )
+        metrics_registry.gauge("event_loop_lag_last_seconds", "最近一次采样的事件循环调度延迟", lambda: self.lag)
+        self._task = None
+    
+    def start(self):
+        """启动后台采样任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """停止采样"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.monotonic() - started - self.interval)
+            self.histogram.observe(self.lag)
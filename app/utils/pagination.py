@@ -2,29 +2,30 @@ from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from app.config.settings import RESULTS_PER_PAGE
 
 class Pagination:
-    def __init__(self, total_results, current_page=1, per_page=RESULTS_PER_PAGE):
+    def __init__(self, total_results, current_page=1, per_page=RESULTS_PER_PAGE, capped=False):
         """
         初始化分页器
         
         :param total_results: 总结果数
         :param current_page: 当前页码，从1开始
         :param per_page: 每页显示的结果数
+        :param capped: 总结果数是否只是计数上限（实际结果更多）
         """
         self.total_results = total_results
         self.current_page = max(1, current_page)
         self.per_page = per_page
+        self.capped = capped
         self.total_pages = (total_results + per_page - 1) // per_page
-    
-    def get_skip(self):
-        """获取需要跳过的结果数量"""
-        return (self.current_page - 1) * self.per_page
+        if capped:
+            # 计数只是下限，翻过上限对应的页数后以当前页为准
+            self.total_pages = max(self.total_pages, self.current_page)
     
     def get_pagination_keyboard(self, search_query, page_callback_data_format):
         """
         生成分页键盘
         
         :param search_query: 搜索查询，用于构建回调数据
-        :param page_callback_data_format: 页码回调数据格式，如 "page:{query}:{page}"
+        :param page_callback_data_format: 页码回调数据格式，如 "page:{page}"
         :return: InlineKeyboardMarkup 对象
         """
         buttons = []
@@ -36,12 +37,12 @@ class Pagination:
             )
             buttons.append(InlineKeyboardButton("⬅️ 上一页", callback_data=prev_page_data))
         
-        # 当前页信息
-        page_info = f"📄 {self.current_page}/{self.total_pages}"
+        # 当前页信息，计数达到上限时显示为 "N+"
+        page_info = f"📄 {self.current_page}/{self.total_pages}{'+' if self.capped else ''}"
         buttons.append(InlineKeyboardButton(page_info, callback_data="noop"))
         
         # 下一页按钮
-        if self.current_page < self.total_pages:
+        if self.current_page < self.total_pages or self.capped:
             next_page_data = page_callback_data_format.format(
                 query=search_query, page=self.current_page + 1
             )
@@ -59,18 +60,26 @@ class Pagination:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
-    def format_results(results, chat_id):
+    def message_link(chat_id, message_id):
+        """生成群组消息链接，只有群组成员可以打开"""
+        return f"https://t.me/c/{str(chat_id).replace('-100', '')}/{message_id}"
+    
+    @staticmethod
+    def format_results(results, chat_id, fuzzy=False):
         """
         格式化搜索结果
         
         :param results: 搜索结果列表
         :param chat_id: 群组ID
+        :param fuzzy: 是否包含容错搜索的近似结果
         :return: 格式化后的结果文本
         """
         if not results:
             return "没有找到匹配的媒体文件。"
         
         formatted_text = "🔍 **搜索结果**:\n\n"
+        if fuzzy:
+            formatted_text = "🔍 **搜索结果**（精确匹配很少，已包含近似结果）:\n\n"
         
         for i, result in enumerate(results):
             file_type_emoji = "🎵" if result["media_type"] == "audio" else "🎬"
@@ -78,8 +87,12 @@ class Pagination:
             message_id = result["message_id"]
             
             # 创建文件名超链接，点击可跳转到原消息
-            link = f"https://t.me/c/{str(chat_id).replace('-100', '')}/{message_id}"
-            line = f"{i+1}. {file_type_emoji} [{file_name}]({link})\n"
+            link = Pagination.message_link(chat_id, message_id)
+            line = f"{i+1}. {file_type_emoji} [{file_name}]({link})"
+            # 同一文件重复转发时只显示一条，并注明发布次数
+            if result.get("occurrences", 1) > 1:
+                line += f" · 发布 {result['occurrences']} 次"
+            line += "\n"
             
             formatted_text += line
         
@@ -0,0 +1,38 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def is_chat_admin(message):
+    """
+    检查命令发送者是否为群组管理员（群主或管理员）
+    
+    :param message: 群组中的命令消息
+    :return: 是否有管理员权限，查询出错时返回False
+    """
+    is_admin = False
+    user_id = message.from_user.id
+    
+    try:
+        # 获取用户在群组中的详细信息
+        chat = message.chat
+        user = await chat.get_member(user_id)
+        
+        # 检查用户状态 - 使用正确的状态值: owner(群主)和administrator(管理员)
+        if hasattr(user, 'status'):
+            if isinstance(user.status, str):
+                is_admin = user.status in ["owner", "administrator"]
+            elif hasattr(user.status, 'value'):
+                status_value = user.status.value
+                is_admin = status_value in ["owner", "administrator", "creator", 1, 2]
+        
+        # 对于Pyrogram API，使用ChatMember类的特殊检查
+        if hasattr(user, '__class__'):
+            class_name = str(user.__class__)
+            owner_check = any(owner_term in class_name for owner_term in ['ChatMemberOwner', 'ChannelParticipantCreator'])
+            admin_check = any(admin_term in class_name for admin_term in ['ChatMemberAdministrator', 'ChannelParticipantAdmin'])
+            is_admin = is_admin or owner_check or admin_check
+    
+    except Exception as e:
+        logger.error(f"检查用户权限时出错: {str(e)}")
+    
+    return is_admin
@@ -0,0 +1,165 @@
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from app.models.media_file import MediaFileModel
+from app.models.query_stats import QueryStatsModel
+from app.utils.query_parser import ParsedQuery
+from app.utils.ttl_cache import TTLCache
+from app.config.settings import (
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_CACHE_WARM_TOP_K, QUERY_CACHE_WARM_CHATS,
+    QUERY_STATS_FLUSH_INTERVAL, QUERY_STATS_RETENTION_DAYS
+)
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(parsed):
+    """
+    规范化搜索语句：关键词忽略大小写和多余空白，筛选条件忽略顺序
+    
+    :param parsed: ParsedQuery
+    :return: 可作为缓存键的字符串
+    """
+    keyword = " ".join(parsed.keyword.lower().split())
+    conditions = sorted(json.dumps(list(condition), ensure_ascii=False) for condition in parsed.conditions)
+    return "\x1f".join([keyword] + conditions)
+
+class QueryCache:
+    def __init__(self, max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, persist=True):
+        """
+        按群组的搜索结果缓存：(群组ID, 规范化的搜索语句) -> 首页结果（总数、首页文档和结果窗口的排序键）
+        
+        少数热门关键词（歌手名、剧名）占了大部分 /f 请求，命中时不再执行计数、排序和容错搜索。
+        条目 ttl 秒后过期；MediaFileModel 写入某个群组后，该群组的全部条目立即失效：
+        每个群组有一个版本号，写入时加一，版本不同的条目视为未命中（拆分部署时由前端的 ChangeFeed 转发写入）。
+        各搜索语句的使用次数定期批量写入 query_stats 集合，重启后在后台预热各群组最常用的搜索。
+        
+        :param max_size: 最大条目数
+        :param ttl: 条目的有效期（秒）
+        :param persist: 是否记录使用次数并在启动时预热
+        """
+        self.entries = TTLCache(max_size, ttl)
+        self.model = QueryStatsModel(QUERY_STATS_RETENTION_DAYS) if persist else None
+        self.hits = 0
+        self.misses = 0
+        self.warmed = 0
+        # chat_id -> 版本号，只记录查询过的群组
+        self._versions = {}
+        # (chat_id, key) -> (keyword, conditions, 次数, 最后使用时间)，等待写入 query_stats
+        self._usage = {}
+        self._tasks = []
+        MediaFileModel.add_write_listener(self.on_write)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def tracks(self, chat_id):
+        """是否查询过该群组，只有这些群组需要接收写入变化"""
+        return chat_id in self._versions
+    
+    def version(self, chat_id):
+        """
+        群组当前的版本号，需要在执行查询之前获取，传给 set
+        
+        第一次查询的群组在这里开始记录版本号，查询期间的写入也会使版本号增加，set 不会缓存过期的结果
+        """
+        return self._versions.setdefault(chat_id, 0)
+    
+    def get(self, chat_id, parsed, record=True):
+        """
+        获取缓存的首页结果
+        
+        :param chat_id: 群组ID
+        :param parsed: 解析后的搜索语句
+        :param record: 是否计入命中率和使用次数（预热时为False）
+        :return: 首页结果，未缓存、已过期或群组有新写入时返回None
+        """
+        key = normalize_query(parsed)
+        if record:
+            keyword, conditions, count, _ = self._usage.get((chat_id, key), (parsed.keyword, parsed.conditions, 0, None))
+            self._usage[(chat_id, key)] = (keyword, conditions, count + 1, datetime.now())
+        
+        entry = self.entries.get((chat_id, key), count=False)
+        if entry is not None and entry[0] == self._versions.get(chat_id):
+            if record:
+                self.hits += 1
+            return entry[1]
+        if record:
+            self.misses += 1
+        return None
+    
+    def set(self, chat_id, parsed, page, version):
+        """
+        缓存首页结果
+        
+        :param version: 查询之前通过 version() 获取的版本号，查询期间群组有新写入时不缓存
+        """
+        if self._versions.get(chat_id) == version:
+            self.entries.set((chat_id, normalize_query(parsed)), (version, page))
+    
+    def on_write(self, docs):
+        """写入监听：群组有新文件或发布次数变化时，使该群组的全部缓存条目失效"""
+        for chat_id in {doc.get("chat_id") for doc in docs}:
+            if chat_id in self._versions:
+                self._versions[chat_id] += 1
+    
+    async def start(self, search):
+        """
+        启动使用次数的定期写入，并在后台预热最常用的搜索
+        
+        :param search: 执行搜索的协程函数，参数为 (parsed, chat_id)，返回首页结果
+        """
+        if self.model is None or self._tasks:
+            return
+        await self.model.ensure_indexes()
+        self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._warm(search))]
+    
+    async def stop(self):
+        """停止后台任务，写入剩余的使用次数"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._flush()
+    
+    async def _flush(self):
+        if self.model is None or not self._usage:
+            return
+        usage, self._usage = self._usage, {}
+        try:
+            await self.model.increment(usage)
+        except Exception as e:
+            logger.error(f"写入搜索语句使用次数失败: {str(e)}")
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(QUERY_STATS_FLUSH_INTERVAL)
+            await self._flush()
+    
+    async def _warm(self, search):
+        """依次执行各群组最常用的搜索并缓存结果，一次只执行一个，不与用户搜索争抢数据库"""
+        started = time.monotonic()
+        try:
+            top = await self.model.top_queries(QUERY_CACHE_WARM_TOP_K, QUERY_CACHE_WARM_CHATS, QUERY_STATS_RETENTION_DAYS)
+        except Exception as e:
+            logger.error(f"读取常用搜索语句失败: {str(e)}")
+            return
+        
+        for chat_id, keyword, conditions in top:
+            parsed = ParsedQuery(keyword, conditions)
+            if self.get(chat_id, parsed, record=False) is not None:
+                continue
+            version = self.version(chat_id)
+            try:
+                self.set(chat_id, parsed, await search(parsed, chat_id), version)
+                self.warmed += 1
+            except Exception as e:
+                logger.warning(f"预热搜索 '{keyword}' 失败: {str(e)}")
+        if self.warmed:
+            logger.info(f"已预热 {self.warmed} 个常用搜索，耗时 {time.monotonic() - started:.1f}s")
@@ -0,0 +1,136 @@
+import re
+
+# 筛选条件：字段名、比较符和取值，如 type:audio、size>100MB、dur<5m、from:@user
+_FILTER_PATTERN = re.compile(r"^(type|size|dur|from)(:|>=|<=|>|<)(.+)$", re.IGNORECASE)
+
+# 文件大小单位，省略单位时按MB计算
+_SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*(b|k|kb|m|mb|g|gb)?$", re.IGNORECASE)
+_SIZE_UNITS = {"b": 1, "k": 1024, "kb": 1024, "m": 1024 ** 2, "mb": 1024 ** 2, "g": 1024 ** 3, "gb": 1024 ** 3}
+
+# 时长，如 90、90s、5m、1h30m，省略单位时按秒计算
+_DURATION_PATTERN = re.compile(r"^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?$", re.IGNORECASE)
+
+# 媒体类型及其别名
+_MEDIA_TYPES = {"audio": "audio", "音频": "audio", "music": "audio", "video": "video", "视频": "video"}
+
+# 比较符 -> MongoDB 操作符
+_OPERATORS = {":": "$eq", ">": "$gt", ">=": "$gte", "<": "$lt", "<=": "$lte"}
+
+class QueryError(ValueError):
+    """搜索语句中的筛选条件无法解析"""
+
+class ParsedQuery:
+    def __init__(self, keyword, conditions=None, sender_username=None):
+        """
+        解析后的搜索语句
+        
+        :param keyword: 去掉筛选条件后的关键词
+        :param conditions: 筛选条件列表，元素为 (字段, MongoDB操作符, 值)
+        :param sender_username: from:@user 中尚未解析为用户ID的用户名
+        """
+        self.keyword = keyword
+        self.conditions = [tuple(condition) for condition in conditions or []]
+        self.sender_username = sender_username
+    
+    def set_sender(self, user_id):
+        """将 from:@user 解析得到的用户ID加入筛选条件"""
+        self.conditions.append(("sender_id", "$eq", user_id))
+        self.sender_username = None
+    
+    def mongo_filters(self):
+        """
+        转换为 MongoDB 查询条件
+        
+        :return: 字段 -> 条件，同一字段的多个条件合并为一个范围
+        """
+        filters = {}
+        for field, operator, value in self.conditions:
+            if operator == "$eq":
+                filters[field] = value
+            else:
+                filters.setdefault(field, {})[operator] = value
+        return filters
+
+def match_filters(filters, doc):
+    """
+    判断文档是否满足 mongo_filters() 生成的条件，用于内存索引
+    
+    :param filters: 字段 -> 值或 {操作符: 值}
+    :param doc: 文档字典
+    :return: 是否满足全部条件
+    """
+    for field, condition in filters.items():
+        actual = doc.get(field)
+        if not isinstance(condition, dict):
+            if actual != condition:
+                return False
+            continue
+        if actual is None:
+            return False
+        for operator, value in condition.items():
+            if operator == "$gt" and not actual > value:
+                return False
+            if operator == "$gte" and not actual >= value:
+                return False
+            if operator == "$lt" and not actual < value:
+                return False
+            if operator == "$lte" and not actual <= value:
+                return False
+    return True
+
+def _parse_size(value):
+    match = _SIZE_PATTERN.match(value)
+    if not match:
+        raise QueryError(f"无法识别的文件大小: {value}，示例: size>100MB")
+    return int(float(match.group(1)) * _SIZE_UNITS[(match.group(2) or "mb").lower()])
+
+def _parse_duration(value):
+    match = _DURATION_PATTERN.match(value)
+    if not value or not match:
+        raise QueryError(f"无法识别的时长: {value}，示例: dur<5m、dur>1h30m")
+    hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+def parse_query(text):
+    """
+    解析搜索语句，分离关键词和筛选条件
+    
+    支持的筛选条件：
+    type:audio / type:video - 媒体类型
+    size>100MB / size<1.5GB - 文件大小，单位 B/KB/MB/GB，省略时为MB
+    dur<5m / dur>1h30m - 时长，单位 h/m/s，省略时为秒
+    from:@user / from:12345 - 发送者
+    
+    :param text: 搜索语句
+    :return: ParsedQuery
+    :raises QueryError: 筛选条件的取值无法解析
+    """
+    words = []
+    conditions = []
+    sender_username = None
+    
+    for word in text.split():
+        match = _FILTER_PATTERN.match(word)
+        if not match:
+            words.append(word)
+            continue
+        
+        field, symbol, value = match.group(1).lower(), match.group(2), match.group(3)
+        if field == "type":
+            if symbol != ":" or value.lower() not in _MEDIA_TYPES:
+                raise QueryError(f"无法识别的媒体类型: {value}，可选 type:audio 或 type:video")
+            conditions.append(("media_type", "$eq", _MEDIA_TYPES[value.lower()]))
+        elif field == "from":
+            if symbol != ":":
+                raise QueryError("发送者条件的格式为 from:@用户名 或 from:用户ID")
+            if value.lstrip("-").isdigit():
+                conditions.append(("sender_id", "$eq", int(value)))
+            else:
+                sender_username = value.lstrip("@")
+        else:
+            if symbol == ":":
+                raise QueryError(f"{field} 条件需要使用比较符，如 {field}>… 或 {field}<…")
+            parsed = _parse_size(value) if field == "size" else _parse_duration(value)
+            conditions.append(("file_size" if field == "size" else "duration", _OPERATORS[symbol], parsed))
+    
+    return ParsedQuery(" ".join(words), conditions, sender_username)
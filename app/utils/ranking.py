@@ -0,0 +1,74 @@
+from app.utils.tokenizer import count_search_tokens
+from app.config.settings import SEARCH_RECENCY_WEIGHT, SEARCH_RECENCY_HALF_LIFE_DAYS
+
+# BM25 参数：词频饱和度和文件名长度归一化强度
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def bm25_scores(docs, query_tokens):
+    """
+    计算文件名的 BM25 文本得分
+    
+    候选文档都包含全部查询词元，IDF 对所有候选都相同，因此只保留词频和长度归一化：
+    关键词重复出现、文件名越短（越接近关键词本身）得分越高。
+    内存索引和数据库两条路径据此得到相同的排序。
+    
+    :param docs: 候选文档列表，需要 file_name 字段
+    :param query_tokens: 查询词元列表
+    :return: 与 docs 对应的得分列表
+    """
+    counts = [count_search_tokens(doc.get("file_name")) for doc in docs]
+    lengths = [sum(count.values()) for count in counts]
+    avg_length = sum(lengths) / len(lengths) if lengths else 1
+    avg_length = avg_length or 1
+    
+    scores = []
+    for count, length in zip(counts, lengths):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        scores.append(sum(
+            count[token] * (BM25_K1 + 1) / (count[token] + norm)
+            for token in query_tokens if count[token]
+        ))
+    return scores
+
+def recency_scores(docs, half_life_days=SEARCH_RECENCY_HALF_LIFE_DAYS):
+    """
+    计算时间得分：以候选中最新的文档为基准，每过 half_life_days 天得分减半
+    
+    :param docs: 候选文档列表，需要 timestamp 字段
+    :param half_life_days: 半衰期（天）
+    :return: 与 docs 对应的 0 到 1 之间的得分列表
+    """
+    if not docs:
+        return []
+    newest = max(doc["timestamp"] for doc in docs)
+    half_life = max(half_life_days, 1e-6) * 86400
+    return [0.5 ** ((newest - doc["timestamp"]).total_seconds() / half_life) for doc in docs]
+
+def rank_documents(docs, query_tokens, recency_weight=SEARCH_RECENCY_WEIGHT):
+    """
+    按相关度和时间的加权得分对候选文档排序
+    
+    文本得分按候选中的最高分归一化到 0 到 1，
+    最终得分 = (1 - recency_weight) * 文本得分 + recency_weight * 时间得分，
+    得分相同时按 (timestamp, _id) 降序，保证顺序稳定。
+    
+    :param docs: 候选文档列表
+    :param query_tokens: 查询词元列表
+    :param recency_weight: 时间得分的权重，0 到 1
+    :return: 排序后的文档列表
+    """
+    if not docs or not query_tokens:
+        return list(docs)
+    
+    text = bm25_scores(docs, query_tokens)
+    best = max(text) or 1
+    recency = recency_scores(docs)
+    scores = [(1 - recency_weight) * t / best + recency_weight * r for t, r in zip(text, recency)]
+    
+    order = sorted(
+        range(len(docs)),
+        key=lambda i: (scores[i], docs[i]["timestamp"], docs[i]["_id"]),
+        reverse=True
+    )
+    return [docs[i] for i in order]
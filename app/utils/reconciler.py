@@ -0,0 +1,110 @@
+import time
+import asyncio
+import logging
+from app.utils.metrics import registry
+from app.utils.streams import chunked
+from app.config.settings import (
+    WORKER_ID, RECONCILE_BATCH_SIZE, RECONCILE_INTERVAL, RECONCILE_PERIOD, RECONCILE_LEASE, RECONCILE_IDLE_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+class Reconciler:
+    def __init__(self, indexer, owner=WORKER_ID, batch_size=RECONCILE_BATCH_SIZE, interval=RECONCILE_INTERVAL,
+                 period=RECONCILE_PERIOD):
+        """
+        索引校验：持续按消息ID顺序核对已索引群组的发布记录，移出已删除的消息，文件被替换的重新索引
+        
+        实时同步收不到的删除（停机期间、普通群组、丢失的更新）由它兜底，媒体目录不会无限增长。
+        每次 get_messages 核对 batch_size 条，两次调用至少间隔 interval 秒，以批量优先级经过用户客户端的调度器，
+        可以一直运行而不影响索引任务；移出操作进入实时写入队列，与新消息一起批量写入。
+        群组通过检查点上的租约领取，多个 worker 不会重复校验；进度随租约保存，重启后从中断处继续。
+        
+        :param indexer: MediaIndexer实例
+        :param owner: 租约持有者标识
+        :param batch_size: 每次 get_messages 核对的消息数
+        :param interval: 两次 get_messages 调用之间的最短间隔（秒）
+        :param period: 同一群组两轮校验的最短间隔（秒）
+        """
+        self.indexer = indexer
+        self.db = indexer.db
+        self.checkpoints = indexer.checkpoints
+        self.owner = owner
+        self.batch_size = batch_size
+        self.interval = interval
+        self.period = period
+        self.checked = 0
+        self.dead = 0
+        self.replaced = 0
+        self._task = None
+        registry.gauge("reconcile_messages_checked_total", "校验过的已索引消息数", lambda: self.checked, kind="counter")
+        registry.gauge("reconcile_dead_messages_total", "校验发现已删除或不再是音视频的消息数", lambda: self.dead, kind="counter")
+        registry.gauge("reconcile_replaced_messages_total", "校验发现文件被替换的消息数", lambda: self.replaced, kind="counter")
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """停止校验，进行中群组的进度已随每批保存（需在写入队列停止之前调用）"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            checkpoint = None
+            try:
+                checkpoint = await self.checkpoints.claim_reconcile(self.owner, RECONCILE_LEASE, self.period)
+                if checkpoint is None:
+                    await asyncio.sleep(RECONCILE_IDLE_INTERVAL)
+                    continue
+                await self.reconcile_chat(checkpoint["_id"], checkpoint.get("reconcile_from") or 0)
+            except asyncio.CancelledError:
+                if checkpoint:
+                    await self.checkpoints.release_reconcile(checkpoint["_id"], self.owner)
+                raise
+            except Exception as e:
+                chat_id = checkpoint["_id"] if checkpoint else None
+                logger.error(f"校验群组 {chat_id} 的索引失败: {str(e)}")
+                if checkpoint:
+                    # 该账号无法访问的群组等错误：保留进度，等租约过期后由其他 worker 或下一次领取重试
+                    await asyncio.sleep(RECONCILE_IDLE_INTERVAL)
+    
+    async def reconcile_chat(self, chat_id, after=0):
+        """
+        校验一个群组中 after 之后的全部发布
+        
+        :param chat_id: 群组ID
+        :param after: 从该消息ID之后开始
+        :return: (核对的消息数, 已删除的消息数, 文件被替换的消息数)
+        """
+        started = time.monotonic()
+        checked = dead = replaced = 0
+        async for occurrences in chunked(self.db.iter_occurrences(chat_id, after, self.batch_size), self.batch_size):
+            call_started = time.monotonic()
+            batch_dead, batch_replaced = await self.indexer.reconcile_messages(chat_id, occurrences)
+            checked += len(occurrences)
+            dead += batch_dead
+            replaced += batch_replaced
+            self.checked += len(occurrences)
+            self.dead += batch_dead
+            self.replaced += batch_replaced
+            
+            after = occurrences[-1]["message_id"]
+            if not await self.checkpoints.save_reconcile_progress(chat_id, self.owner, after, RECONCILE_LEASE):
+                logger.warning(f"群组 {chat_id} 的校验租约已被其他进程领取，停止校验")
+                return checked, dead, replaced
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - call_started)))
+        
+        await self.checkpoints.finish_reconcile(chat_id, self.owner)
+        if checked:
+            logger.info(
+                f"群组 {chat_id} 校验完成：核对 {checked} 条，移出 {dead} 条已删除的消息，"
+                f"{replaced} 条文件被替换，耗时 {time.monotonic() - started:.1f}s"
+            )
+        return checked, dead, replaced
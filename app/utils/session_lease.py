@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from app.models.session_lease import SessionLeaseModel
+from app.config.settings import WORKER_ID, JOB_HEARTBEAT_INTERVAL, JOB_HEARTBEAT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class SessionInUseError(RuntimeError):
+    """用户会话正在被其他进程使用"""
+
+class SessionLease:
+    def __init__(self, session, owner=WORKER_ID, lease_seconds=JOB_HEARTBEAT_TIMEOUT, interval=JOB_HEARTBEAT_INTERVAL):
+        """
+        用户会话的独占租约：启动用户客户端之前领取，运行期间定期续租，停止时释放
+        
+        租约与索引任务使用相同的心跳间隔和超时，进程异常退出后超过 lease_seconds 秒其他进程才能接手该会话。
+        
+        :param session: 会话名
+        :param owner: 持有者标识
+        :param lease_seconds: 租约时长（秒）
+        :param interval: 续租间隔（秒）
+        """
+        self.session = session
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.model = SessionLeaseModel()
+        self._task = None
+    
+    async def acquire(self):
+        """
+        领取租约并开始定期续租
+        
+        :raises SessionInUseError: 会话正在被其他进程使用
+        """
+        holder = await self.model.acquire(self.session, self.owner, self.lease_seconds)
+        if holder != self.owner:
+            raise SessionInUseError(
+                f"用户会话 {self.session} 正在被 {holder} 使用，同一会话只能在一个进程中运行，"
+                f"其他 worker 需要使用各自登录的会话（USER_SESSION_NAME）"
+            )
+        if self._task is None:
+            self._task = asyncio.create_task(self._renew())
+    
+    async def release(self):
+        """停止续租并释放租约"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.model.release(self.session, self.owner)
+        except Exception as e:
+            logger.error(f"释放用户会话 {self.session} 的租约失败: {str(e)}")
+    
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                holder = await self.model.acquire(self.session, self.owner, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"续租用户会话 {self.session} 失败: {str(e)}")
+                continue
+            if holder != self.owner:
+                logger.error(f"用户会话 {self.session} 的租约已被 {holder} 领取（续租中断超过 {self.lease_seconds} 秒）")
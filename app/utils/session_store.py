@@ -0,0 +1,198 @@
+import time
+import heapq
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from app.models.search_session import SearchSessionModel
+from app.config.settings import AUTO_DELETE_TIMEOUT, SEARCH_SESSION_MAX, SEARCH_SESSION_PERSIST
+
+logger = logging.getLogger(__name__)
+
+def _to_datetime(timestamp):
+    """Unix时间戳转为MongoDB使用的UTC时间"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+def _to_timestamp(value):
+    """MongoDB返回的UTC时间转为Unix时间戳"""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+class ExpiryScheduler:
+    def __init__(self, callback):
+        """
+        基于最小堆的过期调度器：所有定时任务共用一个后台任务，而不是每个任务一个 sleep
+        
+        :param callback: 到期时调用的协程函数，参数为键
+        """
+        self.callback = callback
+        self._heap = []  # (到期时间戳, 键)
+        self._deadlines = {}  # 键 -> 当前有效的到期时间戳，用于取消和重新计划
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+    
+    def __len__(self):
+        return len(self._deadlines)
+    
+    def schedule(self, key, when):
+        """
+        计划在 when（Unix时间戳）调用回调，重复计划同一个键会覆盖之前的时间
+        
+        :param key: 键
+        :param when: 到期时间戳
+        """
+        self._deadlines[key] = when
+        heapq.heappush(self._heap, (when, key))
+        self._wakeup.set()
+    
+    def cancel(self, key):
+        """取消计划，堆中的旧条目到期时会被跳过"""
+        self._deadlines.pop(key, None)
+    
+    def start(self):
+        """启动后台调度任务"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """停止后台调度任务"""
+        if self._task:
+            # 刚调用过 schedule() 时 wait_for 可能吞掉取消（Python 3.11 及以下），由标志位保证循环退出
+            self._stopping = True
+            self._wakeup.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while not self._stopping:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                when, key = heapq.heappop(self._heap)
+                # 已取消或已重新计划的条目
+                if self._deadlines.get(key) != when:
+                    continue
+                del self._deadlines[key]
+                try:
+                    await self.callback(key)
+                except Exception as e:
+                    logger.error(f"执行到期任务 {key} 时出错: {str(e)}")
+            
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+class SearchSessionStore:
+    def __init__(self, on_expire, ttl=AUTO_DELETE_TIMEOUT, max_size=SEARCH_SESSION_MAX, persist=SEARCH_SESSION_PERSIST):
+        """
+        搜索会话存储：有容量上限的内存LRU层，加上可选的MongoDB持久层
+        
+        会话以 (chat_id, message_id) 为键，到期时调用 on_expire 删除搜索结果消息，
+        即使删除失败也会清理会话，不会泄漏。
+        
+        :param on_expire: 会话到期时调用的协程函数，参数为 (chat_id, message_id)
+        :param ttl: 会话存活时间（秒）
+        :param max_size: 内存层最多保留的会话数
+        :param persist: 是否持久化到MongoDB，重启后恢复
+        """
+        self.on_expire = on_expire
+        self.ttl = ttl
+        self.max_size = max_size
+        self.model = SearchSessionModel() if persist else None
+        self.scheduler = ExpiryScheduler(self._expire)
+        self._memory = OrderedDict()  # (chat_id, message_id) -> (到期时间戳, 会话)
+    
+    def __len__(self):
+        return len(self._memory)
+    
+    async def start(self):
+        """启动过期调度，并恢复持久层中的会话（已过期的立即清理）"""
+        if self.model:
+            await self.model.ensure_indexes()
+            restored = 0
+            async for chat_id, message_id, expires_at in self.model.list_expirations():
+                self.scheduler.schedule((chat_id, message_id), _to_timestamp(expires_at))
+                restored += 1
+            if restored:
+                logger.info(f"已恢复 {restored} 个搜索会话的自动删除计划")
+        self.scheduler.start()
+    
+    async def stop(self):
+        """停止过期调度，持久层中的会话保留到下次启动"""
+        await self.scheduler.stop()
+    
+    def _remember(self, key, expires, session):
+        """写入内存层，超出容量时淘汰最久未使用的会话"""
+        self._memory[key] = (expires, session)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+    
+    async def add(self, chat_id, message_id, session):
+        """
+        保存新的搜索会话并计划到期删除
+        
+        :param chat_id: 群组ID
+        :param message_id: 搜索结果消息ID
+        :param session: 会话数据
+        """
+        key = (chat_id, message_id)
+        expires = time.time() + self.ttl
+        self._remember(key, expires, session)
+        self.scheduler.schedule(key, expires)
+        if self.model:
+            await self.model.save(chat_id, message_id, session, _to_datetime(expires))
+    
+    async def get(self, chat_id, message_id):
+        """
+        获取搜索会话，内存层未命中时从持久层加载
+        
+        :return: 会话数据，不存在或已过期时返回None
+        """
+        key = (chat_id, message_id)
+        entry = self._memory.get(key)
+        if entry is None and self.model:
+            stored = await self.model.get(chat_id, message_id)
+            if stored:
+                session, expires_at = stored
+                entry = (_to_timestamp(expires_at), session)
+        
+        if entry is None or entry[0] <= time.time():
+            return None
+        
+        self._remember(key, *entry)
+        return entry[1]
+    
+    async def save(self, chat_id, message_id, session):
+        """保存对已有会话的修改（如翻页记录的起点），不改变到期时间"""
+        key = (chat_id, message_id)
+        entry = self._memory.get(key)
+        if entry is None:
+            return
+        self._remember(key, entry[0], session)
+        if self.model:
+            await self.model.save(chat_id, message_id, session, _to_datetime(entry[0]))
+    
+    async def remove(self, chat_id, message_id):
+        """删除会话并取消到期计划"""
+        key = (chat_id, message_id)
+        self._memory.pop(key, None)
+        self.scheduler.cancel(key)
+        if self.model:
+            await self.model.delete(chat_id, message_id)
+    
+    async def _expire(self, key):
+        chat_id, message_id = key
+        try:
+            await self.on_expire(chat_id, message_id)
+        finally:
+            self._memory.pop(key, None)
+            if self.model:
+                await self.model.delete(chat_id, message_id)
@@ -0,0 +1,23 @@
+async def chunked(items, size):
+    """
+    把同步或异步可迭代对象按固定大小分块，逐块产出，不会一次读入全部元素
+    
+    :param items: 可迭代对象或异步可迭代对象
+    :param size: 每块的最大元素数
+    :return: 异步生成器，产出元素列表
+    """
+    chunk = []
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    else:
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
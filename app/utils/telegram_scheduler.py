@@ -0,0 +1,131 @@
+import time
+import asyncio
+import logging
+from pyrogram.errors import FloodWait
+from app.config.settings import (
+    TG_RATE_INITIAL, TG_RATE_MIN, TG_RATE_MAX, TG_RATE_BURST, TG_FLOOD_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# 请求优先级，数值越小越优先
+INTERACTIVE = 0  # 用户交互触发的调用，如 /index 前的权限检查
+BULK = 1  # 批量任务，如历史消息索引
+
+class TelegramScheduler:
+    # 每次成功调用后速率的加性增量（次/秒）
+    RATE_INCREASE = 0.05
+    
+    def __init__(self, rate=TG_RATE_INITIAL, min_rate=TG_RATE_MIN, max_rate=TG_RATE_MAX,
+                 burst=TG_RATE_BURST, max_retries=TG_FLOOD_MAX_RETRIES):
+        """
+        Telegram API 调用调度器：令牌桶限速，根据 FloodWait 自适应调整速率
+        
+        成功调用时速率加性增长，遇到 FloodWait 时按等待时长乘性下降，
+        并把当前速率的90%记为上限，之后只缓慢试探更高的速率（AIMD）。
+        有交互请求等待时，批量请求让出令牌。
+        
+        :param rate: 初始速率（次/秒）
+        :param min_rate: 最低速率
+        :param max_rate: 最高速率
+        :param burst: 令牌桶容量，即允许的突发调用数
+        :param max_retries: 遇到 FloodWait 后的最大重试次数
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.ceiling = max_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+        self.calls = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+    
+    async def acquire(self, priority=BULK):
+        """
+        等待获取一个令牌
+        
+        :param priority: INTERACTIVE 或 BULK
+        """
+        self._waiting[priority] += 1
+        try:
+            while True:
+                now = self._refill()
+                backoff = self._blocked_until - now
+                yield_to_higher = any(self._waiting[p] for p in self._waiting if p < priority)
+                if backoff <= 0 and not yield_to_higher and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                
+                wait = max(backoff, (1 - self._tokens) / self.rate)
+                if yield_to_higher:
+                    # 高优先级请求拿到令牌后重新检查
+                    wait = max(wait, 1 / self.rate)
+                await asyncio.sleep(max(wait, 0.001))
+        finally:
+            self._waiting[priority] -= 1
+    
+    async def call(self, func, *args, priority=BULK, **kwargs):
+        """
+        限速执行一次 API 调用，遇到 FloodWait 时等待指定时间后重试
+        
+        :param func: 协程函数，如 client.get_chat
+        :param priority: INTERACTIVE 或 BULK
+        :return: func 的返回值
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(priority)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWait as e:
+                self._on_flood_wait(e.value)
+                if attempt >= self.max_retries:
+                    raise
+                continue
+            
+            self._on_success()
+            return result
+    
+    def _on_success(self):
+        self.calls += 1
+        self.rate = min(self.ceiling, self.rate + self.RATE_INCREASE)
+        # 上限缓慢放宽，以便在限制解除后重新找到更高的可持续速率
+        self.ceiling = min(self.max_rate, self.ceiling + self.RATE_INCREASE / 10)
+    
+    def _on_flood_wait(self, seconds):
+        seconds = int(seconds or 0)
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        self.ceiling = max(self.min_rate, self.rate * 0.9)
+        # 等待越久说明超出越多，速率下降得越多
+        self.rate = max(self.min_rate, self.rate / (2 + seconds / 30))
+        self._tokens = 0
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        logger.warning(f"触发FloodWait，等待 {seconds} 秒，速率降至 {self.rate:.2f} 次/秒")
+    
+    def stats(self):
+        """
+        当前调度状态，用于监控
+        
+        :return: 速率、退避剩余时间、FloodWait次数及总等待时长、各优先级等待数
+        """
+        return {
+            "rate": round(self.rate, 3),
+            "ceiling": round(self.ceiling, 3),
+            "backoff": round(max(0.0, self._blocked_until - time.monotonic()), 3),
+            "calls": self.calls,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+            "waiting_interactive": self._waiting[INTERACTIVE],
+            "waiting_bulk": self._waiting[BULK]
+        }
@@ -0,0 +1,174 @@
+import re
+import unicodedata
+from collections import Counter
+
+# CJK字符范围：中日韩统一表意文字（含扩展A、兼容区）、日文假名、韩文音节
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+
+# 连续的CJK字符，或连续的非CJK文字字符（字母、数字）
+_RUN_PATTERN = re.compile(f"([{_CJK_RANGES}]+)|([^\\W_{_CJK_RANGES}]+)")
+
+# 非CJK单词按三元组切分，不超过该长度的单词整体作为一个词元
+WORD_GRAM_SIZE = 3
+
+# 模糊搜索的元组长度：单词两侧补空格后取三元组，CJK片段取二元组
+FUZZY_GRAM_SIZE = 3
+CJK_FUZZY_GRAM_SIZE = 2
+
+def normalize_text(text):
+    """
+    规范化文本：全角转半角、统一大小写
+    
+    :param text: 原始文本
+    :return: 规范化后的文本
+    """
+    return unicodedata.normalize("NFKC", text or "").casefold()
+
+def _split_runs(text):
+    """
+    将规范化文本切分为CJK片段和单词片段
+    
+    :param text: 规范化后的文本
+    :return: (片段, 是否为CJK) 列表
+    """
+    runs = []
+    for match in _RUN_PATTERN.finditer(text):
+        if match.group(1):
+            runs.append((match.group(1), True))
+        else:
+            runs.append((match.group(2), False))
+    return runs
+
+def _ngrams(text, n):
+    """生成文本的全部n元组"""
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+def _word_tokens(word):
+    """非CJK单词的词元：短单词整体保留，长单词切分为三元组"""
+    if len(word) <= WORD_GRAM_SIZE:
+        return [word]
+    return _ngrams(word, WORD_GRAM_SIZE)
+
+def count_search_tokens(file_name):
+    """
+    统计文件名中每个搜索词元出现的次数，用于相关度评分的词频
+    
+    :param file_name: 文件名
+    :return: Counter，词元 -> 出现次数
+    """
+    counts = Counter()
+    for run, is_cjk in _split_runs(normalize_text(file_name)):
+        if is_cjk:
+            counts.update(run)
+            counts.update(_ngrams(run, 2))
+        else:
+            counts.update(_word_tokens(run))
+    return counts
+
+def build_search_tokens(file_name):
+    """
+    生成文件名的搜索词元，存储在文档的 search_tokens 字段中
+    
+    CJK片段同时存储单字和二元组，非CJK单词存储三元组，
+    因此任意连续的中文片段都可以通过词元精确查找，无需正则扫描。
+    
+    :param file_name: 文件名
+    :return: 去重排序后的词元列表
+    """
+    return sorted(count_search_tokens(file_name))
+
+def build_query_tokens(keyword):
+    """
+    生成搜索关键词的查询词元，所有词元都必须出现在文档中
+    
+    单个汉字使用单字词元，更长的中文片段使用二元组；
+    词元按选择性从高到低排列，最具区分度的词元放在最前面，
+    MongoDB 会用 $all 的第一个元素确定索引扫描范围。
+    
+    短于 WORD_GRAM_SIZE 的非CJK单词没有对应的词元（文档中只有更长子串的词元），
+    不在返回结果中，由 build_query_substrings 按子串匹配。
+    
+    :param keyword: 搜索关键词
+    :return: 去重后的词元列表，无可搜索内容时为空列表
+    """
+    tokens = []
+    for run, is_cjk in _split_runs(normalize_text(keyword)):
+        if is_cjk:
+            grams = [run] if len(run) == 1 else _ngrams(run, 2)
+        elif len(run) < WORD_GRAM_SIZE:
+            continue
+        else:
+            grams = _word_tokens(run)
+        for gram in grams:
+            if gram not in tokens:
+                tokens.append(gram)
+    # 多字符词元比单字词元的文档频率低得多，优先作为索引扫描入口
+    return sorted(tokens, key=len, reverse=True)
+
+def build_query_substrings(keyword):
+    """
+    获取关键词中需要按子串匹配的短单词
+    
+    "li" 应当匹配 "live"、"mp" 应当匹配 "mp3"，但文档只为单词中长度为 WORD_GRAM_SIZE 的子串存储词元，
+    这些短单词无法通过词元查找，改为在文件名中做子串匹配；有其他词元时只需检查词元命中的文档。
+    
+    :param keyword: 搜索关键词
+    :return: 规范化后的短单词列表
+    """
+    substrings = []
+    for run, is_cjk in _split_runs(normalize_text(keyword)):
+        if not is_cjk and len(run) < WORD_GRAM_SIZE and run not in substrings:
+            substrings.append(run)
+    return substrings
+
+def substring_pattern(text):
+    """
+    生成短单词的子串匹配正则，数据库的 $regex 和内存索引使用同一个表达式，两边结果一致
+    
+    短单词已由 normalize_text 规范化，数据库中的原始文件名却可能是大写或全角形式：
+    每个字符展开为包含其大写和全角变体的字符组，在原始文件名上匹配，不依赖各自忽略大小写的实现。
+    
+    :param text: build_query_substrings 得到的短单词
+    :return: 正则表达式字符串
+    """
+    parts = []
+    for char in text:
+        variants = {char}
+        upper = char.upper()
+        if len(upper) == 1:
+            variants.add(upper)
+        for variant in list(variants):
+            if "!" <= variant <= "~":
+                variants.add(chr(ord(variant) + 0xFEE0))
+        parts.append("[" + "".join(re.escape(variant) for variant in sorted(variants)) + "]")
+    return "".join(parts)
+
+def build_fuzzy_grams(text):
+    """
+    生成模糊搜索用的元组集合，存储在文档的 trigrams 字段中
+    
+    单词前补两个空格、后补一个空格再切分三元组（与 pg_trgm 相同），
+    词首和短单词也能产生足够的元组；单个汉字信息量远大于字母，CJK片段使用二元组。
+    拼写错误只影响附近的少数元组，其余元组仍可命中。
+    
+    :param text: 文件名或搜索关键词
+    :return: 去重排序后的元组列表
+    """
+    grams = set()
+    for run, is_cjk in _split_runs(normalize_text(text)):
+        if is_cjk:
+            grams.update([run] if len(run) < CJK_FUZZY_GRAM_SIZE else _ngrams(run, CJK_FUZZY_GRAM_SIZE))
+        else:
+            grams.update(_ngrams(f"  {run} ", FUZZY_GRAM_SIZE))
+    return sorted(grams)
+
+def compact_text(text):
+    """
+    去掉空格和标点后的规范化文本，用于编辑距离比较
+    
+    "Jay Chou" 与 "jaychou" 的紧凑形式相同，分词差异不计入编辑距离。
+    
+    :param text: 原始文本
+    :return: 紧凑文本
+    """
+    return "".join(run for run, _ in _split_runs(normalize_text(text)))
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+import time
+
+class TTLCache:
+    """带过期时间的LRU缓存，超过容量时淘汰最久未使用的条目"""
+    
+    def __init__(self, max_size, ttl):
+        """
+        :param max_size: 最大条目数
+        :param ttl: 条目的有效期（秒）
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (过期时间, 值)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+    
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def get(self, key, count=True):
+        """
+        获取未过期的值
+        
+        :param key: 键
+        :param count: 是否计入命中率
+        :return: 值，不存在或已过期时返回None
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[1]
+        
+        if entry is not None:
+            del self._entries[key]
+        if count:
+            self.misses += 1
+        return None
+    
+    def set(self, key, value, ttl=None):
+        """
+        保存值
+        
+        :param key: 键
+        :param value: 值，不能为None
+        :param ttl: 本条目的有效期（秒），默认使用缓存的 ttl
+        """
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def pop(self, key):
+        """删除条目"""
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
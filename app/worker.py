@@ -0,0 +1,135 @@
+import logging
+import asyncio
+from pyrogram import idle
+from app.config.settings import (
+    SESSION_NAME, WORKER_ID, MONGODB_AUTO_INDEX, METRICS_ENABLED, METRICS_HOST, METRICS_PORT, EVENT_LOOP_LAG_INTERVAL,
+    RECONCILE_ENABLED, USER_SESSION_NAME
+)
+from app.utils.indexing import MediaIndexer
+from app.utils.live_sync import LiveSync
+from app.utils.reconciler import Reconciler
+from app.utils.index_jobs import IndexJobManager
+from app.utils.session_lease import SessionLease
+from app.utils.telegram_scheduler import TelegramScheduler, INTERACTIVE
+from app.utils.metrics import registry, MetricsServer, EventLoopMonitor
+from app.utils.clients import (
+    check_credentials, build_proxy, create_user_client, create_bot_client, register_client_metrics
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class IndexWorker:
+    def __init__(self):
+        """
+        索引 worker（RUN_MODE=worker）：运行用户客户端、实时同步、索引校验和索引任务，不处理机器人命令
+        
+        /index 任务由前端写入 index_jobs 集合，worker 原子地领取后执行，可以同时运行多个 worker，
+        索引负载不会占用前端的事件循环。机器人客户端只用于更新进度消息：不接收更新，
+        会话只保存在内存中，多个 worker 不会争用前端的会话文件。
+        用户会话（USER_SESSION_NAME）同一时间只能由一个进程使用，启动时领取 MongoDB 中的会话租约，
+        会话已被其他进程使用时 worker 直接退出；多个 worker 需要各自用 auth_user.py 登录不同的会话。
+        """
+        logger.info(f"初始化索引 worker: {WORKER_ID}")
+        check_credentials()
+        proxy = build_proxy()
+        
+        self.user = create_user_client(proxy)
+        self.session_lease = SessionLease(USER_SESSION_NAME)
+        # 用户客户端的所有 API 调用共用一个调度器：令牌桶限速，交互调用优先于批量索引
+        self.user_scheduler = TelegramScheduler()
+        self.bot = create_bot_client(proxy, name=SESSION_NAME + "_worker_bot", in_memory=True, no_updates=True)
+        
+        self.indexer = MediaIndexer(self.user, self.user_scheduler)
+        self.index_jobs = IndexJobManager(self.indexer, self.bot, shared=True)
+        self.live_sync = LiveSync(self.indexer)
+        self.reconciler = Reconciler(self.indexer) if RECONCILE_ENABLED else None
+        
+        # 指标接口，与前端在同一台主机上运行时需要使用不同的 METRICS_PORT
+        self.metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_ENABLED else None
+        self.loop_monitor = EventLoopMonitor(EVENT_LOOP_LAG_INTERVAL) if METRICS_ENABLED else None
+        register_client_metrics(self.user_scheduler)
+        registry.gauge("ingest_queue_size", "实时写入队列中等待写入的媒体文件数", lambda: len(self.indexer.ingest_queue))
+        registry.gauge("index_jobs_running", "本 worker 进行中的索引任务数", lambda: self.index_jobs.running_count())
+        
+        # 用户客户端 - 处理新消息、编辑和删除
+        self.live_sync.register(self.user)
+    
+    async def start(self):
+        """启动 worker：用户客户端无法启动时直接退出，没有用户客户端的 worker 无法工作"""
+        if MONGODB_AUTO_INDEX:
+            await self.indexer.db.ensure_indexes()
+        
+        self.indexer.start()
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"启动指标接口失败: {str(e)}")
+            self.loop_monitor.start()
+        
+        logger.info("正在启动用户客户端...")
+        await self.session_lease.acquire()
+        await self.user.start()
+        user_info = await self.user_scheduler.call(self.user.get_me, priority=INTERACTIVE)
+        logger.info(f"用户客户端已启动: {user_info.first_name}")
+        
+        await self.bot.start()
+        await self.index_jobs.start()
+        self.live_sync.start()
+        if self.reconciler:
+            self.reconciler.start()
+        
+        print(f"\n{'='*30}")
+        print(f"索引 worker 已启动: {WORKER_ID}")
+        print(f"同时索引 {self.index_jobs.concurrency} 个群组")
+        print(f"{'='*30}\n")
+        
+        await idle()
+    
+    async def stop(self):
+        """停止 worker，进行中的任务归还到队列，由其他 worker 或重启后的 worker 继续"""
+        try:
+            await self.index_jobs.stop()
+            if self.bot.is_connected:
+                await self.bot.stop()
+            if self.user.is_connected:
+                await self.user.stop()
+                logger.info("用户客户端已停止")
+            await self.session_lease.release()
+        except Exception as e:
+            logger.error(f"停止客户端时出错: {str(e)}")
+        
+        # 用户客户端停止后不会再有新消息入队，保存实时同步的检查点，写入队列中剩余的媒体文件
+        try:
+            await self.live_sync.stop()
+            if self.reconciler:
+                await self.reconciler.stop()
+            await self.indexer.stop()
+        except Exception as e:
+            logger.error(f"写入剩余媒体文件时出错: {str(e)}")
+        
+        if self.metrics_server:
+            await self.loop_monitor.stop()
+            await self.metrics_server.stop()
+
+async def main():
+    worker = IndexWorker()
+    try:
+        await worker.start()
+    except KeyboardInterrupt:
+        logger.info("接收到退出信号")
+    finally:
+        await worker.stop()
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
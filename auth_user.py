@@ -4,7 +4,7 @@ import sys
 import platform
 from pyrogram import Client
 from app.config.settings import (
-    API_ID, API_HASH, SESSION_NAME,
+    API_ID, API_HASH, USER_SESSION_NAME,
     USE_PROXY, PROXY_TYPE, PROXY_HOST, PROXY_PORT, PROXY_USERNAME, PROXY_PASSWORD
 )
 
@@ -20,7 +20,7 @@ async def main():
         sys.exit(1)
     
     # 设置会话名称
-    session_name = SESSION_NAME + "_user"
+    session_name = USER_SESSION_NAME
     
     print(f"使用会话名: {session_name}")
     
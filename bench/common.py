@@ -0,0 +1,72 @@
+import os
+import time
+import random
+import string
+from datetime import datetime, timedelta
+
+# 基准测试默认使用独立的数据库，避免污染正式数据
+os.environ.setdefault("DB_NAME", "tg_media_search_bench")
+
+# 合成文件名使用的词表（中英文混合，贴近真实群组）
+WORDS = [
+    "周杰伦", "晴天", "稻香", "七里香", "演唱会", "现场版", "无损", "合集",
+    "陈奕迅", "十年", "浮夸", "林俊杰", "江南", "电影", "第一季", "第二集",
+    "live", "remix", "official", "mv", "concert", "ost", "1080p", "flac",
+]
+
+def random_file_name(rng=random):
+    """生成一个随机的合成文件名"""
+    words = rng.sample(WORDS, rng.randint(2, 4))
+    suffix = "".join(rng.choice(string.ascii_lowercase) for _ in range(4))
+    ext = rng.choice([".mp3", ".flac", ".mp4", ".mkv"])
+    return "_".join(words) + "_" + suffix + ext
+
+def make_file_data(chat_id, message_id, rng=random, base_time=None):
+    """生成一条合成的媒体文件记录，字段与 MediaIndexer 写入的一致"""
+    base_time = base_time or datetime(2024, 1, 1)
+    file_name = random_file_name(rng)
+    media_type = "audio" if file_name.endswith((".mp3", ".flac")) else "video"
+    return {
+        # 每条合成记录都是不同的文件，不会被目录去重合并
+        "file_unique_id": f"bench{chat_id}_{message_id}",
+        "file_name": file_name,
+        "message_id": message_id,
+        "chat_id": chat_id,
+        "sender_id": rng.randint(1, 1000),
+        "timestamp": base_time + timedelta(seconds=message_id),
+        "media_type": media_type,
+        "file_size": rng.randint(10**6, 10**9),
+        "duration": rng.randint(60, 7200),
+    }
+
+def percentile(samples, pct):
+    """计算百分位数（最近秩法）"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def summarize(name, samples_ms):
+    """将一组毫秒级耗时汇总为一行报告"""
+    return (
+        f"{name:<28} n={len(samples_ms):<6} "
+        f"p50={percentile(samples_ms, 50):8.2f}ms "
+        f"p95={percentile(samples_ms, 95):8.2f}ms "
+        f"p99={percentile(samples_ms, 99):8.2f}ms "
+        f"max={max(samples_ms) if samples_ms else 0:8.2f}ms"
+    )
+
+class Timer:
+    """简单的计时上下文，记录毫秒耗时到列表"""
+    
+    def __init__(self, samples):
+        self.samples = samples
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.samples.append((time.perf_counter() - self.start) * 1000)
+        return False
@@ -0,0 +1,248 @@
+"""
+基准测试用的假 Telegram 客户端：不连接网络，返回真实的 Pyrogram 类型对象
+
+同一个 FakeClient 既可以作为用户客户端交给 MediaIndexer 拉取历史，
+也可以作为机器人客户端交给 SearchHandler：处理器注册、回复、编辑和回调应答都在内存中完成。
+"""
+import asyncio
+import itertools
+import random
+from datetime import datetime, timedelta
+from pyrogram import types
+from pyrogram.enums import ChatType, MessageMediaType
+from pyrogram.file_id import FileId, FileType, FileUniqueId, FileUniqueType
+from bench.common import random_file_name
+
+# 合成媒体的类型分布：(类型, 权重)，document_other 不是音视频，会被索引器跳过
+MEDIA_KINDS = [
+    ("audio", 50),
+    ("video", 25),
+    ("document_audio", 10),
+    ("document_video", 10),
+    ("document_other", 5),
+]
+
+class SyntheticHistory:
+    def __init__(self, chat_id, size, seed=42, media_ratio=0.6, repost_ratio=0.1,
+                 base_time=datetime(2024, 1, 1), title="bench"):
+        """
+        一个群组的合成历史消息，消息ID为 1..size
+        
+        每条消息只由 (seed, 消息ID) 决定，按需生成，不需要预先保存整段历史，
+        相同参数在任何提交上都生成完全相同的消息。
+        
+        :param chat_id: 群组ID
+        :param size: 消息总数
+        :param seed: 随机种子
+        :param media_ratio: 媒体消息占比，其余为文本消息
+        :param repost_ratio: 媒体消息中转发较早文件的占比（file_unique_id 相同）
+        :param base_time: 第一条消息的时间
+        :param title: 群组名称
+        """
+        self.chat_id = chat_id
+        self.size = size
+        self.seed = seed
+        self.media_ratio = media_ratio
+        self.repost_ratio = repost_ratio
+        self.base_time = base_time
+        self.chat = types.Chat(id=chat_id, type=ChatType.SUPERGROUP, title=title)
+        # 模拟已删除的消息ID
+        self.deleted = set()
+    
+    def _rng(self, key):
+        return random.Random(self.seed * 1000003 + key)
+    
+    def exists(self, message_id):
+        return 1 <= message_id <= self.size and message_id not in self.deleted
+    
+    def message(self, message_id, client=None):
+        """
+        生成指定ID的消息
+        
+        :param message_id: 消息ID
+        :param client: 消息绑定的客户端
+        :return: pyrogram.types.Message
+        """
+        rng = self._rng(message_id)
+        sender = types.User(id=rng.randint(1, 1000), first_name="bench")
+        date = self.base_time + timedelta(seconds=message_id * 30)
+        if rng.random() >= self.media_ratio:
+            return types.Message(
+                id=message_id, chat=self.chat, from_user=sender, date=date,
+                text=f"text message {message_id}", client=client
+            )
+        
+        # 转发时复用较早消息的文件，文件内容只由文件编号决定
+        file_key = message_id
+        if message_id > 1 and rng.random() < self.repost_ratio:
+            file_key = rng.randint(1, message_id - 1)
+        kind, media = self._media(file_key)
+        media_type = {"audio": MessageMediaType.AUDIO, "video": MessageMediaType.VIDEO}.get(
+            kind, MessageMediaType.DOCUMENT
+        )
+        return types.Message(
+            id=message_id, chat=self.chat, from_user=sender, date=date, media=media_type,
+            client=client, **{media_type.value: media}
+        )
+    
+    def _media(self, file_key):
+        """生成文件编号对应的媒体对象"""
+        rng = self._rng(-file_key)
+        kind = rng.choices([kind for kind, _ in MEDIA_KINDS], [weight for _, weight in MEDIA_KINDS])[0]
+        file_name = random_file_name(rng)
+        file_type = {"audio": FileType.AUDIO, "video": FileType.VIDEO}.get(kind, FileType.DOCUMENT)
+        file_id = FileId(
+            file_type=file_type, dc_id=4, media_id=self.seed * 10 ** 9 + file_key,
+            access_hash=rng.getrandbits(63), file_reference=b""
+        ).encode()
+        file_unique_id = FileUniqueId(
+            file_unique_type=FileUniqueType.DOCUMENT, media_id=self.seed * 10 ** 9 + file_key
+        ).encode()
+        file_size = rng.randint(10 ** 6, 10 ** 9)
+        duration = rng.randint(60, 7200)
+        
+        if kind == "audio":
+            return kind, types.Audio(
+                file_id=file_id, file_unique_id=file_unique_id, duration=duration,
+                file_name=file_name, file_size=file_size, mime_type="audio/mpeg"
+            )
+        if kind == "video":
+            return kind, types.Video(
+                file_id=file_id, file_unique_id=file_unique_id, width=1920, height=1080,
+                duration=duration, file_name=file_name, file_size=file_size, mime_type="video/mp4"
+            )
+        mime_type = {"document_audio": "audio/flac", "document_video": "video/x-matroska"}.get(kind, "application/pdf")
+        return kind, types.Document(
+            file_id=file_id, file_unique_id=file_unique_id, file_name=file_name,
+            file_size=file_size, mime_type=mime_type
+        )
+
+class FakeClient:
+    def __init__(self, histories=(), latency=0.0):
+        """
+        假的 Pyrogram 客户端
+        
+        :param histories: SyntheticHistory 列表
+        :param latency: 每次 API 调用模拟的网络往返时间（秒）
+        """
+        self.histories = {history.chat_id: history for history in histories}
+        self.latency = latency
+        self.calls = 0
+        self.is_connected = True
+        self.me = types.User(id=999999, first_name="bench", username="bench_bot", is_self=True, is_bot=True)
+        # 注册的处理器：(类型, 过滤器, 函数)
+        self.handlers = []
+        # 机器人发送和编辑的消息：消息ID -> Message
+        self.sent = {}
+        self._message_ids = itertools.count(10 ** 6)
+        self._callback_ids = itertools.count(1)
+    
+    async def _call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+    
+    # 用户客户端接口
+    
+    async def get_chat_history(self, chat_id, limit=0, offset_id=0):
+        """与 Client.get_chat_history 相同：从 offset_id 之前开始，从新到旧返回消息"""
+        await self._call()
+        history = self.histories[chat_id]
+        newest = offset_id - 1 if offset_id else history.size
+        returned = 0
+        for message_id in range(newest, 0, -1):
+            if returned >= limit:
+                break
+            if history.exists(message_id):
+                returned += 1
+                yield history.message(message_id, self)
+    
+    async def get_messages(self, chat_id, message_ids):
+        """与 Client.get_messages 相同：按请求顺序返回，不存在的消息为 empty"""
+        await self._call()
+        history = self.histories[chat_id]
+        return [
+            history.message(message_id, self) if history.exists(message_id) else types.Message(id=message_id, empty=True)
+            for message_id in message_ids
+        ]
+    
+    async def get_chat(self, chat_id):
+        await self._call()
+        return self.histories[chat_id].chat
+    
+    async def get_me(self):
+        await self._call()
+        return self.me
+    
+    async def get_users(self, user_id):
+        await self._call()
+        return types.User(id=user_id if isinstance(user_id, int) else abs(hash(user_id)) % 1000 + 1, first_name="bench")
+    
+    # 机器人客户端接口
+    
+    def on_message(self, filters=None):
+        return self._register("message", filters)
+    
+    def on_callback_query(self, filters=None):
+        return self._register("callback_query", filters)
+    
+    def on_inline_query(self, filters=None):
+        return self._register("inline_query", filters)
+    
+    def add_handler(self, handler, group=0):
+        self.handlers.append((type(handler).__name__, handler.filters, handler.callback))
+    
+    def _register(self, kind, filters):
+        def decorator(func):
+            self.handlers.append((kind, filters, func))
+            return func
+        return decorator
+    
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._call()
+        message = types.Message(
+            id=next(self._message_ids), chat=self._chat(chat_id), from_user=self.me,
+            date=datetime.now(), text=text, reply_markup=reply_markup, client=self
+        )
+        self.sent[message.id] = message
+        return message
+    
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        await self._call()
+        message = self.sent.get(message_id)
+        if message is not None:
+            message.text = text
+            message.reply_markup = reply_markup
+        return message
+    
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        await self._call()
+        return True
+    
+    async def delete_messages(self, chat_id, message_ids, revoke=True):
+        await self._call()
+        ids = message_ids if isinstance(message_ids, list) else [message_ids]
+        for message_id in ids:
+            self.sent.pop(message_id, None)
+        return len(ids)
+    
+    # 构造用户输入
+    
+    def command(self, chat_id, user_id, text):
+        """构造一条群组成员发送的命令消息"""
+        return types.Message(
+            id=next(self._message_ids), chat=self._chat(chat_id),
+            from_user=types.User(id=user_id, first_name="member"),
+            date=datetime.now(), text=text, client=self
+        )
+    
+    def callback(self, message, user_id, data):
+        """构造一次点击 message 上按钮的回调"""
+        return types.CallbackQuery(
+            id=str(next(self._callback_ids)), from_user=types.User(id=user_id, first_name="member"),
+            chat_instance="bench", message=message, data=data, client=self
+        )
+    
+    def _chat(self, chat_id):
+        history = self.histories.get(chat_id)
+        return history.chat if history else types.Chat(id=chat_id, type=ChatType.SUPERGROUP)
@@ -0,0 +1,281 @@
+"""
+离线基准测试：用假 Telegram 客户端驱动真实的 MediaIndexer 和 SearchHandler
+
+1. 索引阶段：MediaIndexer.index_chat_history 拉取合成历史（音频/视频/文件混合、中英文文件名、重复转发），
+   报告消息吞吐量和写入吞吐量
+2. 存储阶段：目录文档的平均大小、搜索结果每条读取的字节数和数据库分页延迟；
+   mongod 上还报告索引总大小，以及 type: 筛选的结果页是否由索引覆盖
+3. 搜索阶段：向 SearchHandler 发送合成的 /f 命令并点击翻页按钮，报告延迟百分位
+
+数据库可以是本地 mongod，也可以是进程内的 mongomock（需要 pip install mongomock-motor），
+mongomock 的绝对耗时与真实数据库差别很大，只适合在同一台机器上对比不同提交。
+消息和查询由固定的随机种子生成，--json 保存结果（附带提交哈希），--compare 与之前的结果对比。
+
+用法:
+    python -m bench.offline --backend mongomock --history 5000
+    python -m bench.offline --history 50000 --json bench-results/head.json
+    python -m bench.offline --history 50000 --compare bench-results/head.json
+"""
+import argparse
+import asyncio
+import bson
+import json
+import random
+import subprocess
+import time
+from datetime import datetime
+from bench.common import WORDS, percentile, summarize, Timer
+from bench.fake_telegram import SyntheticHistory, FakeClient
+from app.config.settings import DB_NAME, RESULTS_PER_PAGE
+from app.models import database
+from app.utils.query_parser import parse_query
+from app.utils.telegram_scheduler import TelegramScheduler
+
+CHAT_ID = -1001000000010
+USER_ID = 4242
+
+# 搜索语句模板：单个关键词、两个关键词、附加筛选条件
+QUERY_TEMPLATES = ["{a}", "{a} {b}", "{a} type:audio", "{a} dur<10m"]
+
+# 基准测试会清空的集合
+BENCH_COLLECTIONS = [
+    "media_files", "media_occurrences", "media_removals", "index_checkpoints", "search_sessions", "query_stats"
+]
+
+def use_backend(backend):
+    """选择数据库后端，需要在创建任何模型之前调用"""
+    if backend != "mongomock":
+        return
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("mongomock 后端需要安装 mongomock-motor: pip install mongomock-motor")
+    database.AsyncIOMotorClient = AsyncMongoMockClient
+
+async def reset_database():
+    """清空基准数据库中的相关集合"""
+    db = database.get_database()
+    for name in BENCH_COLLECTIONS:
+        await db[name].drop()
+
+def git_revision():
+    """当前提交的哈希，工作区有改动时加上 -dirty"""
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"]) != 0
+        return revision + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+def latency_summary(samples_ms):
+    return {
+        "n": len(samples_ms),
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+    }
+
+async def bench_indexing(args):
+    """索引阶段：完整索引一段合成历史"""
+    from app.utils.indexing import MediaIndexer
+    
+    history = SyntheticHistory(
+        CHAT_ID, args.history, seed=args.seed, media_ratio=args.media_ratio, repost_ratio=args.repost_ratio
+    )
+    client = FakeClient([history], latency=args.api_latency / 1000)
+    # 限速交给假客户端的模拟延迟，调度器放开速率，测量的是本地处理和数据库写入能力
+    scheduler = TelegramScheduler(rate=args.tg_rate, max_rate=args.tg_rate, burst=args.tg_rate)
+    indexer = MediaIndexer(client, scheduler)
+    await indexer.db.ensure_indexes()
+    
+    started = time.perf_counter()
+    stats = await indexer.index_chat_history(CHAT_ID)
+    elapsed = time.perf_counter() - started
+    
+    catalogue = await indexer.db.collection.count_documents({"chat_id": CHAT_ID})
+    print(f"\n索引 {args.history} 条消息，耗时 {elapsed:.2f}s | {stats.summary()}")
+    print(
+        f"{'messages/s':<28} {stats.counts['fetch'] / elapsed:10.1f}\n"
+        f"{'inserts/s':<28} {stats.written / elapsed:10.1f}\n"
+        f"{'catalogue docs':<28} {catalogue:10d}（{stats.written} 条媒体消息）"
+    )
+    return {
+        "seconds": round(elapsed, 3),
+        "messages": stats.counts["fetch"],
+        "inserted": stats.written,
+        "catalogue_docs": catalogue,
+        "messages_per_s": round(stats.counts["fetch"] / elapsed, 1),
+        "inserts_per_s": round(stats.written / elapsed, 1),
+    }
+
+async def bench_search(args):
+    """搜索阶段：/f 命令和翻页回调"""
+    from app.handlers.search_handler import SearchHandler
+    
+    bot = FakeClient([SyntheticHistory(CHAT_ID, 0)])
+    handler = SearchHandler(bot)
+    if args.no_hot_index:
+        handler.hot_index = None
+    await handler.start()
+    
+    # 预热：第一次搜索会在后台把群组加载到内存索引，等加载完成后再计时
+    await handler.handle_search_command(bot, bot.command(CHAT_ID, USER_ID, f"/f {WORDS[0]}"))
+    while handler.hot_index and CHAT_ID in handler.hot_index._loading:
+        await asyncio.sleep(0.01)
+    
+    rng = random.Random(args.seed)
+    search_samples, page_samples = [], []
+    errors = 0
+    for _ in range(args.searches):
+        a, b = rng.sample(WORDS, 2)
+        query = rng.choice(QUERY_TEMPLATES).format(a=a, b=b)
+        command = bot.command(CHAT_ID, USER_ID, f"/f {query}")
+        sent_before = set(bot.sent)
+        with Timer(search_samples):
+            await handler.handle_search_command(bot, command)
+        
+        replies = [bot.sent[message_id] for message_id in bot.sent if message_id not in sent_before]
+        if not replies:
+            continue
+        reply = replies[-1]
+        if "错误" in reply.text:
+            errors += 1
+            continue
+        for page in range(2, args.pages + 1):
+            if not reply.reply_markup or f"page:{page}" not in _callback_data(reply):
+                break
+            with Timer(page_samples):
+                await handler.handle_page_callback(bot, bot.callback(reply, USER_ID, f"page:{page}"))
+    
+    await handler.stop()
+    print(f"\n搜索 {args.searches} 次，每次最多翻到第 {args.pages} 页（每页 {RESULTS_PER_PAGE} 条）")
+    print(summarize("/f latency", search_samples))
+    print(summarize("page callback latency", page_samples))
+    print(f"{'query phase p50':<28} {handler.command_latency['query'].quantile(0.5) * 1000:g}ms（分桶上界）")
+    if errors:
+        print(f"⚠️ {errors} 次搜索返回错误")
+    return {
+        "search": latency_summary(search_samples),
+        "page": latency_summary(page_samples),
+        "errors": errors,
+    }
+
+async def bench_storage(args):
+    """存储阶段：目录文档的平均大小、搜索每页读取的字节数和数据库翻页延迟（不经过内存索引）"""
+    from app.models.media_file import MediaFileModel, RESULT_PROJECTION
+    
+    db = MediaFileModel()
+    stored = [len(bson.encode(doc)) async for doc in db.collection.find({"chat_id": CHAT_ID})]
+    
+    rng = random.Random(args.seed)
+    page_bytes, returned = 0, 0
+    page_samples = []
+    for _ in range(args.searches or 50):
+        a, b = rng.sample(WORDS, 2)
+        parsed = parse_query(rng.choice(QUERY_TEMPLATES + ["type:audio"]).format(a=a, b=b))
+        filters = parsed.mongo_filters()
+        with Timer(page_samples):
+            page = await db.search_page(parsed.keyword, CHAT_ID, RESULTS_PER_PAGE, filters=filters)
+        results = page["results"]
+        if len(results) == RESULTS_PER_PAGE:
+            # 第二页走键集分页
+            with Timer(page_samples):
+                results = results + await db.search_media_files(
+                    parsed.keyword, CHAT_ID, db.sort_key(results[-1]), RESULTS_PER_PAGE, filters
+                )
+        page_bytes += sum(len(bson.encode(doc)) for doc in results)
+        returned += len(results)
+    
+    result = {
+        "docs": len(stored),
+        "doc_bytes": round(sum(stored) / len(stored), 1) if stored else 0,
+        "result_doc_bytes": round(page_bytes / returned, 1) if returned else 0,
+        "page": latency_summary(page_samples),
+    }
+    # collStats 和 explain 只有 mongod 支持
+    try:
+        stats = await db.db.command("collStats", "media_files")
+        result["index_bytes"] = stats["totalIndexSize"]
+        explain = await db.collection.find(
+            {"chat_id": CHAT_ID, "media_type": "audio"}, RESULT_PROJECTION
+        ).sort([("timestamp", -1), ("_id", -1)]).limit(RESULTS_PER_PAGE).explain()
+        result["covered"] = explain["executionStats"]["totalDocsExamined"] == 0
+    except Exception:
+        pass
+    
+    print(f"\n目录 {result['docs']} 个文件，数据库分页 {len(page_samples)} 次")
+    print(
+        f"{'stored bytes/doc':<28} {result['doc_bytes']:10.1f}\n"
+        f"{'result bytes/doc':<28} {result['result_doc_bytes']:10.1f}"
+    )
+    if "index_bytes" in result:
+        print(f"{'index bytes':<28} {result['index_bytes']:10d}（type: 首页索引覆盖: {result['covered']}）")
+    print(summarize("db page latency", page_samples))
+    return result
+
+def _callback_data(message):
+    return {button.callback_data for row in message.reply_markup.inline_keyboard for button in row}
+
+def compare(previous, current):
+    """逐项对比两次结果"""
+    print(f"\n对比 {previous['revision']} -> {current['revision']}")
+    for section, metrics in current["results"].items():
+        old_metrics = previous["results"].get(section, {})
+        for name, value in _flatten(metrics):
+            old = dict(_flatten(old_metrics)).get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{section + '.' + name:<36} {old:>12} -> {value:<12} {change}")
+
+def _flatten(metrics, prefix=""):
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{name}.")
+        else:
+            yield prefix + name, value
+
+async def run(args):
+    use_backend(args.backend)
+    print(f"后端: {args.backend}，数据库: {DB_NAME}，提交: {git_revision()}")
+    await reset_database()
+    
+    results = {"indexing": await bench_indexing(args)}
+    results["storage"] = await bench_storage(args)
+    if args.searches:
+        results["search"] = await bench_search(args)
+    database.close_client()
+    
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json}")
+
+def main():
+    parser = argparse.ArgumentParser(description="离线索引与搜索基准测试（假 Telegram 客户端）")
+    parser.add_argument("--backend", choices=["mongod", "mongomock"], default="mongod",
+                        help="mongod 使用 MONGODB_URI 指向的数据库，mongomock 在进程内模拟")
+    parser.add_argument("--history", type=int, default=20000, help="合成历史的消息数")
+    parser.add_argument("--media-ratio", type=float, default=0.6, help="媒体消息占比")
+    parser.add_argument("--repost-ratio", type=float, default=0.1, help="媒体消息中重复转发的占比")
+    parser.add_argument("--api-latency", type=float, default=0, help="每次 Telegram API 调用模拟的往返时间（毫秒）")
+    parser.add_argument("--tg-rate", type=float, default=1000, help="调度器的 API 速率上限（次/秒）")
+    parser.add_argument("--searches", type=int, default=200, help="/f 命令次数，0 表示只测索引")
+    parser.add_argument("--pages", type=int, default=3, help="每次搜索最多翻到第几页")
+    parser.add_argument("--no-hot-index", action="store_true", help="关闭内存索引，只测数据库查询")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--json", help="保存结果的 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
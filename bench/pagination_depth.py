@@ -0,0 +1,77 @@
+"""
+基准测试：第1页与深页（默认第500页）的翻页延迟，对比 skip/limit 与键集分页
+
+用法（需要本地 MongoDB，默认使用 tg_media_search_bench 数据库）:
+    python -m bench.pagination_depth --docs 10000 --page 500
+"""
+import argparse
+import asyncio
+import random
+from pymongo import DESCENDING
+from bench.common import make_file_data, summarize, Timer
+from app.config.settings import DB_NAME, RESULTS_PER_PAGE
+from app.models.media_file import MediaFileModel
+from app.utils.tokenizer import build_search_tokens
+
+CHAT_ID = -1001000000003
+KEYWORD = "bench"
+
+async def preload(db, docs):
+    """预置一个所有记录都匹配关键词的群组，使深页真实存在"""
+    await db.collection.delete_many({})
+    await db.ensure_indexes()
+    rng = random.Random(42)
+    batch = []
+    for message_id in range(1, docs + 1):
+        doc = make_file_data(CHAT_ID, message_id, rng)
+        doc["file_name"] = f"{KEYWORD}_{doc['file_name']}"
+        doc["search_tokens"] = build_search_tokens(doc["file_name"])
+        batch.append(doc)
+    for i in range(0, len(batch), 1000):
+        await db.collection.insert_many(batch[i:i + 1000])
+
+async def skip_page(db, page):
+    """旧实现：skip 掉前面所有页"""
+    query = db.build_search_query(KEYWORD, CHAT_ID)
+    skip = (page - 1) * RESULTS_PER_PAGE
+    cursor = db.collection.find(query).sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    return await cursor.skip(skip).limit(RESULTS_PER_PAGE).to_list(length=RESULTS_PER_PAGE)
+
+async def cursor_for_page(db, page):
+    """取得某一页的键集起点（即前一页最后一条结果的排序键）"""
+    if page == 1:
+        return None
+    previous = await skip_page(db, page - 1)
+    return db.sort_key(previous[-1])
+
+async def run(args):
+    db = MediaFileModel()
+    print(f"预置 {args.docs} 条记录到 {DB_NAME} ...")
+    await preload(db, args.docs)
+    
+    for page in (1, args.page):
+        after = await cursor_for_page(db, page)
+        skip_samples, seek_samples = [], []
+        for _ in range(args.repeat):
+            with Timer(skip_samples):
+                await skip_page(db, page)
+            with Timer(seek_samples):
+                await db.search_media_files(KEYWORD, CHAT_ID, after, RESULTS_PER_PAGE)
+        print(f"\n第 {page} 页")
+        print(summarize("skip/limit", skip_samples))
+        print(summarize("keyset seek", seek_samples))
+    
+    db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="浅页与深页的翻页延迟基准测试")
+    parser.add_argument("--docs", type=int, default=10000, help="群组中预置的匹配记录数")
+    parser.add_argument("--page", type=int, default=500, help="测量的深页页码")
+    parser.add_argument("--repeat", type=int, default=50, help="每种方式的重复次数")
+    args = parser.parse_args()
+    if args.docs < args.page * RESULTS_PER_PAGE:
+        parser.error("--docs 不足以生成指定的深页")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+基准测试：在 /index 并行写入时测量 /f 搜索延迟
+
+用法（需要本地 MongoDB，默认使用 tg_media_search_bench 数据库）:
+    python -m bench.search_under_indexing --docs 20000 --duration 20
+    python -m bench.search_under_indexing --driver pymongo   # 对比旧的同步驱动
+"""
+import argparse
+import asyncio
+import random
+import time
+from pymongo import MongoClient
+from bench.common import WORDS, make_file_data, summarize, Timer
+from app.config.settings import MONGODB_URI, DB_NAME
+from app.models.media_file import MediaFileModel
+from app.utils.tokenizer import build_search_tokens
+
+SEARCH_CHAT_ID = -1001000000001
+INDEX_CHAT_ID = -1001000000002
+
+class BlockingMediaFileModel(MediaFileModel):
+    """旧实现的等价物：在协程中直接调用同步 pymongo，会阻塞事件循环"""
+    
+    def __init__(self):
+        super().__init__()
+        self.sync_collection = MongoClient(MONGODB_URI)[DB_NAME].media_files
+    
+    async def add_media_file(self, file_data):
+        file_data["search_tokens"] = build_search_tokens(file_data["file_name"])
+        if self.sync_collection.find_one({"message_id": file_data["message_id"], "chat_id": file_data["chat_id"]}):
+            return None
+        return self.sync_collection.insert_one(file_data).inserted_id
+    
+    async def search_media_files(self, keyword, chat_id, after=None, limit=10, filters=None):
+        query = self.build_search_query(keyword, chat_id, filters)
+        if query is None:
+            return []
+        if after is not None:
+            timestamp, last_id = after
+            query["$or"] = [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": last_id}}]
+        return list(self.sync_collection.find(query).sort([("timestamp", -1), ("_id", -1)]).limit(limit))
+    
+    async def count_search_results(self, keyword, chat_id):
+        return self.sync_collection.count_documents(self.build_search_query(keyword, chat_id))
+
+async def preload(db, docs):
+    """清空基准数据库并预置搜索群组的数据"""
+    await db.collection.delete_many({})
+    await db.ensure_indexes()
+    rng = random.Random(42)
+    batch = [make_file_data(SEARCH_CHAT_ID, i, rng) for i in range(1, docs + 1)]
+    for doc in batch:
+        doc["search_tokens"] = build_search_tokens(doc["file_name"])
+    for i in range(0, len(batch), 1000):
+        await db.collection.insert_many(batch[i:i + 1000])
+
+async def indexing_writer(db, stop, written):
+    """模拟 /index：持续向另一个群组写入新记录"""
+    rng = random.Random(7)
+    message_id = 0
+    while not stop.is_set():
+        message_id += 1
+        await db.add_media_file(make_file_data(INDEX_CHAT_ID, message_id, rng))
+        written[0] += 1
+        # 让出事件循环，对应真实索引器中每条消息之间的调度点
+        await asyncio.sleep(0)
+
+async def searcher(db, stop, samples):
+    """模拟 /f：与 handle_search_command 相同的 count + find 两次查询"""
+    rng = random.Random(11)
+    while not stop.is_set():
+        keyword = rng.choice(WORDS)
+        with Timer(samples):
+            total = await db.count_search_results(keyword, SEARCH_CHAT_ID)
+            if total:
+                await db.search_media_files(keyword, SEARCH_CHAT_ID, None, 10)
+        await asyncio.sleep(0.01)
+
+async def loop_lag_probe(stop, samples, interval=0.05):
+    """测量事件循环延迟：计划每 interval 秒唤醒一次，记录实际的超时量"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - start - interval) * 1000)
+
+async def run(args):
+    db = BlockingMediaFileModel() if args.driver == "pymongo" else MediaFileModel()
+    print(f"预置 {args.docs} 条记录到 {DB_NAME} ...")
+    await preload(db, args.docs)
+    
+    for with_indexing in (False, True):
+        stop = asyncio.Event()
+        search_samples, lag_samples, written = [], [], [0]
+        tasks = [asyncio.create_task(searcher(db, stop, search_samples)) for _ in range(args.searchers)]
+        tasks.append(asyncio.create_task(loop_lag_probe(stop, lag_samples)))
+        if with_indexing:
+            tasks += [asyncio.create_task(indexing_writer(db, stop, written)) for _ in range(args.writers)]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        
+        label = "并行索引" if with_indexing else "无索引负载"
+        print(f"\n[{args.driver}] {label}，写入 {written[0] / args.duration:.0f} 条/秒")
+        print(summarize("/f latency", search_samples))
+        print(summarize("event loop lag", lag_samples))
+    
+    db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="并行索引时的 /f 延迟基准测试")
+    parser.add_argument("--driver", choices=["motor", "pymongo"], default="motor")
+    parser.add_argument("--docs", type=int, default=20000, help="搜索群组中预置的记录数")
+    parser.add_argument("--duration", type=float, default=15, help="每个阶段的持续时间（秒）")
+    parser.add_argument("--searchers", type=int, default=4, help="并发搜索者数量")
+    parser.add_argument("--writers", type=int, default=4, help="并发写入者数量")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from app.models import database
+from app.models.media_file import MediaFileModel
+from app.utils.hot_index import HotIndex
+
+CHAT_ID = -1001000000001
+
+FILE_NAMES = [
+    "LIVE Show.mp3",
+    "ｌｉｖｅ 全角.flac",
+    "Olive.mp4",
+    "ＭＰ３ 合集.zip",
+    "Li Li - Song.ogg",
+    "nothing here.wav",
+]
+
+# 短单词的大小写、全角写法和混合查询
+QUERIES = ["li", "LI", "ｌｉ", "mp", "Mp", "ＭＰ", "li mp", "li song", "zz"]
+
+@pytest.fixture
+def mongomock_backend(monkeypatch):
+    """使用进程内的 mongomock 作为数据库后端"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    monkeypatch.setattr(database, "AsyncIOMotorClient", mongomock_motor.AsyncMongoMockClient)
+    monkeypatch.setattr(database, "_client", None)
+    yield
+    database.close_client()
+
+async def _search_both(queries):
+    db = MediaFileModel()
+    base_time = datetime(2024, 1, 1)
+    await db.add_media_files([
+        {
+            "chat_id": CHAT_ID,
+            "message_id": message_id,
+            "file_unique_id": f"unique{message_id}",
+            "file_name": file_name,
+            "media_type": "audio",
+            "sender_id": 1,
+            "timestamp": base_time + timedelta(minutes=message_id)
+        }
+        for message_id, file_name in enumerate(FILE_NAMES, start=1)
+    ])
+    
+    hot_index = HotIndex(db)
+    # 第一次查询在后台加载群组
+    assert hot_index.search_media_files("li", CHAT_ID) is None
+    await asyncio.gather(*hot_index._tasks)
+    
+    results = {}
+    for query in queries:
+        mongo = await db.search_media_files(query, CHAT_ID, limit=len(FILE_NAMES))
+        hot = hot_index.search_media_files(query, CHAT_ID, limit=len(FILE_NAMES))
+        results[query] = ([doc["file_name"] for doc in mongo], [doc["file_name"] for doc in hot])
+    return results
+
+def test_short_words_match_the_same_files_in_both_backends(mongomock_backend):
+    results = asyncio.run(_search_both(QUERIES))
+    
+    for query, (mongo, hot) in results.items():
+        assert mongo == hot, query
+    assert sorted(results["li"][0]) == sorted(["LIVE Show.mp3", "ｌｉｖｅ 全角.flac", "Olive.mp4", "Li Li - Song.ogg"])
+    assert results["li"] == results["LI"] == results["ｌｉ"]
+    assert sorted(results["mp"][0]) == sorted(["LIVE Show.mp3", "Olive.mp4", "ＭＰ３ 合集.zip"])
+    assert results["mp"] == results["Mp"] == results["ＭＰ"]
+    assert results["li mp"][0] == ["Olive.mp4", "LIVE Show.mp3"]
+    assert results["zz"] == ([], [])